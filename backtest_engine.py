@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+Backtest Engine — Bloop Tracker
+Vectorized stop / take-profit simulation over historical trades.
+
+Signals are loaded once into arrays sorted by time. Each trade's price window
+(signals after entry_time, up to and including exit_time) is found with
+searchsorted, and every window is laid end to end in one flat array with the
+running peak of each trade precomputed. A sweep point is then a few array
+operations over all trades at once (threshold mask, first crossing per trade)
+instead of a scan of the whole signal list per trade.
+
+When the path carries a symbol (signals with 'symbol', symbol codes in
+from_points(), bars tagged with one), points are sorted by (symbol, time)
+and each trade only searches its own symbol's block: the trades need a
+'symbol' too. Without one, the path is a single instrument.
+
+simulate() checks fixed SL, trailing stop and TP1/TP2 against that whole
+path, so a trade that crossed its stop and recovered is stopped out. The
+path is the signal stream or OHLC bars, each bar walked as four points.
+Within a point, stops come before targets, and of several stops crossed the
+highest fills: it is the first one price reaches.
+
+Prices are stored "in the trade's favour" (x = price for LONG, -price for
+SHORT): negation is exact in floating point, so the results are bit-for-bit
+those of the loops in trailing_stop_analysis.py (`--verify` checks it).
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_US = timedelta(microseconds=1)
+
+
+def epoch_us(values):
+    """ISO-8601 strings -> int64 microseconds since the epoch (naive = UTC)."""
+    out = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        out[i] = (dt - EPOCH) // ONE_US
+    return out
+
+
+def iso_from_us(values):
+    """int64 microseconds since the epoch -> UTC isoformat strings (as from_db)."""
+    return [(EPOCH + int(value) * ONE_US).isoformat() for value in values]
+
+
+def _symbol_codes(rows):
+    """(int codes, names) of the rows' 'symbol', or (None, None) when they
+    don't carry one."""
+    if not rows or 'symbol' not in rows[0]:
+        return None, None
+    code_of = {}
+    codes = np.array([code_of.setdefault(row['symbol'], len(code_of)) for row in rows], dtype=np.int64)
+    return codes, list(code_of)
+
+
+def segment_cummax(values, seg):
+    """Running max of values, restarting at every segment (seg ascending).
+
+    Works on ranks so the segments can be offset apart in exact integers:
+    one accumulate over the whole array, no per-segment loop.
+    """
+    n = len(values)
+    if not n:
+        return values.copy()
+    order = np.argsort(values, kind='stable')
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    offset = seg.astype(np.int64) * n
+    return values[order[np.maximum.accumulate(rank + offset) - offset]]
+
+
+def first_per_segment(mask, seg, n_segments):
+    """Flat index of the first True of each segment, -1 where there is none."""
+    hits = np.flatnonzero(mask)
+    first = np.full(n_segments, -1, dtype=np.int64)
+    if len(hits):
+        segs = seg[hits]
+        starts = np.concatenate(([True], segs[1:] != segs[:-1]))
+        first[segs[starts]] = hits[starts]
+    return first
+
+
+class Backtest:
+    """Trades and the price path seen during each of them, as arrays.
+
+    The path is the signal/tick stream (Backtest(trades, signals, ...)) or
+    OHLC bars (Backtest.from_bars()). Build once per data set; every
+    simulate call reuses the windows.
+    """
+
+    # What simulating needs (the rest is build-time only): see from_arrays()
+    ARRAYS = ('ids', 'side', 'entry', 'pnl', 'entry_ts', 'exit_ts', 'entry_x', 'x', 'ts', 'peak_x',
+              'unrealized', 'seg', 'final_peak_x')
+
+    def __init__(self, trades, signals, spread):
+        self._load_trades(trades, spread)
+        codes, symbols = _symbol_codes(signals)
+        self._load_points(epoch_us([s['timestamp'] for s in signals]),
+                          np.array([s['price'] for s in signals], dtype=np.float64), codes, symbols)
+
+    @classmethod
+    def from_points(cls, trades, ts, price, spread, symbol=None, symbols=None):
+        """Path from signal columns: ts (epoch µs) and price arrays, e.g. the
+        memory-mapped ones of history_cache, and optionally symbol (int codes
+        into the `symbols` names). Same result as Backtest(trades, signals)."""
+        bt = cls.__new__(cls)
+        bt._load_trades(trades, spread)
+        bt._load_points(np.asarray(ts, dtype=np.int64), np.asarray(price, dtype=np.float64),
+                        None if symbol is None else np.asarray(symbol, dtype=np.int64), symbols)
+        return bt
+
+    def _load_points(self, ts, price, codes=None, symbols=None):
+        order = np.argsort(ts, kind='stable') if codes is None else np.lexsort((ts, codes))
+        self.point_ts = ts[order]
+        self.point_price = price[order]
+        self._build_windows(*self._search(None if codes is None else codes[order], symbols,
+                                          self.entry_ts, 'right',     # first signal > entry
+                                          self.exit_ts, 'right'))     # past the last <= exit
+
+    def _search(self, codes, symbols, lo_ts, lo_side, hi_ts, hi_side):
+        """Window bounds of every trade in point_ts, within its symbol's block
+        when the points have one (codes sorted, point_ts sorted in each block)."""
+        if codes is None:
+            return (np.searchsorted(self.point_ts, lo_ts, side=lo_side),
+                    np.searchsorted(self.point_ts, hi_ts, side=hi_side))
+        if any(symbol is None for symbol in self.symbol):
+            raise ValueError('the price path is per symbol: every trade needs a symbol')
+        code_of = {name: code for code, name in enumerate(symbols)}
+        trade_code = np.array([code_of.get(symbol, -1) for symbol in self.symbol], dtype=np.int64)
+        blocks = np.searchsorted(codes, np.arange(len(symbols) + 1))
+        # Symbols with no points: empty windows
+        start = np.zeros(len(self), dtype=np.int64)
+        end = np.zeros(len(self), dtype=np.int64)
+        for code in np.unique(trade_code[trade_code >= 0]):
+            mine = trade_code == code
+            lo, hi = blocks[code], blocks[code + 1]
+            start[mine] = lo + np.searchsorted(self.point_ts[lo:hi], lo_ts[mine], side=lo_side)
+            end[mine] = lo + np.searchsorted(self.point_ts[lo:hi], hi_ts[mine], side=hi_side)
+        return start, end
+
+    @classmethod
+    def from_bars(cls, trades, bars, spread, seconds):
+        """Path from OHLC bars of `seconds` (dicts with bucket_start, open, high,
+        low, close, as /bars returns them).
+
+        Each bar is walked as 4 points: open, the nearer-looking extreme, the
+        other one, close (open -> low -> high -> close when it closed up,
+        open -> high -> low -> close when it closed down). Only bars entirely
+        inside the trade are used: the partial bars at entry and exit hold
+        prices from outside it.
+        """
+        bt = cls.__new__(cls)
+        bt._load_trades(trades, spread)
+        codes, symbols = _symbol_codes(bars)
+        starts = epoch_us([b['bucket_start'] for b in bars])
+        order = np.argsort(starts, kind='stable') if codes is None else np.lexsort((starts, codes))
+        bars = [bars[i] for i in order]
+        starts = starts[order]
+        ohlc = np.array([[b['open'], b['high'], b['low'], b['close']] for b in bars],
+                        dtype=np.float64).reshape(-1, 4)
+        o, h, l, c = ohlc.T
+        up = c >= o
+        bt.point_ts = np.repeat(starts, 4)
+        bt.point_price = np.stack([o, np.where(up, l, h), np.where(up, h, l), c], axis=1).ravel()
+        bar_us = int(seconds) * 1_000_000
+        bt._build_windows(*bt._search(None if codes is None else np.repeat(codes[order], 4), symbols,
+                                      bt.entry_ts, 'left',                # bars starting >= entry
+                                      bt.exit_ts - bar_us, 'right'))      # ending <= exit
+        return bt
+
+    @classmethod
+    def from_arrays(cls, arrays, spread):
+        """Backtest over arrays already built by another instance (arrays()),
+        e.g. views of shared memory in a worker process. No copy."""
+        bt = cls.__new__(cls)
+        bt.spread = spread
+        for name in cls.ARRAYS:
+            setattr(bt, name, arrays[name])
+        bt.direction = np.where(bt.side > 0, 'LONG', 'SHORT')
+        return bt
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load_trades(self, trades, spread):
+        self.spread = spread
+        self.ids = np.array([t['id'] for t in trades], dtype=np.int64)
+        self.direction = np.array([t['direction'] for t in trades])
+        self.side = np.where(self.direction == 'LONG', 1.0, -1.0)
+        self.entry = np.array([t['entry_price'] for t in trades], dtype=np.float64)
+        self.pnl = np.array([t['pnl_points'] for t in trades], dtype=np.float64)
+        self.entry_ts = epoch_us([t['entry_time'] for t in trades])
+        self.exit_ts = epoch_us([t['exit_time'] for t in trades])
+        self.symbol = [t.get('symbol') for t in trades]
+
+    def _build_windows(self, start, end):
+        """Lay the path points start[i]:end[i] of every trade end to end."""
+        lengths = np.maximum(end - start, 0)
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.lengths = lengths
+        self.seg = np.repeat(np.arange(len(self)), lengths)               # trade of each flat element
+        flat = np.arange(self.offsets[-1]) - self.offsets[self.seg] + start[self.seg]
+
+        side = self.side[self.seg]
+        self.entry_x = self.entry * self.side
+        self.x = self.point_price[flat] * side
+        self.ts = self.point_ts[flat]
+        # Peak including the current price, as the loop updates it before checking
+        self.peak_x = np.maximum(segment_cummax(self.x, self.seg), self.entry_x[self.seg])
+        self.unrealized = self.peak_x - self.entry_x[self.seg]
+        # Peak at the end of each window (entry if the window is empty)
+        self.final_peak_x = self.entry_x.copy()
+        nonempty = lengths > 0
+        self.final_peak_x[nonempty] = self.peak_x[self.offsets[1:][nonempty] - 1]
+
+    def trailing_stop(self, trail_points, activation_points=0):
+        """Arrays equivalent to simulate_trailing_stop(): exit at peak - trail
+        on the first signal at or beyond it, once the peak is activation
+        points in profit."""
+        level = self.peak_x - trail_points
+        first = first_per_segment((self.unrealized >= activation_points) & (self.x <= level),
+                                  self.seg, len(self))
+        triggered = first >= 0
+        hit = first[triggered]
+
+        pnl = self.pnl.copy()
+        pnl[triggered] = level[hit] - self.entry_x[triggered]
+        peak_x = self.final_peak_x.copy()
+        peak_x[triggered] = self.peak_x[hit]
+        peak = peak_x * self.side
+        return {
+            'id': self.ids,
+            'direction': self.direction,
+            'entry_price': self.entry,
+            'original_pnl': self.pnl,
+            'new_pnl': pnl,
+            'new_pnl_net': pnl - self.spread,
+            'trail_triggered': triggered,
+            'peak_price': peak,
+            'mfe': np.abs(peak - self.entry),
+        }
+
+    # ============================================================
+    # PATH-DEPENDENT EXITS: SL, trailing stop, TP1/TP2
+    # ============================================================
+    def trail_levels(self, trail_points, activation_points=0):
+        """Trailing stop level at every path point (-inf while not armed)."""
+        if not trail_points:
+            return None
+        return np.where(self.unrealized >= activation_points, self.peak_x - trail_points, -np.inf)
+
+    def _leg(self, stop_fixed, trail, target, fill):
+        """First exit of one position leg along the path.
+
+        stop_fixed: fixed stop level per point (x space, -inf = none); trail:
+        trail_levels() or None; target: take-profit level per trade (+inf = none).
+        A point at or below the active stop exits there; at or above the
+        target, takes profit. Several stops crossed by the same point fill at
+        the highest (the first one price reaches); a stop and the target on
+        the same point (not possible with trail > 0) resolves to the stop.
+
+        Returns (exit_x or nan, reason code per trade, flat exit index or -1).
+        """
+        n = len(self)
+        if not len(self.x):
+            return np.full(n, np.nan), np.full(n, EXIT_SIGNAL, dtype=np.int8), np.full(n, -1)
+        stop = stop_fixed if trail is None else np.maximum(stop_fixed, trail)
+        never = len(self.x)
+        stop_at = first_per_segment(self.x <= stop, self.seg, n)
+        target_at = first_per_segment(self.x >= target[self.seg], self.seg, n)
+        stop_at[stop_at < 0] = never
+        target_at[target_at < 0] = never
+        by_stop = stop_at <= target_at
+        at = np.minimum(stop_at, target_at)
+        hit = at < never
+        idx = np.where(hit, at, 0)
+
+        exit_x = self.x[idx] if fill == 'price' else np.where(by_stop, stop[idx], target)
+        reason = np.where(by_stop, EXIT_STOP, EXIT_TARGET)
+        if trail is not None:
+            reason = np.where(by_stop & (trail[idx] > stop_fixed[idx]), EXIT_TRAIL, reason)
+        reason = np.where(hit, reason, EXIT_SIGNAL).astype(np.int8)
+        return np.where(hit, exit_x, np.nan), reason, np.where(hit, at, -1)
+
+    def simulate(self, sl_points=None, trail_points=None, activation_points=0, tp1_points=None,
+                 tp2_points=None, tp1_fraction=0.5, breakeven=False, fill='level', levels=None):
+        """Path-dependent exits of every trade.
+
+        sl_points: fixed stop loss from entry; trail_points / activation_points:
+        trailing stop as in trailing_stop(); tp1_points: take tp1_fraction of
+        the position off there, the rest runs to tp2_points (or to the stops
+        / the original exit), with the stop moved to entry once TP1 is hit
+        when breakeven=True. Without tp1_points, tp2_points closes it all.
+        fill: 'level' fills stops and targets at their level, 'price' at the
+        path point that crossed it (gaps fill worse, like the live server
+        closing at the tick price). levels: trail_levels() already computed
+        for these trail/activation points, to reuse across calls.
+
+        Trades that hit nothing keep their original exit. new_pnl is the
+        fraction-weighted P&L of the legs.
+        """
+        n = len(self)
+        trail = self.trail_levels(trail_points, activation_points) if levels is None else levels
+        sl_x = self.entry_x - sl_points if sl_points else np.full(n, -np.inf)
+        stop_fixed = sl_x[self.seg]
+        no_target = np.full(n, np.inf)
+
+        legs = []
+        if tp1_points:
+            tp1_x = self.entry_x + tp1_points
+            exit1, reason1, at1 = self._leg(stop_fixed, trail, tp1_x, fill)
+            if breakeven:
+                after_tp1 = (reason1 == EXIT_TARGET)[self.seg] & (np.arange(len(self.x)) > at1[self.seg])
+                stop_fixed = np.where(after_tp1, np.maximum(stop_fixed, self.entry_x[self.seg]), stop_fixed)
+            legs.append((tp1_fraction, exit1, np.where(reason1 == EXIT_TARGET, EXIT_TP1, reason1), at1))
+        tp2_x = self.entry_x + tp2_points if tp2_points else no_target
+        exit2, reason2, at2 = self._leg(stop_fixed, trail, tp2_x, fill)
+        legs.append((1 - tp1_fraction if tp1_points else 1.0, exit2,
+                     np.where(reason2 == EXIT_TARGET, EXIT_TP2, reason2), at2))
+
+        pnls = [np.where(np.isnan(exit_x), self.pnl, exit_x - self.entry_x) for _, exit_x, _, _ in legs]
+        pnl = pnls[0] if len(legs) == 1 else legs[0][0] * pnls[0] + legs[1][0] * pnls[1]
+        _, _, reason, at = legs[-1]
+        exit_ts = self.exit_ts.copy()
+        exit_ts[at >= 0] = self.ts[at[at >= 0]]
+        return {
+            'id': self.ids,
+            'direction': self.direction,
+            'entry_price': self.entry,
+            'original_pnl': self.pnl,
+            'new_pnl': pnl,
+            'new_pnl_net': pnl - self.spread,
+            'exit_reason': EXIT_REASONS[reason],
+            'exit_ts': exit_ts,
+            'sl_triggered': reason == EXIT_STOP,
+            'trail_triggered': reason == EXIT_TRAIL,
+            'tp1_hit': legs[0][2] == EXIT_TP1 if tp1_points else np.zeros(n, dtype=bool),
+            'tp2_hit': reason == EXIT_TP2,
+        }
+
+
+EXIT_SIGNAL, EXIT_STOP, EXIT_TRAIL, EXIT_TARGET, EXIT_TP1, EXIT_TP2 = range(6)
+EXIT_REASONS = np.array(['signal', 'fixed_sl', 'trailing_stop', 'target', 'tp1', 'tp2'])
+
+
+def to_records(result):
+    """Column arrays -> the list of dicts the loop functions return."""
+    columns = {name: values.tolist() for name, values in result.items()}
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def stats_rows(pnl):
+    """calc_stats() of trailing_stop_analysis for every row of a 2-D array of
+    net P&Ls (one row per scenario, trades in order along axis 1), unrounded.
+    Returns {stat: 1-D array}."""
+    rows, n = pnl.shape
+    if not n:
+        stats = dict.fromkeys(('trades', 'total_pnl', 'winners', 'losers', 'win_rate', 'avg_win', 'avg_loss',
+                               'expectancy', 'max_drawdown', 'best', 'worst'), np.zeros(rows))
+        return {**stats, 'profit_factor': np.full(rows, np.inf)}
+    # Sums via cumsum: left to right like sum() on a list, so the same floats
+    win = pnl > 0
+    winners = win.sum(axis=1)
+    losers = n - winners
+    win_sum = np.cumsum(np.where(win, pnl, 0.0), axis=1)[:, -1]
+    loss_sum = np.cumsum(np.where(win, 0.0, pnl), axis=1)[:, -1]
+    cumulative = np.cumsum(pnl, axis=1)
+    total = cumulative[:, -1]
+    peak = np.maximum.accumulate(np.maximum(cumulative, 0.0), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'total_pnl': total,
+            'trades': np.full(rows, n),
+            'winners': winners,
+            'losers': losers,
+            'win_rate': winners / n * 100,
+            'avg_win': np.where(winners > 0, win_sum / winners, 0.0),
+            'avg_loss': np.where(losers > 0, loss_sum / losers, 0.0),
+            'profit_factor': np.where((losers > 0) & (loss_sum != 0), np.abs(win_sum / loss_sum), np.inf),
+            'expectancy': total / n,
+            'max_drawdown': (peak - cumulative).max(axis=1),
+            'best': pnl.max(axis=1),
+            'worst': pnl.min(axis=1),
+        }
+
+
+# ============================================================
+# LIVE REPLAY (trade_engine rules over a whole signal history)
+# ============================================================
+SIGNAL_KINDS = {'PRICE_UPDATE': 1, 'LONG': 2, 'SHORT': 3}    # any other signal: 0
+
+
+def _range_reduce(ufunc, values, lo, hi):
+    """ufunc.reduce of values[lo[i]:hi[i]] for every i (non-empty, non-overlapping ranges)."""
+    if not len(lo):
+        return np.empty(0, dtype=values.dtype)
+    # In lo order, so the gaps between ranges don't span the array
+    by_lo = np.argsort(lo, kind='stable')
+    bounds = np.stack([lo[by_lo], hi[by_lo]], axis=1).ravel()
+    out = np.empty(len(lo), dtype=values.dtype)
+    out[by_lo] = ufunc.reduceat(np.append(values, values[:1]), bounds)[::2]    # hi may be len(values)
+    return out
+
+
+def _expand(lo, hi):
+    """(seg, flat) of the ranges [lo[i], hi[i]): range number and index of every element."""
+    lengths = hi - lo
+    seg = np.repeat(np.arange(len(lo)), lengths)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    return seg, np.arange(offsets[-1]) - offsets[seg] + lo[seg]
+
+
+def _fresh_prices(p, t, lo, hi):
+    """p with the stale prices of each position [lo, hi) (older than its
+    entry lo) replaced by the entry price: they don't move max/min."""
+    seg, flat = _expand(lo, hi)
+    stale = t[flat] < t[lo][seg]
+    if not stale.any():
+        return p
+    out = p.copy()
+    out[flat[stale]] = p[lo][seg[stale]]
+    return out
+
+
+def replay(key, kind, price, ts, cfg, spread):
+    """Vectorized trade_engine.replay_ledger(): the trades the live server
+    would book from a signal history, without a loop over the signals.
+
+    Arrays in arrival order: key (position key code), kind (SIGNAL_KINDS),
+    price and ts (epoch µs). cfg: TRAILING_STOP_CONFIG shape. spread: spread
+    points per key code.
+
+    Per key, LONG/SHORT signals split the history into runs between
+    reversals. A run opens at its first signal and is closed by the first
+    signal of the next one (exit 'signal'), unless a stop triggers first; then
+    the next LONG/SHORT of the run reopens it. Every run is evaluated at once,
+    one pass per stop-out. Signals older than the open position are skipped
+    (trade_engine.is_stale); a reversal older than the position it would
+    close changes the runs themselves and raises ValueError.
+
+    Returns (trades, open_positions), dicts of arrays; trades in booking
+    order. entry_index/exit_index point into the input arrays.
+    """
+    n = len(key)
+    order = np.argsort(key, kind='stable')         # per key, in arrival order
+    k, kd, p, t = key[order], kind[order], price[order], ts[order]
+    new_block = np.ones(n, dtype=bool)
+    new_block[1:] = k[1:] != k[:-1]
+    block_start = np.flatnonzero(new_block)
+    block_end = np.append(block_start[1:], n)[:len(block_start)]     # n = 0: no blocks
+    end_of = np.repeat(block_end, block_end - block_start)                # end of each signal's key
+
+    # Runs: LONG/SHORT signals of one key in a row with the same direction
+    d = np.flatnonzero(kd >= SIGNAL_KINDS['LONG'])
+    d_side = kd[d]
+    change = np.ones(len(d), dtype=bool)
+    change[1:] = (k[d[1:]] != k[d[:-1]]) | (d_side[1:] != d_side[:-1])
+    run_start = d[change]
+    # Ended by the next run of the same key (a reversal), else open to the key's last signal
+    reversal = np.zeros(len(run_start), dtype=bool)
+    reversal[:-1] = k[run_start[1:]] == k[run_start[:-1]]
+    run_end = end_of[run_start]
+    run_end[:-1] = np.where(reversal[:-1], run_start[1:], run_end[:-1])
+
+    on = cfg['enabled']
+    sl = cfg['fixed_sl_points'] if on and cfg['fixed_sl_points'] > 0 else None
+    trail = cfg['trail_points'] if on and cfg['trail_points'] > 0 else None
+    act = cfg['activation_points']
+    if trail is not None:
+        by_price = np.argsort(p, kind='stable')
+        rank = np.empty(n, dtype=np.int64)
+        rank[by_price] = np.arange(n)
+
+    opens, exits, reasons, left_open = [], [], [], []
+    o, e, rev = run_start, run_end, reversal
+    while len(o):
+        first = np.full(len(o), -1)
+        if sl is not None or trail is not None:
+            # Signals after each open, up to (not including) the run's end;
+            # stale ones (older than the entry) are skipped
+            seg, flat = _expand(o + 1, e)
+            fresh = t[flat] >= t[o][seg]
+            side = np.where(kd[o] == SIGNAL_KINDS['LONG'], 1.0, -1.0)[seg]
+            entry = p[o][seg]
+            px = p[flat]
+            fixed = np.zeros(len(flat), dtype=bool)
+            if sl is not None:
+                fixed = np.where(side > 0, px - entry, entry - px) <= -sl
+            hit = fixed.copy()
+            if trail is not None:
+                # Peak (LONG) / trough (SHORT) so far, entry and this price included.
+                # As segment_cummax, on ranks: prices sorted once, reversed for SHORT
+                r_entry = rank[o][seg]
+                r = np.where(fresh, rank[flat], r_entry)
+                r = np.where(side > 0, np.maximum(r, r_entry), n - 1 - np.minimum(r, r_entry))
+                top = np.maximum.accumulate(r + seg * n) - seg * n
+                extreme = p[by_price[np.where(side > 0, top, n - 1 - top)]]
+                hit |= np.where(side > 0, (extreme - entry >= act) & (px <= extreme - trail),
+                                (entry - extreme >= act) & (px >= extreme + trail))
+            hit &= fresh & (kd[flat] > 0)         # other signal types only move the extremes
+            first = first_per_segment(hit, seg, len(o))
+
+        stopped = first >= 0
+        if stopped.any():
+            at = flat[first[stopped]]
+            opens.append(o[stopped])
+            exits.append(at)
+            reasons.append(np.where(fixed[first[stopped]], EXIT_STOP, EXIT_TRAIL))
+        closed = ~stopped & rev
+        if (t[e[closed]] < t[o[closed]]).any():
+            raise ValueError('a LONG/SHORT older than the position it would reverse '
+                             '(out-of-order signals): replay with trade_engine.replay_ledger()')
+        opens.append(o[closed])
+        exits.append(e[closed])
+        reasons.append(np.full(closed.sum(), EXIT_SIGNAL))
+        left_open.append(o[~stopped & ~rev])
+        if not stopped.any():
+            break
+        # Flat after the stop: the run's next LONG/SHORT opens again
+        j = np.searchsorted(d, at, side='right')
+        nxt = d[np.minimum(j, len(d) - 1)]
+        again = (j < len(d)) & (nxt < e[stopped])
+        o, e, rev = nxt[again], e[stopped][again], rev[stopped][again]
+
+    o = np.concatenate(opens) if opens else np.empty(0, dtype=np.int64)
+    x = np.concatenate(exits) if exits else np.empty(0, dtype=np.int64)
+    reason = np.concatenate(reasons).astype(np.int8) if reasons else np.empty(0, dtype=np.int8)
+    booked = np.argsort(order[x], kind='stable')
+    o, x, reason = o[booked], x[booked], reason[booked]
+
+    side = np.where(kd[o] == SIGNAL_KINDS['LONG'], 1.0, -1.0)
+    entry, exit_ = p[o], p[x]
+    pnl = np.where(side > 0, exit_ - entry, entry - exit_)
+    cost = np.asarray(spread, dtype=np.float64)[k[o]]
+    net = pnl - cost
+    held = _fresh_prices(p, t, o, x + 1)
+    trades = {
+        'key': k[o],
+        'side': side,
+        'entry_index': order[o],
+        'exit_index': order[x],
+        'entry_price': entry,
+        'exit_price': exit_,
+        'reason': reason,
+        'pnl_points': pnl,
+        'pnl_percent': (pnl / entry) * 100,
+        'spread_cost': cost,
+        'pnl_net_points': net,
+        'pnl_net_percent': (net / entry) * 100,
+        'duration_seconds': ((t[x] - t[o]) / 1e6).astype(np.int64),
+        'max_price': _range_reduce(np.maximum, held, o, x + 1),
+        'min_price': _range_reduce(np.minimum, held, o, x + 1),
+    }
+    still = np.sort(np.concatenate(left_open)) if left_open else np.empty(0, dtype=np.int64)
+    held = _fresh_prices(p, t, still, end_of[still])
+    open_positions = {
+        'key': k[still],
+        'side': np.where(kd[still] == SIGNAL_KINDS['LONG'], 1.0, -1.0),
+        'entry_index': order[still],
+        'entry_price': p[still],
+        'max_price': _range_reduce(np.maximum, held, still, end_of[still]),
+        'min_price': _range_reduce(np.minimum, held, still, end_of[still]),
+    }
+    return trades, open_positions
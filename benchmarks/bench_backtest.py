@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Backtest Engine Benchmark — Bloop Tracker
+Loops vs backtest_engine on synthetic history, with an exact-match check.
+
+Generates a random-walk tick series (one PRICE_UPDATE a minute, with LONG/SHORT
+signals sharing some of the timestamps) and back-to-back trades over it, then
+runs trailing_stop_analysis.verify(): every sweep point through the loop
+reference and through the engine, field by field.
+
+    python benchmarks/bench_backtest.py --trades 233 --signals 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+
+def synthetic_history(n_trades, n_signals, seed):
+    """(trades, signals) shaped like load_trades()/load_signals()."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 5, 14, 30, tzinfo=timezone.utc)
+    price = 21500.0
+    signals = []
+    for i in range(n_signals):
+        price = round(price + rng.gauss(0, 6) * 4) / 4      # USTEC ticks of 0.25
+        signals.append({'timestamp': (start + timedelta(minutes=i)).isoformat(),
+                        'signal': 'PRICE_UPDATE', 'price': price})
+
+    cuts = sorted(rng.sample(range(1, n_signals - 1), 2 * n_trades))
+    trades = []
+    for n, (i, j) in enumerate(zip(cuts[::2], cuts[1::2]), 1):
+        direction = rng.choice(('LONG', 'SHORT'))
+        entry, exit_ = signals[i], signals[j]
+        # The entry/exit signal itself, at the same timestamp as the tick
+        for s in (entry, exit_):
+            signals.append({'timestamp': s['timestamp'], 'signal': direction, 'price': s['price']})
+        pnl = (exit_['price'] - entry['price']) * (1 if direction == 'LONG' else -1)
+        trades.append({
+            'id': n,
+            'direction': direction,
+            'entry_price': entry['price'],
+            'exit_price': exit_['price'],
+            'pnl_points': pnl,
+            'pnl_net': pnl - 0.9,
+            'duration_s': (j - i) * 60,
+            'entry_time': entry['timestamp'],
+            'exit_time': exit_['timestamp'],
+        })
+    signals.sort(key=lambda s: s['timestamp'])
+    return trades, signals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--trades', type=int, default=233)
+    parser.add_argument('--signals', type=int, default=20000, help='PRICE_UPDATE ticks (one a minute)')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    import trailing_stop_analysis as tsa
+    trades, signals = synthetic_history(args.trades, args.signals, args.seed)
+    print(f"  {len(trades)} trades, {len(signals)} signals (seed {args.seed})")
+    sys.exit(0 if tsa.verify(trades, signals) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Index Benchmark — Bloop Tracker
+Query plans and timings for the hot signals/trades queries, before and after
+the SCHEMA_INDEXES created by init_db (db.py).
+
+Tables have the server's current columns and time types (db_time: integer
+microseconds on SQLite, TIMESTAMPTZ on PostgreSQL).
+
+SQLite (default): builds a scratch database with synthetic history.
+    python benchmarks/bench_indexes.py --rows 1000000
+
+PostgreSQL: set BENCH_DATABASE_URL. Everything happens in a throwaway
+`bench_indexes` schema, dropped at the end — never point it at a schema you
+care about.
+    BENCH_DATABASE_URL=postgresql://... python benchmarks/bench_indexes.py
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_DATABASE_URL = os.environ.get('BENCH_DATABASE_URL')
+if BENCH_DATABASE_URL:
+    os.environ['DATABASE_URL'] = BENCH_DATABASE_URL   # db_time: TIMESTAMPTZ columns and values
+
+from db import SCHEMA_INDEXES, create_indexes  # noqa: E402
+from db_time import TIME_TYPE, to_db  # noqa: E402
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TICK_SECONDS = 60
+
+
+def ts(i):
+    return to_db(START + timedelta(seconds=i * TICK_SECONDS))
+
+
+def connect():
+    if BENCH_DATABASE_URL:
+        import psycopg2
+        conn = psycopg2.connect(BENCH_DATABASE_URL)
+        c = conn.cursor()
+        c.execute('DROP SCHEMA IF EXISTS bench_indexes CASCADE')
+        c.execute('CREATE SCHEMA bench_indexes')
+        c.execute('SET search_path TO bench_indexes')
+        conn.commit()
+        return conn, '%s'
+    import sqlite3
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    return sqlite3.connect(path), '?'
+
+
+def populate(conn, ph, rows):
+    c = conn.cursor()
+    serial = 'SERIAL' if BENCH_DATABASE_URL else 'INTEGER'
+    # Same columns as init_db (webhook_server.py)
+    c.execute(f'''CREATE TABLE signals (id {serial} PRIMARY KEY, timestamp {TIME_TYPE} NOT NULL,
+                  signal TEXT NOT NULL, price REAL, symbol TEXT, timeframe TEXT, atr REAL, tp1 REAL,
+                  tp2 REAL, sl REAL, high REAL, low REAL, raw_payload TEXT,
+                  strategy TEXT NOT NULL DEFAULT 'default', created_at TEXT)''')
+    c.execute(f'''CREATE TABLE trades (id {serial} PRIMARY KEY, symbol TEXT, direction TEXT,
+                  entry_time {TIME_TYPE}, entry_price REAL, entry_atr REAL, entry_tp1 REAL,
+                  entry_tp2 REAL, entry_sl REAL, exit_time {TIME_TYPE}, exit_price REAL, exit_reason TEXT,
+                  pnl_points REAL, pnl_percent REAL, spread_cost REAL, pnl_net_points REAL,
+                  pnl_net_percent REAL, duration_seconds INTEGER, max_price REAL, min_price REAL,
+                  strategy TEXT NOT NULL DEFAULT 'default')''')
+
+    rnd = random.Random(42)
+    price = 21000.0
+    chunk = []
+    trades = []
+    direction, entry_i, entry_p = None, None, None
+    insert = (f'INSERT INTO signals (timestamp, signal, price, symbol, timeframe, raw_payload, strategy) '
+              f'VALUES ({", ".join([ph] * 7)})')
+    for i in range(rows):
+        price += rnd.gauss(0, 5)
+        # ~1 entry/exit signal per 60 ticks, the rest are PRICE_UPDATE
+        if rnd.random() < 1 / 60:
+            sig = 'LONG' if direction != 'LONG' else 'SHORT'
+            if direction:
+                pnl = (price - entry_p) if direction == 'LONG' else (entry_p - price)
+                trades.append(('USTEC', direction, ts(entry_i), entry_p, ts(i), price, pnl, pnl - 0.9,
+                               'default'))
+            direction, entry_i, entry_p = sig, i, price
+        else:
+            sig = 'PRICE_UPDATE'
+        symbol = 'USTEC' if i % 10 else 'US30'
+        strategy = 'breakout' if i % 3 == 0 else 'default'
+        chunk.append((ts(i), sig, round(price, 2), symbol, '1m', '{"signal": "%s"}' % sig, strategy))
+        if len(chunk) >= 50000:
+            c.executemany(insert, chunk)
+            chunk = []
+    if chunk:
+        c.executemany(insert, chunk)
+    c.executemany(f'''INSERT INTO trades (symbol, direction, entry_time, entry_price, exit_time,
+                      exit_price, pnl_points, pnl_net_points, strategy) VALUES ({", ".join([ph] * 9)})''', trades)
+    conn.commit()
+    c.execute('ANALYZE')
+    conn.commit()
+    return len(trades)
+
+
+def queries(rows):
+    # Range bounds: last ~7 days of history and one week-long window mid-history
+    last_week = ts(max(rows - 7 * 24 * 60, 0))
+    mid_a, mid_b = ts(rows // 2), ts(rows // 2 + 7 * 24 * 60)
+    return [
+        ('/signals latest 500',
+         'SELECT id, timestamp, signal, price FROM signals ORDER BY timestamp DESC LIMIT 500', ()),
+        ('/trades latest 500',
+         'SELECT id, exit_time, pnl_points FROM trades ORDER BY exit_time DESC LIMIT 500', ()),
+        ("count signal = 'LONG'",
+         "SELECT COUNT(*) FROM signals WHERE signal = 'LONG'", ()),
+        ('backtest range (1 week)',
+         'SELECT timestamp, signal, price FROM signals WHERE timestamp > {ph} AND timestamp <= {ph} ORDER BY timestamp',
+         (mid_a, mid_b)),
+        ('entries/exits since last week',
+         "SELECT timestamp, signal, price FROM signals WHERE signal <> 'PRICE_UPDATE' AND timestamp >= {ph} ORDER BY timestamp",
+         (last_week,)),
+        ('symbol range (1 week)',
+         "SELECT timestamp, price FROM signals WHERE symbol = 'US30' AND timestamp > {ph} AND timestamp <= {ph}",
+         (mid_a, mid_b)),
+        # position_state.recover_position, for a position opened a week ago
+        ('position recovery max/min',
+         'SELECT MAX(price), MIN(price) FROM signals WHERE symbol = {ph} AND strategy = {ph} AND timestamp >= {ph}',
+         ('USTEC', 'default', last_week)),
+    ]
+
+
+def plan(conn, sql, params):
+    c = conn.cursor()
+    if BENCH_DATABASE_URL:
+        c.execute('EXPLAIN ' + sql, params)
+        return [r[0] for r in c.fetchall()]
+    c.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    return [r[-1] for r in c.fetchall()]
+
+
+def timed(conn, sql, params, repeat):
+    c = conn.cursor()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        c.execute(sql, params)
+        c.fetchall()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def run(conn, ph, rows, repeat, label):
+    results = {}
+    print(f"\n{'=' * 70}\n  {label}\n{'=' * 70}")
+    for name, sql, params in queries(rows):
+        sql = sql.format(ph=ph)
+        ms = timed(conn, sql, params, repeat)
+        results[name] = ms
+        print(f"\n  {name}: {ms:.2f} ms")
+        for line in plan(conn, sql, params):
+            print(f"      {line}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1_000_000, help='signals to generate')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per query (median)')
+    args = parser.parse_args()
+
+    conn, ph = connect()
+    t0 = time.perf_counter()
+    n_trades = populate(conn, ph, args.rows)
+    backend = 'PostgreSQL' if BENCH_DATABASE_URL else 'SQLite'
+    print(f"  {backend}: {args.rows:,} signals, {n_trades:,} trades generated in {time.perf_counter() - t0:.1f}s")
+
+    before = run(conn, ph, args.rows, args.repeat, 'BEFORE (no secondary indexes)')
+
+    t0 = time.perf_counter()
+    create_indexes(conn)
+    c = conn.cursor()
+    c.execute('ANALYZE')
+    conn.commit()
+    print(f"\n  Built {len(SCHEMA_INDEXES)} indexes in {time.perf_counter() - t0:.1f}s")
+
+    after = run(conn, ph, args.rows, args.repeat, 'AFTER (SCHEMA_INDEXES)')
+
+    print(f"\n{'=' * 70}\n  SUMMARY (median ms)\n{'=' * 70}")
+    print(f"  {'Query':<34} {'Before':>10} {'After':>10} {'Speedup':>9}")
+    for name in before:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f"  {name:<34} {before[name]:>10.2f} {after[name]:>10.2f} {speedup:>8.1f}x")
+
+    if BENCH_DATABASE_URL:
+        c.execute('DROP SCHEMA bench_indexes CASCADE')
+        conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
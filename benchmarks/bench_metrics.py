@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Metrics Overhead Benchmark — Bloop Tracker
+What the /metrics instrumentation costs on the webhook path.
+
+1. Recording primitives: ns per inc(), observe() and timer() block.
+2. Full /webhook requests through the Flask test client on a scratch SQLite
+   database, with recording on and off (METRICS.enabled toggled in the
+   same process, rounds interleaved so drift hits both sides equally).
+3. One /metrics render with every worker file of a realistic registry.
+
+    python benchmarks/bench_metrics.py --requests 2000 --rounds 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+
+def ns_per_call(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e9
+
+
+def bench_primitives(metrics, n):
+    from metrics import DB_DURATION, SIGNALS
+    registry = metrics.METRICS
+
+    def timed_block():
+        with registry.timer(DB_DURATION, op='bench'):
+            pass
+
+    def baseline():
+        pass
+
+    base = ns_per_call(baseline, n)
+    print(f"\n{'=' * 70}\n  RECORDING ({n:,} calls each, empty-call baseline subtracted)\n{'=' * 70}")
+    for label, fn in (('inc(signal=...)', lambda: registry.inc(SIGNALS, signal='PRICE_UPDATE')),
+                      ('observe(op=...)', lambda: registry.observe(DB_DURATION, 0.0004, op='bench')),
+                      ('timer() block', timed_block)):
+        print(f"  {label:<20} {ns_per_call(fn, n) - base:>8,.0f} ns")
+
+
+def bench_requests(ws, metrics, requests, rounds):
+    client = ws.app.test_client()
+    prices = [21500 + (i % 40) for i in range(requests)]
+
+    def run():
+        t0 = time.perf_counter()
+        for i, price in enumerate(prices):
+            sig = 'LONG' if i % 50 == 0 else 'PRICE_UPDATE'
+            client.post('/webhook', json={'secret': 'bench', 'signal': sig, 'price': price,
+                                          'sent_at': time.time()})
+        return (time.perf_counter() - t0) / requests * 1e6
+
+    samples = {True: [], False: []}
+    run()   # warm-up: pool, position load, code paths
+    for _ in range(rounds):
+        for enabled in (True, False):
+            metrics.METRICS.enabled = enabled
+            samples[enabled].append(run())
+    metrics.METRICS.enabled = True
+
+    on, off = statistics.median(samples[True]), statistics.median(samples[False])
+    ops = sorted(line.split('"')[1] for line in metrics.METRICS.render().splitlines()
+                 if line.startswith('bloop_db_operation_duration_seconds_count'))
+    print(f"\n{'=' * 70}\n  /webhook ({requests:,} requests x {rounds} rounds, median µs per request)\n{'=' * 70}")
+    print(f"  metrics off   {off:>9,.1f} µs")
+    print(f"  metrics on    {on:>9,.1f} µs")
+    print(f"  overhead      {on - off:>9,.1f} µs ({(on - off) / off * 100:+.1f}%)  "
+          f"\n  DB ops timed: {', '.join(ops)}")
+
+
+def bench_render(metrics, workers):
+    registry = metrics.METRICS
+    registry.write()
+    directory = registry.config['dir']
+    own = registry._path()
+    # Pretend `workers` processes wrote the same samples
+    for i in range(workers - 1):
+        with open(own) as src, open(os.path.join(directory, f'9{i:04d}-bench.json'), 'w') as dst:
+            dst.write(src.read())
+    t0 = time.perf_counter()
+    body = registry.render()
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"\n{'=' * 70}\n  /metrics render ({workers} worker files)\n{'=' * 70}")
+    print(f"  {len(body.splitlines()):,} lines, {len(body):,} bytes in {ms:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=2000, help='/webhook requests per round')
+    parser.add_argument('--rounds', type=int, default=5, help='interleaved on/off rounds (median)')
+    parser.add_argument('--calls', type=int, default=200_000, help='calls per recording primitive')
+    parser.add_argument('--workers', type=int, default=8, help='worker files for the render test')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    os.environ.update(WEBHOOK_SECRET='bench', METRICS_DIR=os.path.join(scratch, 'metrics'))
+    import db
+    db.DB_PATH = os.path.join(scratch, 'bench.db')
+    import metrics
+    import webhook_server as ws
+    ws.TRAILING_STOP_CONFIG['enabled'] = True
+    ws.log_signal = lambda *a: None     # keep logging out of the timings
+
+    bench_primitives(metrics, args.calls)
+    bench_requests(ws, metrics, args.requests, args.rounds)
+    bench_render(metrics, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Ledger Replay Benchmark — Bloop Tracker
+Signals per second through backtest_engine.replay(), with an exact-match check.
+
+Generates a random walk per (symbol, strategy) key, interleaved (a PRICE_UPDATE
+most of the time, LONG/SHORT every so often), and replays it with a few stop
+configs. --verify-signals of them also go through trade_engine.replay_ledger()
+(the server's calls, one signal at a time), trade by trade.
+
+    python benchmarks/bench_replay.py --signals 2000000 --keys 6
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+CONFIGS = [
+    {'enabled': False, 'trail_points': 0, 'activation_points': 0, 'fixed_sl_points': 0},
+    {'enabled': True, 'trail_points': 20, 'activation_points': 0, 'fixed_sl_points': 0},
+    {'enabled': True, 'trail_points': 30, 'activation_points': 15, 'fixed_sl_points': 40},
+    {'enabled': True, 'trail_points': 8, 'activation_points': 0, 'fixed_sl_points': 10},
+]
+
+
+def synthetic_history(n_signals, n_keys, signal_every, seed):
+    """History columns shaped like ledger_replay.history_from_db()."""
+    from backtest_engine import SIGNAL_KINDS
+    rng = np.random.default_rng(seed)
+    key = rng.integers(0, n_keys, n_signals)
+    steps = np.round(rng.normal(0, 6, n_signals) * 4) / 4              # USTEC ticks of 0.25
+    price = np.empty(n_signals)
+    for k in range(n_keys):
+        mine = key == k
+        price[mine] = 21500.0 + np.cumsum(steps[mine])
+    kind = np.full(n_signals, SIGNAL_KINDS['PRICE_UPDATE'], dtype=np.int8)
+    directional = rng.random(n_signals) < 1 / signal_every
+    kind[directional] = rng.choice([SIGNAL_KINDS['LONG'], SIGNAL_KINDS['SHORT']], directional.sum())
+    names = np.empty(max(SIGNAL_KINDS.values()) + 1, dtype=object)
+    for name, code in SIGNAL_KINDS.items():
+        names[code] = name
+    return {
+        'key': key,
+        'keys': [('USTEC', f'strategy{k}') for k in range(n_keys)],
+        'kind': kind,
+        'signal': names[kind],
+        'price': price,
+        'ts': 1_767_623_400_000_000 + np.arange(n_signals, dtype=np.int64) * 1_000_000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--signals', type=int, default=2_000_000)
+    parser.add_argument('--keys', type=int, default=6, help='(symbol, strategy) positions')
+    parser.add_argument('--signal-every', type=int, default=60, help='one LONG/SHORT per N signals on average')
+    parser.add_argument('--verify-signals', type=int, default=200_000, help='0 = no check against the loop')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    import ledger_replay as lr
+    history = synthetic_history(args.signals, args.keys, args.signal_every, args.seed)
+    spreads = {'USTEC': 0.9}
+    print(f"  {args.signals:,} signals, {args.keys} keys (seed {args.seed})")
+    ok = True
+    for cfg in CONFIGS:
+        lr.run(history, cfg, spreads)                                   # warm-up
+        t0 = time.perf_counter()
+        trades, still_open, _ = lr.run(history, cfg, spreads)
+        seconds = time.perf_counter() - t0
+        label = (f"trail={cfg['trail_points']} activ={cfg['activation_points']} sl={cfg['fixed_sl_points']}"
+                 if cfg['enabled'] else 'stops off')
+        print(f"\n  {label:<28} {seconds * 1000:8.1f} ms  {args.signals / seconds:>13,.0f} signals/s  "
+              f"{len(trades['key']):,} trades")
+        if args.verify_signals:
+            head = {name: (values[:args.verify_signals] if name != 'keys' else values)
+                    for name, values in history.items()}
+            part, _, _ = lr.run(head, cfg, spreads)
+            ok = lr.verify(head, cfg, spreads, lr.ledger_records(part, head, cfg)) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
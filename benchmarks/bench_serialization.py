@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Serialization Benchmark — Bloop Tracker
+Bytes on the wire and ms per request for /trades and /signals pages:
+stdlib json vs orjson, row vs columnar layout, identity vs gzip/deflate.
+
+Encoder-level by default (synthetic 10k-row pages, no database):
+    python benchmarks/bench_serialization.py --rows 10000
+
+--http also runs full requests through the Flask test client against a
+scratch SQLite database (auth, query, serialization, compression):
+    python benchmarks/bench_serialization.py --http
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization  # noqa: E402
+
+TRADE_FIELDS = ['id', 'symbol', 'direction', 'entry_time', 'entry_price',
+                'entry_atr', 'entry_tp1', 'entry_tp2', 'entry_sl',
+                'exit_time', 'exit_price', 'exit_reason',
+                'pnl_points', 'pnl_percent',
+                'spread_cost', 'pnl_net_points', 'pnl_net_percent',
+                'duration_seconds', 'max_price', 'min_price']
+SIGNAL_FIELDS = ['id', 'timestamp', 'signal', 'price', 'symbol', 'timeframe',
+                 'atr', 'tp1', 'tp2', 'sl', 'high', 'low']
+
+
+def synthetic_rows(fields, n, rnd):
+    rows = []
+    for i in range(n):
+        row = []
+        for f in fields:
+            if f == 'id' or f == 'duration_seconds':
+                row.append(i if f == 'id' else rnd.randint(60, 20000))
+            elif f in ('entry_time', 'exit_time', 'timestamp'):
+                row.append(f'2026-02-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00+00:00')
+            elif f in ('symbol',):
+                row.append('USTEC')
+            elif f in ('direction', 'signal'):
+                row.append(rnd.choice(['LONG', 'SHORT']))
+            elif f in ('exit_reason', 'timeframe'):
+                row.append('signal' if f == 'exit_reason' else '1m')
+            else:
+                row.append(round(rnd.uniform(-50, 21500), 2))
+        rows.append(tuple(row))
+    return rows
+
+
+def median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def encoders():
+    found = [('json', None)]
+    if serialization.orjson:
+        found.append(('orjson', serialization.orjson))
+    return found
+
+
+def bench_encoders(rows_n, repeat):
+    rnd = random.Random(7)
+    print(f"\n{'=' * 78}\n  ENCODER ({rows_n:,} rows per page, median of {repeat})\n{'=' * 78}")
+    print(f"  {'Page':<9} {'Encoder':<8} {'Layout':<8} {'Encoding':<9} {'Bytes':>11} {'Encode ms':>10} {'Total ms':>9}")
+    orjson = serialization.orjson
+    try:
+        for page, fields in (('/trades', TRADE_FIELDS), ('/signals', SIGNAL_FIELDS)):
+            rows = synthetic_rows(fields, rows_n, rnd)
+            for name, module in encoders():
+                serialization.orjson = module
+                for layout in ('rows', 'columns'):
+                    if layout == 'rows':
+                        build = lambda: [dict(zip(fields, r)) for r in rows]  # noqa: E731
+                    else:
+                        build = lambda: serialization.columns(fields, rows)  # noqa: E731
+                    body = serialization.dumps(build())
+                    encode_ms = median_ms(lambda: serialization.dumps(build()), repeat)
+                    for encoding in (None, 'gzip', 'deflate'):
+                        if encoding:
+                            size = len(serialization.compress(body, encoding))
+                            comp_ms = median_ms(lambda: serialization.compress(body, encoding), repeat)
+                        else:
+                            size, comp_ms = len(body), 0.0
+                        print(f"  {page:<9} {name:<8} {layout:<8} {encoding or 'identity':<9} "
+                              f"{size:>11,} {encode_ms:>10.2f} {encode_ms + comp_ms:>9.2f}")
+    finally:
+        serialization.orjson = orjson
+
+
+def bench_http(rows_n, repeat):
+    import db
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.setdefault('WEBHOOK_SECRET', 'bench')
+    import webhook_server
+
+    rnd = random.Random(11)
+    ticks, price = [], 21000.0
+    for i in range(rows_n):
+        price += rnd.gauss(0, 5)
+        sig = 'PRICE_UPDATE' if i % 40 else ('LONG' if (i // 40) % 2 else 'SHORT')
+        ticks.append({'signal': sig, 'price': round(price, 2), 'timestamp': 1767225600 + i * 60})
+    client = webhook_server.app.test_client()
+    secret = os.environ['WEBHOOK_SECRET']
+    for i in range(0, len(ticks), webhook_server.BATCH_MAX_TICKS):
+        client.post('/webhook/batch', json={'secret': secret, 'ticks': ticks[i:i + webhook_server.BATCH_MAX_TICKS]})
+
+    # No cache: measure the full render path every time
+    webhook_server.RESPONSE_CACHE.max_entries = 0
+
+    print(f"\n{'=' * 78}\n  HTTP (Flask test client, {rows_n:,} signals in SQLite, median of {repeat})\n{'=' * 78}")
+    print(f"  {'Request':<32} {'Encoder':<8} {'Encoding':<9} {'Bytes':>11} {'ms':>9}")
+    orjson = serialization.orjson
+    try:
+        for path in ('/trades', '/trades?format=columns', '/signals', '/signals?format=columns'):
+            for name, module in encoders():
+                serialization.orjson = module
+                for encoding in (None, 'gzip'):
+                    headers = {'X-Webhook-Secret': secret}
+                    if encoding:
+                        headers['Accept-Encoding'] = encoding
+                    size = len(client.get(path, headers=headers).data)
+                    ms = median_ms(lambda: client.get(path, headers=headers).data, repeat)
+                    print(f"  {path:<32} {name:<8} {encoding or 'identity':<9} {size:>11,} {ms:>9.2f}")
+    finally:
+        serialization.orjson = orjson
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10_000, help='rows per page / signals to load')
+    parser.add_argument('--repeat', type=int, default=7, help='timed runs (median)')
+    parser.add_argument('--http', action='store_true', help='also benchmark full requests')
+    args = parser.parse_args()
+
+    print(f"  orjson: {'available' if serialization.orjson else 'not installed (stdlib json only)'}")
+    bench_encoders(args.rows, args.repeat)
+    if args.http:
+        bench_http(args.rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
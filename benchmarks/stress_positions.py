@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Position Stress Test — Bloop Tracker
+Thousands of concurrent signals through N worker processes sharing one
+database, then a check of the resulting trades ledger.
+
+Each worker process imports the app, like a gunicorn worker, and runs
+--threads client threads. The threads post to /webhook and /webhook/batch
+through the Flask test client. Signals are spread over --keys
+(symbol, strategy) keys, so every key gets signals from many threads and
+processes at once.
+
+Check: the signals of each key are applied in id order, because the key's
+lock is held from insert to commit. Each key's signals are replayed in that
+order, one process, on a scratch SQLite database. The replay's trades
+(times, prices, exit reason, extremes) and open positions must equal the
+ledger. The /stats counters must equal a rebuild from the tables.
+
+    python benchmarks/stress_positions.py --workers 4 --threads 8 --signals 4000
+    python benchmarks/stress_positions.py --mode local    # no DB locks: expect a broken ledger
+
+PostgreSQL: set BENCH_DATABASE_URL. Its tables are reset. The replay always
+runs on SQLite.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = 'stress'
+TRAILING = {'enabled': True, 'trail_points': 6, 'activation_points': 2, 'fixed_sl_points': 10}
+TRADE_FIELDS = ['symbol', 'strategy', 'direction', 'entry_time', 'entry_price', 'exit_time',
+                'exit_price', 'exit_reason', 'max_price', 'min_price']
+
+
+def load_app(env):
+    """Import the server in this (child) process against env's database."""
+    os.environ.update(env)
+    os.environ['WEBHOOK_SECRET'] = SECRET
+    os.environ['INGEST_MODE'] = 'sync'
+    sys.path.insert(0, HERE)
+    import db
+    if env.get('SQLITE_PATH'):
+        db.DB_PATH = env['SQLITE_PATH']
+    import webhook_server
+    webhook_server.TRAILING_STOP_CONFIG.update(TRAILING)
+    return webhook_server
+
+
+def keys_for(n):
+    symbols = ['USTEC', 'US30', 'GER40', 'UK100', 'JP225', 'XAUUSD']
+    return [(symbols[i % len(symbols)], f's{i // len(symbols)}') for i in range(n)]
+
+
+def worker(env, worker_id, threads, per_thread, keys, results):
+    ws = load_app(env)
+    errors, posted = [], [0]
+    lock = threading.Lock()
+
+    def client_thread(seed):
+        rnd = random.Random(seed)
+        client = ws.app.test_client()
+        price = {key: 100.0 for key in keys}
+        sent = 0
+        while sent < per_thread:
+            key = rnd.choice(keys)
+            price[key] = round(price[key] + rnd.gauss(0, 3), 2)
+            if rnd.random() < 0.1 and per_thread - sent >= 5:
+                ticks = []
+                for _ in range(5):
+                    price[key] = round(price[key] + rnd.gauss(0, 3), 2)
+                    ticks.append({'signal': rnd.choice(['PRICE_UPDATE'] * 3 + ['LONG', 'SHORT']),
+                                  'price': price[key]})
+                r = client.post('/webhook/batch', json={'secret': SECRET, 'symbol': key[0],
+                                                       'strategy': key[1], 'ticks': ticks})
+                n = len(ticks)
+            else:
+                sig = 'PRICE_UPDATE' if rnd.random() < 0.8 else rnd.choice(['LONG', 'SHORT'])
+                r = client.post('/webhook', json={'secret': SECRET, 'signal': sig, 'price': price[key],
+                                                 'symbol': key[0], 'strategy': key[1]})
+                n = 1
+            with lock:
+                if r.status_code == 200:
+                    posted[0] += n
+                else:
+                    errors.append(r.status_code)
+            sent += n
+
+    pool = [threading.Thread(target=client_thread, args=(worker_id * 1000 + t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put({'worker': worker_id, 'posted': posted[0], 'errors': errors})
+
+
+def read_ledger(env, results):
+    """Signals per key (id order), trades, open positions and the stats check."""
+    ws = load_app(env)
+    from db_time import from_db
+    from position_state import read_open_positions
+    from stats_summary import read_summary, rebuild_summary
+    with ws.db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT symbol, strategy, timestamp, signal, price FROM signals ORDER BY id')
+        signals = {}
+        for symbol, strategy, ts, sig, price in c.fetchall():
+            signals.setdefault(f'{symbol}|{strategy}', []).append(
+                {'timestamp': from_db(ts), 'signal': sig, 'price': price})
+        c.execute(f'SELECT {", ".join(TRADE_FIELDS)} FROM trades ORDER BY id')
+        trades = [dict(zip(TRADE_FIELDS, r)) for r in c.fetchall()]
+        for t in trades:
+            t['entry_time'], t['exit_time'] = from_db(t['entry_time']), from_db(t['exit_time'])
+        positions = {'|'.join(k): v for k, v in read_open_positions(conn).items()}
+        keys = [tuple(k.split('|')) for k in signals]
+        before = [read_summary(conn)] + [read_summary(conn, *k) for k in keys]
+        rebuild_summary(conn)
+        after = [read_summary(conn)] + [read_summary(conn, *k) for k in keys]
+        conn.rollback()
+    results.put({'signals': signals, 'trades': trades, 'positions': positions,
+                 'stats_ok': before == after})
+
+
+def replay(signals, results):
+    """Apply every key's signals serially on a scratch SQLite database."""
+    ws = load_app({'SQLITE_PATH': os.path.join(tempfile.mkdtemp(), 'replay.db'),
+                   'POSITION_MODE': 'local'})
+    client = ws.app.test_client()
+    for key, sigs in signals.items():
+        symbol, strategy = key.split('|')
+        for i in range(0, len(sigs), ws.BATCH_MAX_TICKS):
+            r = client.post('/webhook/batch', json={'secret': SECRET, 'symbol': symbol, 'strategy': strategy,
+                                                   'ticks': sigs[i:i + ws.BATCH_MAX_TICKS]})
+            assert r.status_code == 200, r.get_json()
+    with ws.db_connection() as conn:
+        c = conn.cursor()
+        c.execute(f'SELECT {", ".join(TRADE_FIELDS)} FROM trades ORDER BY id')
+        trades = [dict(zip(TRADE_FIELDS, r)) for r in c.fetchall()]
+        from db_time import from_db
+        from position_state import read_open_positions
+        for t in trades:
+            t['entry_time'], t['exit_time'] = from_db(t['entry_time']), from_db(t['exit_time'])
+        positions = {'|'.join(k): v for k, v in read_open_positions(conn).items()}
+    results.put({'trades': trades, 'positions': positions})
+
+
+def run_child(ctx, target, *args):
+    results = ctx.Queue()
+    p = ctx.Process(target=target, args=args + (results,))
+    p.start()
+    out = results.get()
+    p.join()
+    return out
+
+
+def by_key(trades):
+    grouped = {}
+    for t in trades:
+        grouped.setdefault(f"{t['symbol']}|{t['strategy']}", []).append(t)
+    return grouped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=4, help='worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='client threads per worker')
+    parser.add_argument('--signals', type=int, default=4000, help='signals in total')
+    parser.add_argument('--keys', type=int, default=6, help='(symbol, strategy) keys')
+    parser.add_argument('--mode', choices=['shared', 'local'], default='shared', help='POSITION_MODE')
+    args = parser.parse_args()
+
+    env = {'POSITION_MODE': args.mode, 'POSITION_FLUSH_INTERVAL': '0'}
+    if os.environ.get('BENCH_DATABASE_URL'):
+        env['DATABASE_URL'] = os.environ['BENCH_DATABASE_URL']
+        target = 'PostgreSQL'
+    else:
+        env['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'stress.db')
+        target = env['SQLITE_PATH']
+
+    ctx = multiprocessing.get_context('fork')
+    keys = keys_for(args.keys)
+    # Fresh tables: init_db runs on import, then /reset
+    run_child(ctx, reset_tables, env)
+
+    per_thread = max(1, args.signals // (args.workers * args.threads))
+    print(f"\n{'=' * 70}\n  STRESS: {args.workers} workers x {args.threads} threads x {per_thread} signals, "
+          f"{len(keys)} keys, POSITION_MODE={args.mode}\n  {target}\n{'=' * 70}")
+    results = ctx.Queue()
+    started = time.perf_counter()
+    procs = [ctx.Process(target=worker, args=(env, w, args.threads, per_thread, keys, results))
+             for w in range(args.workers)]
+    for p in procs:
+        p.start()
+    reports = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    posted = sum(r['posted'] for r in reports)
+    errors = [e for r in reports for e in r['errors']]
+    print(f"  {posted:,} signals applied in {elapsed:.1f}s ({posted / elapsed:,.0f}/s), "
+          f"{len(errors)} failed requests {sorted(set(errors)) or ''}")
+
+    ledger = run_child(ctx, read_ledger, env)
+    reference = run_child(ctx, replay, ledger['signals'])
+    got, want = by_key(ledger['trades']), by_key(reference['trades'])
+    bad = [k for k in sorted(set(got) | set(want)) if got.get(k) != want.get(k)]
+    print(f"  trades: {len(ledger['trades'])} in ledger, {len(reference['trades'])} in serial replay")
+    for k in sorted(ledger['signals']):
+        mark = 'MISMATCH' if k in bad else 'ok'
+        print(f"    {k:<14} {len(ledger['signals'][k]):>6} signals {len(got.get(k, [])):>5} trades  {mark}")
+    positions_ok = ledger['positions'] == reference['positions']
+    print(f"  open positions match replay: {positions_ok}")
+    print(f"  /stats counters match rebuild: {ledger['stats_ok']}")
+    ok = not bad and positions_ok and ledger['stats_ok'] and not errors
+    print(f"\n  {'PASS' if ok else 'FAIL'}")
+    sys.exit(0 if ok else 1)
+
+
+def reset_tables(env, results):
+    ws = load_app(env)
+    r = ws.app.test_client().post('/reset', headers={'X-Webhook-Secret': SECRET})
+    results.put(r.status_code)
+
+
+if __name__ == '__main__':
+    main()
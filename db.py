@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Database layer — Bloop Tracker
+Connection config and pooling shared by webhook_server (and any script that
+needs the same database).
+
+PostgreSQL: bounded pool, safe across gunicorn forks (connections inherited
+from a parent process are dropped, never reused), with health checks on idle
+connections and recycling of old ones.
+SQLite: one connection per thread, reused across requests.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRICS, POOL_CHECKOUT, POOL_CONNECT
+
+DATABASE_URL = os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_PUBLIC_URL')
+
+if DATABASE_URL:
+    import psycopg2
+    import psycopg2.extensions
+    USE_POSTGRES = True
+else:
+    import sqlite3
+    USE_POSTGRES = False
+    DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signals.db')
+
+# ============================================================
+# POOL CONFIG (override via env)
+# ============================================================
+POOL_CONFIG = {
+    'max_size': int(os.environ.get('DB_POOL_MAX', 10)),
+    'checkout_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),            # seconds waiting for a free connection
+    'max_age': float(os.environ.get('DB_POOL_MAX_AGE', 1800)),                   # recycle connections older than this
+    'health_check_idle': float(os.environ.get('DB_POOL_HEALTHCHECK_IDLE', 30)),  # ping before reuse if idle longer
+}
+
+
+class PoolTimeout(Exception):
+    """No connection became available within checkout_timeout."""
+
+
+def is_transient_error(exc):
+    """Would the same transaction likely succeed if retried? Lock contention,
+    deadlock / serialization failure, a dropped connection, pool exhausted.
+    Anything else points at the data or the code."""
+    if isinstance(exc, PoolTimeout):
+        return True
+    if USE_POSTGRES:
+        return isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError,
+                                psycopg2.extensions.TransactionRollbackError))
+    return isinstance(exc, sqlite3.OperationalError) and any(
+        word in str(exc) for word in ('locked', 'busy', 'disk I/O'))
+
+
+@METRICS.timed(POOL_CONNECT)
+def get_db_connection():
+    """Open a new, unpooled connection. Use db_connection() in request code."""
+    if USE_POSTGRES:
+        return psycopg2.connect(DATABASE_URL)
+    else:
+        return sqlite3.connect(DB_PATH)
+
+
+class PoolMetrics:
+    """Counters and checkout latency for one pool (per process)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.waits = 0              # checkouts that had to wait for a free connection
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0           # closed for age
+        self.health_check_failures = 0
+        self.discarded = 0          # closed because broken / failed rollback
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+
+    def record_checkout(self, elapsed, waited):
+        METRICS.observe(POOL_CHECKOUT, elapsed)
+        with self._lock:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+            self.checkout_time_total += elapsed
+            if elapsed > self.checkout_time_max:
+                self.checkout_time_max = elapsed
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            avg = self.checkout_time_total / self.checkouts if self.checkouts else 0.0
+            return {
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'recycled': self.recycled,
+                'health_check_failures': self.health_check_failures,
+                'discarded': self.discarded,
+                'checkout_ms_avg': round(avg * 1000, 3),
+                'checkout_ms_max': round(self.checkout_time_max * 1000, 3),
+            }
+
+
+class _Entry:
+    __slots__ = ('conn', 'created_at', 'last_used', 'pid')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+        self.pid = os.getpid()
+
+
+class PostgresPool:
+    """Bounded psycopg2 pool. Blocks up to checkout_timeout when exhausted."""
+
+    def __init__(self, max_size=10, checkout_timeout=10, max_age=1800,
+                 health_check_idle=30):
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.max_age = max_age
+        self.health_check_idle = health_check_idle
+        self.metrics = PoolMetrics()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = 0
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # Called with the lock held. After a fork the sockets are shared with
+        # the parent: forget them (closing would terminate the parent's session).
+        if os.getpid() != self._pid:
+            self._idle = []
+            self._in_use = 0
+            self._pid = os.getpid()
+            self.metrics.reset()
+
+    def _usable(self, entry):
+        conn = entry.conn
+        now = time.monotonic()
+        if conn.closed:
+            self.metrics.incr('discarded')
+            return False
+        if self.max_age and now - entry.created_at > self.max_age:
+            self.metrics.incr('recycled')
+            self._close(entry)
+            return False
+        if self.health_check_idle and now - entry.last_used > self.health_check_idle:
+            try:
+                c = conn.cursor()
+                c.execute('SELECT 1')
+                c.close()
+                conn.rollback()
+            except Exception:
+                self.metrics.incr('health_check_failures')
+                self._close(entry)
+                return False
+        return True
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        start = time.perf_counter()
+        deadline = start + self.checkout_timeout
+        waited = False
+        entry = None
+        with self._cond:
+            self._check_fork()
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break  # slot reserved below, connect outside the lock
+                waited = True
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.metrics.incr('timeouts')
+                    raise PoolTimeout(f'no connection available after {self.checkout_timeout}s '
+                                      f'(max_size={self.max_size})')
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if entry is not None and not self._usable(entry):
+                entry = None
+            if entry is None:
+                entry = _Entry(get_db_connection())
+                self.metrics.incr('created')
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        self.metrics.record_checkout(time.perf_counter() - start, waited)
+        return entry
+
+    def _checkin(self, entry):
+        conn = entry.conn
+        keep = not conn.closed
+        if keep:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Never hand out a connection with an open/aborted transaction
+                try:
+                    conn.rollback()
+                except Exception:
+                    keep = False
+        if not keep:
+            self.metrics.incr('discarded')
+        elif self.max_age and time.monotonic() - entry.created_at > self.max_age:
+            self.metrics.incr('recycled')
+            keep = False
+        with self._cond:
+            if entry.pid != self._pid:
+                return  # checked out before a fork; belongs to the parent
+            self._in_use -= 1
+            if keep:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+            else:
+                self._close(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        entry = self._checkout()
+        try:
+            yield entry.conn
+        finally:
+            self._checkin(entry)
+
+    def stats(self):
+        with self._cond:
+            self._check_fork()
+            state = {'in_use': self._in_use, 'idle': len(self._idle),
+                     'max_size': self.max_size, 'pid': self._pid}
+        state.update(self.metrics.snapshot())
+        return state
+
+
+class SQLitePool:
+    """One SQLite connection per thread, reused across requests."""
+
+    def __init__(self, max_age=1800, health_check_idle=30, **_):
+        self.max_age = max_age
+        self.health_check_idle = health_check_idle
+        self.metrics = PoolMetrics()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._open = 0
+        self._pid = os.getpid()
+
+    def _get_entry(self):
+        entry = getattr(self._local, 'entry', None)
+        if entry is not None and entry.pid != os.getpid():
+            entry = self._local.entry = None  # inherited across fork
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if self.max_age and now - entry.created_at > self.max_age:
+            self.metrics.incr('recycled')
+            self._drop(entry)
+            return None
+        if self.health_check_idle and now - entry.last_used > self.health_check_idle:
+            try:
+                entry.conn.execute('SELECT 1')
+            except Exception:
+                self.metrics.incr('health_check_failures')
+                self._drop(entry)
+                return None
+        return entry
+
+    def _drop(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        self._local.entry = None
+        with self._lock:
+            self._open -= 1
+
+    @contextmanager
+    def connection(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            # Nested checkout on the same thread shares the outer connection
+            self._local.depth = depth + 1
+            try:
+                yield self._local.entry.conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        start = time.perf_counter()
+        entry = self._get_entry()
+        if entry is None:
+            entry = self._local.entry = _Entry(get_db_connection())
+            self.metrics.incr('created')
+            with self._lock:
+                self._open += 1
+        self.metrics.record_checkout(time.perf_counter() - start, False)
+
+        self._local.depth = 1
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield entry.conn
+        finally:
+            self._local.depth = 0
+            with self._lock:
+                self._in_use -= 1
+            try:
+                if entry.conn.in_transaction:
+                    entry.conn.rollback()
+                entry.last_used = time.monotonic()
+            except Exception:
+                self.metrics.incr('discarded')
+                self._drop(entry)
+
+    def stats(self):
+        with self._lock:
+            state = {'in_use': self._in_use, 'open': self._open,
+                     'max_size': None, 'pid': self._pid}
+        state.update(self.metrics.snapshot())
+        return state
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Per-process pool, created lazily (so each gunicorn worker builds its own)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                cls = PostgresPool if USE_POSTGRES else SQLitePool
+                _pool = cls(**POOL_CONFIG)
+    return _pool
+
+
+def db_connection():
+    """Check out a pooled connection: `with db_connection() as conn: ...`
+
+    Any transaction left open when the block exits is rolled back; commit
+    explicitly.
+    """
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+# ============================================================
+# SQL DIALECT HELPERS
+# ============================================================
+GREATEST = 'GREATEST' if USE_POSTGRES else 'MAX'
+LEAST = 'LEAST' if USE_POSTGRES else 'MIN'
+
+
+def q(query):
+    """Write queries with '?' placeholders; adapted to '%s' for psycopg2."""
+    return query.replace('?', '%s') if USE_POSTGRES else query
+
+
+def table_columns(conn, table):
+    """Column name -> declared type for an existing table."""
+    c = conn.cursor()
+    if USE_POSTGRES:
+        c.execute('''SELECT column_name, data_type FROM information_schema.columns
+                     WHERE table_name = %s AND table_schema = current_schema()''', (table,))
+        return {name: dtype.lower() for name, dtype in c.fetchall()}
+    c.execute(f'PRAGMA table_info({table})')
+    return {row[1]: (row[2] or '').lower() for row in c.fetchall()}
+
+
+# ============================================================
+# INDEXES (created by init_db, same DDL on PostgreSQL and SQLite)
+# ============================================================
+SCHEMA_INDEXES = [
+    # name, table (columns), partial-index predicate
+    ('idx_signals_timestamp', 'signals (timestamp)', None),                 # /signals order, range scans
+    ('idx_signals_signal_timestamp', 'signals (signal, timestamp)', None),  # LONG/SHORT counts and ranges
+    ('idx_signals_symbol_timestamp', 'signals (symbol, timestamp)', None),  # per-symbol history
+    ('idx_signals_trading_timestamp', 'signals (timestamp)',                # entries/exits only, skips ticks
+     "signal <> 'PRICE_UPDATE'"),
+    ('idx_trades_exit_time', 'trades (exit_time)', None),                   # /trades order
+]
+
+
+def create_indexes(conn):
+    """CREATE INDEX IF NOT EXISTS for SCHEMA_INDEXES. Caller commits."""
+    c = conn.cursor()
+    for name, target, where in SCHEMA_INDEXES:
+        c.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}' + (f' WHERE {where}' if where else ''))
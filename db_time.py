@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Time columns — Bloop Tracker
+Native storage for event times, ISO-8601 strings everywhere else.
+
+Stored as TIMESTAMPTZ on PostgreSQL and as integer microseconds since the
+Unix epoch (UTC) on SQLite, so ranges, ordering and arithmetic run on
+numbers instead of strings. The application and the API keep using UTC
+isoformat strings ('2026-02-10T14:00:01+00:00'): convert with to_db() on the
+way in and from_db() on the way out.
+
+migrate_time_columns() converts databases created with TEXT columns
+(ALTER ... TYPE on PostgreSQL, table rebuild on SQLite). It runs from init_db
+and is a no-op once done.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+
+from db import USE_POSTGRES, table_columns
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_US = timedelta(microseconds=1)
+
+# table -> event-time columns
+TIME_COLUMNS = {
+    'signals': ['timestamp'],
+    'trades': ['entry_time', 'exit_time'],
+    'open_position': ['entry_time'],     # legacy singleton, converted before init_db moves its row
+    'open_positions': ['entry_time'],
+    'ohlc_bars': ['bucket_start', 'first_ts', 'last_ts'],
+}
+
+TIME_TYPE = 'TIMESTAMPTZ' if USE_POSTGRES else 'INTEGER'   # for CREATE TABLE
+
+
+def parse_iso(value):
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def to_db(value):
+    """ISO-8601 string (or aware datetime) -> column value. None passes through."""
+    if value is None:
+        return None
+    dt = parse_iso(value) if isinstance(value, str) else value
+    if USE_POSTGRES:
+        return dt
+    return (dt - EPOCH) // ONE_US
+
+
+def from_db(value):
+    """Column value -> UTC isoformat string, as the TEXT columns used to hold."""
+    if value is None:
+        return None
+    if USE_POSTGRES:
+        return value.astimezone(timezone.utc).isoformat()
+    return (EPOCH + value * ONE_US).isoformat()
+
+
+def epoch_us_sql(column):
+    """SELECT expression for a time column as integer microseconds since the epoch."""
+    if USE_POSTGRES:
+        return f'ROUND(EXTRACT(EPOCH FROM {column}) * 1000000)::BIGINT'
+    return column
+
+
+def rows_from_db(rows, indexes):
+    """Convert the columns at `indexes` in every row (tuples -> lists)."""
+    if not indexes:
+        return rows
+    out = []
+    for row in rows:
+        row = list(row)
+        for i in indexes:
+            row[i] = from_db(row[i])
+        out.append(row)
+    return out
+
+
+def time_indexes(names, table):
+    return [i for i, name in enumerate(names) if name in TIME_COLUMNS[table]]
+
+
+# ============================================================
+# MIGRATION (TEXT -> native)
+# ============================================================
+def _iso_to_us(value):
+    return None if value is None else to_db(value)
+
+
+def _rebuild_sqlite_table(conn, table, cols):
+    """SQLite can't change a column type: copy into a new table, swap names."""
+    c = conn.cursor()
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    ddl = c.fetchone()[0]
+    for col in cols:
+        ddl = re.sub(rf'\b{col}\s+TEXT\b', f'{col} INTEGER', ddl)
+    ddl = re.sub(r'^CREATE TABLE\s+"?\w+"?', f'CREATE TABLE {table}__migrating', ddl)
+
+    names = list(table_columns(conn, table))
+    select = ', '.join(f'iso_to_us({n})' if n in cols else n for n in names)
+    seq = None
+    if _has_sequence(c):
+        c.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+        seq = c.fetchone()
+
+    c.execute(f'DROP TABLE IF EXISTS {table}__migrating')
+    c.execute(ddl)
+    c.execute(f'INSERT INTO {table}__migrating ({", ".join(names)}) SELECT {select} FROM {table}')
+    c.execute(f'DROP TABLE {table}')
+    c.execute(f'ALTER TABLE {table}__migrating RENAME TO {table}')
+    if seq:
+        # Keep AUTOINCREMENT from reusing ids of deleted rows
+        c.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (seq[0], table))
+
+
+def _has_sequence(c):
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'")
+    return c.fetchone() is not None
+
+
+def migrate_time_columns(conn):
+    """Convert TEXT time columns to native ones. Returns the tables migrated.
+
+    Run before creating indexes (the SQLite rebuild drops them). Caller commits.
+    """
+    migrated = []
+    c = conn.cursor()
+    if not USE_POSTGRES:
+        conn.create_function('iso_to_us', 1, _iso_to_us, deterministic=True)
+    for table, cols in TIME_COLUMNS.items():
+        existing = table_columns(conn, table)
+        todo = [col for col in cols if existing.get(col) == 'text']
+        if not todo:
+            continue
+        if USE_POSTGRES:
+            for col in todo:
+                c.execute(f'ALTER TABLE {table} ALTER COLUMN "{col}" TYPE TIMESTAMPTZ '
+                          f'USING "{col}"::timestamptz')
+        else:
+            _rebuild_sqlite_table(conn, table, todo)
+        migrated.append(table)
+    return migrated
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Event Stream — Bloop Tracker
+In-process pub/sub behind GET /stream (Server-Sent Events).
+
+The write paths publish typed events once their DB transaction has
+committed (a rolled-back signal never reaches a client):
+
+    signal            every stored signal (timestamp, signal, price, symbol, strategy)
+    position_opened   a LONG/SHORT opened a position (the position dict)
+    extremes          max/min of an open position moved (last values per transaction)
+    trade_closed      a position was booked as a trade (the trade dict)
+    config            POST /spread or POST /trailing-stop changed the settings
+    reset             POST /reset wiped the data
+
+Each event is encoded to its SSE frame once, when published; subscribers get
+a reference to it in their own bounded queue, so N dashboards cost N queue
+puts and no query. A subscriber whose queue fills up (client not reading) is
+disconnected: it reconnects with Last-Event-ID and resumes from the replay
+buffer, which holds the last STREAM_REPLAY_SIZE events.
+
+Event ids are '<process token>-<seq>'. An id from another process, from
+before a restart or older than the buffer can't be resumed: the client gets
+a `snapshot` of the open positions instead, as on a first connect.
+
+POSITION_MODE=shared on PostgreSQL: events are sent with NOTIFY inside the
+writing transaction (delivered on commit, in commit order) and a listener
+thread in every worker publishes them to its own subscribers, so a client
+sees the writes of every worker whichever one it is connected to.
+"""
+
+import json
+import logging
+import os
+import queue
+import secrets
+import select
+import threading
+import time
+from collections import deque, namedtuple
+
+from serialization import dumps
+from structured_log import log_event
+
+STREAM_CONFIG = {
+    'replay_size': int(os.environ.get('STREAM_REPLAY_SIZE', 1000)),      # events kept for Last-Event-ID
+    'queue_size': int(os.environ.get('STREAM_QUEUE_SIZE', 1000)),        # per subscriber, then disconnected
+    'max_subscribers': int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 16)),   # per worker (each holds a thread)
+    'heartbeat': float(os.environ.get('STREAM_HEARTBEAT', 15)),          # seconds between keep-alive comments
+}
+
+EVENT_TYPES = ('signal', 'position_opened', 'extremes', 'trade_closed', 'config', 'reset')
+
+NOTIFY_CHANNEL = 'bloop_events'
+NOTIFY_MAX_BYTES = 7000      # PostgreSQL caps a NOTIFY payload at 8000 bytes
+
+Event = namedtuple('Event', 'seq type key frame')
+
+
+class TooManySubscribers(Exception):
+    """max_subscribers streams already open in this process: caller answers 503."""
+
+
+def encode_frame(event_type, data, event_id=None):
+    """One SSE frame: optional id, event type, JSON data, blank line."""
+    head = f'id: {event_id}\n' if event_id else ''
+    return f'{head}event: {event_type}\ndata: '.encode() + dumps(data) + b'\n\n'
+
+
+def event_key(data):
+    """(symbol, strategy) of an event, None for global ones (config, reset)."""
+    if isinstance(data, dict) and 'symbol' in data:
+        return data['symbol'], data.get('strategy')
+    return None
+
+
+class Subscription:
+    """One connected client: its filters and its bounded queue."""
+
+    def __init__(self, queue_size, types=None, symbol=None, strategy=None):
+        self.queue = queue.Queue(queue_size)
+        self.types = set(types) if types else None
+        self.symbol = symbol
+        self.strategy = strategy
+        self.dropped = False     # queue overflowed: the stream ends, client resumes
+
+    def wants(self, event):
+        if self.types and event.type not in self.types:
+            return False
+        if event.key is None:
+            return True
+        return self.symbol in (None, event.key[0]) and self.strategy in (None, event.key[1])
+
+    def offer(self, event):
+        if self.dropped or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped = True
+
+
+class EventBus:
+    """Publish/subscribe with a replay buffer. One per worker process.
+
+    notify=True (shared mode on PostgreSQL): before_commit() sends the events
+    with NOTIFY and NotifyListener publishes them; otherwise after_commit()
+    publishes them directly.
+    """
+
+    def __init__(self, config=STREAM_CONFIG, notify=False):
+        self.config = config
+        self.notify = notify
+        self._lock = threading.Lock()
+        self._pid = None
+        self._check_fork()
+
+    def _check_fork(self):
+        # Subscribers and ids don't survive fork: each gunicorn worker starts its own sequence
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._token = secrets.token_hex(4)
+        self._seq = 0
+        self._buffer = deque(maxlen=self.config['replay_size'])
+        self._subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def before_commit(self, conn, events):
+        """Inside the writing transaction. Caller commits."""
+        if self.notify and events:
+            notify_events(conn, events)
+
+    def after_commit(self, events):
+        """Once the transaction that produced events has committed."""
+        if not self.notify and events:
+            self.publish(events)
+
+    def publish(self, events):
+        """Fan [(type, data), ...] out to the subscribers, in order."""
+        with self._lock:
+            self._check_fork()
+            for event_type, data in events:
+                self._seq += 1
+                event = Event(self._seq, event_type, event_key(data),
+                              encode_frame(event_type, data, f'{self._token}-{self._seq}'))
+                self._buffer.append(event)
+                for sub in self._subscribers:
+                    was_dropped = sub.dropped
+                    sub.offer(event)
+                    self.dropped += sub.dropped and not was_dropped
+            self.published += len(events)
+
+    def subscribe(self, last_event_id=None, **filters):
+        """Register a subscriber. Returns (subscription, replay, current_id).
+
+        replay: the buffered events after last_event_id that pass the filters,
+        or None when it can't be resumed (or wasn't given): send a snapshot.
+        current_id: id of the last event published so far.
+        """
+        with self._lock:
+            self._check_fork()
+            if len(self._subscribers) >= self.config['max_subscribers']:
+                raise TooManySubscribers(f"max {self.config['max_subscribers']} streams per worker")
+            sub = Subscription(self.config['queue_size'], **filters)
+            seq = self._resume_seq(last_event_id)
+            replay = None if seq is None else [e.frame for e in self._buffer if e.seq > seq and sub.wants(e)]
+            self._subscribers.add(sub)
+            return sub, replay, f'{self._token}-{self._seq}'
+
+    def _resume_seq(self, last_event_id):
+        token, _, seq = (last_event_id or '').partition('-')
+        if token != self._token or not seq.isdigit():
+            return None
+        seq = int(seq)
+        # Buffer holds seqs (_seq - len, _seq]: older ones are gone
+        if seq > self._seq or seq < self._seq - len(self._buffer):
+            return None
+        return seq
+
+    def resync(self):
+        """Events may have been missed (listener reconnected): forget the
+        buffer and the ids handed out, and end every stream, so clients
+        reconnect and start again from a snapshot."""
+        with self._lock:
+            self._token = secrets.token_hex(4)
+            self._buffer.clear()
+            for sub in self._subscribers:
+                sub.dropped = True
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'dropped_subscribers': self.dropped,
+            'buffered': len(self._buffer),
+            'last_id': f'{self._token}-{self._seq}',
+            'notify': self.notify,
+        }
+
+
+def stream_frames(bus, sub, first_frames, heartbeat):
+    """SSE body: first_frames (replay or snapshot), then live events.
+
+    A comment line every `heartbeat` seconds keeps proxies from closing an
+    idle stream and lets the server notice a gone client. A dropped
+    subscriber gets what its queue holds, then the stream ends and the
+    client reconnects with Last-Event-ID.
+    """
+    try:
+        yield b'retry: 3000\n\n'
+        yield from first_frames
+        while True:
+            try:
+                event = sub.queue.get(block=not sub.dropped, timeout=heartbeat)
+            except queue.Empty:
+                if sub.dropped:
+                    return    # queue drained: the client resumes after the last id it got
+                yield b': ping\n\n'
+                continue
+            yield event.frame
+    finally:
+        bus.unsubscribe(sub)
+
+
+# ============================================================
+# POSTGRESQL NOTIFY BRIDGE (POSITION_MODE=shared)
+# ============================================================
+def notify_events(conn, events):
+    """pg_notify the events in as few payloads as fit. Delivered on commit."""
+    c = conn.cursor()
+    chunk, size = [], 0
+    for event in events:
+        encoded = dumps(list(event)).decode()
+        if chunk and size + len(encoded) > NOTIFY_MAX_BYTES:
+            c.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, f"[{','.join(chunk)}]"))
+            chunk, size = [], 0
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        c.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, f"[{','.join(chunk)}]"))
+
+
+class NotifyListener:
+    """Background thread: LISTEN on a dedicated connection, publish to the bus."""
+
+    def __init__(self, bus, connect):
+        self.bus = bus
+        self.connect = connect     # () -> new psycopg2 connection (not pooled: held forever)
+        self._thread = None
+        self._pid = None
+        self.connected = False
+        self.last_error = None
+
+    def start(self):
+        """Start once per process (call after gunicorn forks)."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='event-listener', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = self.connect()
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+                if self.last_error:
+                    self.bus.resync()
+                self.connected = True
+                self.last_error = None
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.bus.publish([tuple(e) for e in json.loads(conn.notifies.pop(0).payload)])
+            except Exception as e:
+                # Events sent while disconnected are lost: resync() on reconnect
+                self.connected = False
+                self.last_error = str(e)
+                log_event('event_listener', '⚠️  Event listener: %s', e, level=logging.ERROR, error=str(e))
+                time.sleep(1)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
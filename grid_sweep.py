@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Grid Sweep — Bloop Tracker
+Stop optimization over an arbitrary parameter grid, on every core.
+
+Dimensions (any subset, each a list of values):
+
+    sl          fixed stop loss in points ('off' = none)
+    trail       trailing stop distance in points ('off' = none)
+    activation  profit in points before the trail arms (ignored when trail is off)
+    tp1         take --tp1-fraction of the position off at this profit ('off' = none)
+    tp2         take the rest (all of it without tp1) off at this profit ('off' = none)
+    hours       entry time-of-day windows, UTC ('all', '13:30-20:00', '22-2')
+    spread      spread scenario in points, charged per trade
+
+Values: '20,30,40', ranges 'start:stop:step' (stop included) or a mix
+('off,10:150:5'). From the CLI or a JSON config file with the same keys
+(lists or strings); CLI flags override the file.
+
+    python grid_sweep.py --sl off,20:200:10 --trail off,10:150:5 --activation 0:100:10 \\
+        --hours all,13:30-20:00 --spread 0.9,1.5 --out sweep.csv --out sweep.json
+    python grid_sweep.py --config grid.json --rank profit_factor --min-trades 50
+
+Exits are path-dependent (Backtest.simulate): stops and targets are checked
+at every signal price during the trade, or along OHLC bars with --bars 1m.
+Data: /tmp exports, the server's API (BLOOP_API_URL) or, with --db, its
+database through the history_cache columns. From the API or the database,
+each trade is checked against its own symbol's prices.
+
+The trades and price windows are built once (backtest_engine) and placed in
+shared memory; each worker of the process pool maps them without copying. A
+task is one (trail, activation, tp1, tp2) combination: the trail levels are
+computed once, each sl is one simulate() over all trades, and every
+sl x hours x spread scenario is a row of one array, scored together. Results
+are ranked (--rank) and written as CSV and/or JSON.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest_engine import Backtest, stats_rows
+from trailing_stop_analysis import (ACTIVATION_GRID, SL_GRID, SPREAD, TRAIL_GRID, load_bars, load_from_api,
+                                    load_from_db, load_signals, load_traded_bars, load_trades)
+
+DIMENSIONS = ('sl', 'trail', 'activation', 'tp1', 'tp2', 'hours', 'spread')
+
+DEFAULT_GRID = {
+    'sl': ['off'] + SL_GRID,
+    'trail': ['off'] + TRAIL_GRID,
+    'activation': [0] + ACTIVATION_GRID,
+    'tp1': ['off'],
+    'tp2': ['off'],
+    'hours': ['all'],
+    'spread': [SPREAD],
+}
+
+STATS = ('trades', 'total_pnl', 'win_rate', 'profit_factor', 'expectancy', 'max_drawdown',
+         'avg_win', 'avg_loss', 'best', 'worst')
+COUNTS = {'sl_triggers': 'sl_triggered', 'trail_triggers': 'trail_triggered',
+          'tp1_hits': 'tp1_hit', 'tp2_hits': 'tp2_hit'}
+COLUMNS = DIMENSIONS + STATS + tuple(COUNTS)
+LOWER_IS_BETTER = {'max_drawdown'}
+
+
+# ============================================================
+# GRID PARSING
+# ============================================================
+def parse_values(spec, dimension):
+    """'off,10:30:10,50' -> [None, 10, 20, 30, 50] (lists pass through item by item)."""
+    items = spec if isinstance(spec, list) else str(spec).split(',')
+    values = []
+    for item in items:
+        item = str(item).strip()
+        if not item:
+            continue
+        if dimension == 'hours':
+            values.append(item)
+        elif item.lower() in ('off', 'none'):
+            values.append(None)
+        elif item.count(':') == 2:
+            start, stop, step = (float(v) for v in item.split(':'))
+            values.extend(_number(v) for v in np.arange(start, stop + step / 2, step).round(6))
+        else:
+            values.append(_number(float(item)))
+    if not values:
+        raise ValueError(f"{dimension}: empty grid")
+    return list(dict.fromkeys(values))
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def minute_of_day(text):
+    hours, _, minutes = text.strip().partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def hours_mask(window, entry_ts):
+    """Trades whose entry falls in window ('all', 'HH[:MM]-HH[:MM]', may wrap midnight)."""
+    if window == 'all':
+        return np.ones(len(entry_ts), dtype=bool)
+    start, end = (minute_of_day(part) for part in window.split('-'))
+    minute = (entry_ts // 60_000_000) % 1440
+    if start <= end:
+        return (minute >= start) & (minute < end)
+    return (minute >= start) | (minute < end)
+
+
+def load_grid(args):
+    grid = dict(DEFAULT_GRID)
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown = set(config) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"unknown grid keys in {args.config}: {', '.join(sorted(unknown))}")
+        grid.update(config)
+    for dimension in DIMENSIONS:
+        if getattr(args, dimension) is not None:
+            grid[dimension] = getattr(args, dimension)
+    return {dimension: parse_values(grid[dimension], dimension) for dimension in DIMENSIONS}
+
+
+# ============================================================
+# SHARED MEMORY
+# ============================================================
+def share(arrays):
+    """Copy arrays into shared memory blocks. Returns (blocks, specs for attach())."""
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach(specs):
+    """Views of the blocks created by share(). Keep the blocks alive as long as the views."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    return blocks, arrays
+
+
+# ============================================================
+# EVALUATION
+# ============================================================
+_worker = {}
+
+
+def init_worker(specs, grid, masks, options):
+    blocks, arrays = attach(specs)
+    _worker.update(blocks=blocks, bt=Backtest.from_arrays(arrays, 0.0), grid=grid, masks=masks,
+                   options=options)
+
+
+def evaluate(task):
+    """One (trail, activation, tp1, tp2): every sl x hours x spread scenario.
+    Returns rows (tuples, COLUMNS order)."""
+    trail, activation, tp1, tp2 = task
+    bt, grid, masks = _worker['bt'], _worker['grid'], _worker['masks']
+    levels = bt.trail_levels(trail, activation)
+    results = [bt.simulate(sl, trail, activation, tp1, tp2, levels=levels, **_worker['options'])
+               for sl in grid['sl']]
+    pnl = np.vstack([r['new_pnl'] for r in results])                      # one row per sl value
+    flags = {column: np.vstack([r[key] for r in results]) for column, key in COUNTS.items()}
+
+    rows = []
+    for window, mask in zip(grid['hours'], masks):
+        selected = pnl[:, mask]
+        counts = [flags[column][:, mask].sum(axis=1).tolist() for column in COUNTS]
+        for spread in grid['spread']:
+            stats = stats_rows(selected - spread)
+            stats = [stats[name].tolist() for name in STATS]
+            for i, sl in enumerate(grid['sl']):
+                rows.append((sl, trail, None if trail is None else activation, tp1, tp2, window, spread,
+                             *(column[i] for column in stats), *(column[i] for column in counts)))
+    return rows
+
+
+def tasks_for(grid):
+    trails = [(None, None)] if None in grid['trail'] else []
+    trails += [(trail, activation) for trail in grid['trail'] if trail is not None
+               for activation in grid['activation']]
+    # A TP1 at or beyond TP2 would never leave anything for TP2
+    targets = [(tp1, tp2) for tp1 in grid['tp1'] for tp2 in grid['tp2']
+               if tp1 is None or tp2 is None or tp1 < tp2]
+    return [trail + target for trail in trails for target in targets]
+
+
+_last_progress = [0.0]
+
+
+def progress(done, total, combos, started):
+    """Progress bar on stderr, redrawn at most 10 times a second."""
+    now = time.perf_counter()
+    if done < total and now - _last_progress[0] < 0.1:
+        return
+    _last_progress[0] = now
+    width = 30
+    filled = int(width * done / total) if total else width
+    sys.stderr.write(f"\r  [{'#' * filled}{'.' * (width - filled)}] {done}/{total} tasks, "
+                     f"{combos:,} combos, {now - started:.1f} s")
+    sys.stderr.flush()
+
+
+def run(bt, grid, workers, options):
+    """Evaluate the whole grid. Returns (rows, seconds).
+    options: simulate() keywords (tp1_fraction, breakeven, fill)."""
+    masks = [hours_mask(window, bt.entry_ts) for window in grid['hours']]
+    tasks = tasks_for(grid)
+    chunksize = max(1, len(tasks) // (workers * 8))
+    rows, started = [], time.perf_counter()
+    if workers == 1:
+        _worker.update(bt=bt, grid=grid, masks=masks, options=options)
+        for done, task in enumerate(tasks, 1):
+            rows.extend(evaluate(task))
+            progress(done, len(tasks), len(rows), started)
+        _worker.clear()
+    else:
+        blocks, specs = share(bt.arrays())
+        try:
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(specs, grid, masks, options)) as pool:
+                for done, task_rows in enumerate(pool.map(evaluate, tasks, chunksize=chunksize), 1):
+                    rows.extend(task_rows)
+                    progress(done, len(tasks), len(rows), started)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    sys.stderr.write('\n')
+    return rows, time.perf_counter() - started
+
+
+# ============================================================
+# RESULTS
+# ============================================================
+def rank(rows, metric, min_trades=0):
+    """Rows as dicts, best first by metric (min_trades drops thin scenarios)."""
+    index = COLUMNS.index(metric)
+    trades = COLUMNS.index('trades')
+    kept = [row for row in rows if row[trades] >= min_trades]
+    kept.sort(key=lambda row: row[index], reverse=metric not in LOWER_IS_BETTER)
+    return [dict(zip(COLUMNS, row), rank=i) for i, row in enumerate(kept, 1)]
+
+
+def rounded(row):
+    return {k: round(v, 2) if isinstance(v, float) and np.isfinite(v) else v for k, v in row.items()}
+
+
+def write_results(path, ranked, meta):
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump({**meta, 'results': [rounded(r) for r in ranked]}, f, indent=1, default=str)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=('rank',) + COLUMNS)
+            writer.writeheader()
+            writer.writerows(rounded(r) for r in ranked)
+    print(f"  Wrote {len(ranked):,} rows to {path}")
+
+
+def print_table(ranked, metric, top):
+    print(f"\n{'='*110}")
+    print(f"  TOP {min(top, len(ranked))} by {metric}")
+    print(f"{'='*110}")
+    print(f"  {'#':<4} {'SL':<6} {'Trail':<6} {'Activ':<6} {'TP1':<6} {'TP2':<6} {'Hours':<12} {'Spread':<7} {'Trades':<7} "
+          f"{'P&L Net':>9} {'WR%':>6} {'PF':>6} {'Expect':>7} {'MaxDD':>8}")
+    off = lambda v: 'off' if v is None else f'{v:g}'
+    for r in ranked[:top]:
+        print(f"  {r['rank']:<4} {off(r['sl']):<6} {off(r['trail']):<6} {off(r['activation']):<6} "
+              f"{off(r['tp1']):<6} {off(r['tp2']):<6} "
+              f"{r['hours']:<12} {r['spread']:<7g} {r['trades']:<7} {r['total_pnl']:>+9.1f} "
+              f"{r['win_rate']:>6.1f} {r['profit_factor']:>6.2f} {r['expectancy']:>+7.1f} {r['max_drawdown']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--config', help='JSON file with grid lists (keys: ' + ', '.join(DIMENSIONS) + ')')
+    for dimension in DIMENSIONS:
+        parser.add_argument(f'--{dimension}', help=f"{dimension} values (overrides the config file)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes (1 = in-process)')
+    parser.add_argument('--rank', default='total_pnl', choices=STATS[1:], help='metric to rank by')
+    parser.add_argument('--min-trades', type=int, default=0, help='skip scenarios with fewer trades')
+    parser.add_argument('--top', type=int, default=20, help='rows printed')
+    parser.add_argument('--out', action='append', default=[], help='results file, .csv or .json (repeatable)')
+    parser.add_argument('--tp1-fraction', type=float, default=0.5, help='share of the position closed at tp1')
+    parser.add_argument('--breakeven', action='store_true', help='move the stop to entry once tp1 is hit')
+    parser.add_argument('--fill', choices=['level', 'price'], default='level',
+                        help='stops/targets fill at their level or at the price that crossed it')
+    parser.add_argument('--bars', choices=['1m', '5m', '1h'], help='price path from OHLC bars instead of signals')
+    parser.add_argument('--trades-file', default='/tmp/bloop_trades.csv')
+    parser.add_argument('--signals-file', default='/tmp/bloop_signals.csv')
+    parser.add_argument('--bars-file', default='/tmp/bloop_bars.csv')
+    parser.add_argument('--db', action='store_true',
+                        help="read the server's database (DATABASE_URL or signals.db) through history_cache")
+    parser.add_argument('--symbol', help='only this symbol (--db)')
+    parser.add_argument('--rebuild-cache', action='store_true', help='with --db: fetch everything again')
+    args = parser.parse_args()
+
+    grid = load_grid(args)
+    api_url = os.environ.get('BLOOP_API_URL')
+    t0 = time.perf_counter()
+    if args.db:
+        trades, points = load_from_db(args.symbol, args.rebuild_cache)
+        n_signals = len(points['price'])
+    elif api_url:
+        trades, signals = load_from_api(api_url.rstrip('/'), os.environ.get('WEBHOOK_SECRET', ''))
+        n_signals = len(signals)
+    else:
+        trades, signals = load_trades(args.trades_file), load_signals(args.signals_file)
+        n_signals = len(signals)
+    load_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if args.bars:
+        from ohlc_bars import RESOLUTIONS
+        if args.db:
+            bars = load_traded_bars(trades, args.bars)
+        elif api_url:
+            bars = load_traded_bars(trades, args.bars, api_url.rstrip('/'), os.environ.get('WEBHOOK_SECRET', ''))
+        else:
+            bars = load_bars(args.bars_file)
+        bt = Backtest.from_bars(trades, bars, SPREAD, RESOLUTIONS[args.bars])
+        path = f"{len(bars)} {args.bars} bars"
+    elif args.db:
+        bt = Backtest.from_points(trades, points['timestamp'], points['price'], SPREAD,
+                                  points['symbol'], points['symbols'])
+        path = f"{n_signals} signals"
+    else:
+        bt = Backtest(trades, signals, SPREAD)
+        path = f"{n_signals} signals"
+    build_s = time.perf_counter() - t0
+    combos = len(tasks_for(grid)) * len(grid['sl']) * len(grid['hours']) * len(grid['spread'])
+    print(f"\n  {len(trades)} trades, {path} (loaded in {load_s:.2f} s, arrays built in {build_s:.2f} s)")
+    print(f"  Grid: {' x '.join(f'{len(grid[d])} {d}' for d in DIMENSIONS)} -> {combos:,} combos, "
+          f"{args.workers} workers")
+
+    options = {'tp1_fraction': args.tp1_fraction, 'breakeven': args.breakeven, 'fill': args.fill}
+    rows, seconds = run(bt, grid, max(1, args.workers), options)
+    print(f"  {len(rows):,} combos in {seconds:.2f} s ({len(rows) / seconds:,.0f}/s)")
+
+    ranked = rank(rows, args.rank, args.min_trades)
+    print_table(ranked, args.rank, args.top)
+    meta = {'grid': grid, **options, 'path': args.bars or 'signals', 'rank': args.rank, 'min_trades': args.min_trades,
+            'trades': len(trades), 'signals': n_signals, 'seconds': round(seconds, 3)}
+    for path in args.out:
+        write_results(path, ranked, meta)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+History Cache — Bloop Tracker
+Trades and signals from the server's database as memory-mapped columns.
+
+The backtester reads the same database as webhook_server (DATABASE_URL, else
+signals.db), without an export or the API: rows are streamed (server-side
+cursor on PostgreSQL, fetchmany on SQLite, BACKTEST_FETCH_SIZE rows per round
+trip) straight into one .npy file per column:
+
+    BACKTEST_CACHE_DIR/manifest.json              rows, high-water mark, text vocabularies
+    BACKTEST_CACHE_DIR/signals-1/timestamp.npy    int64 microseconds since the epoch (UTC)
+    BACKTEST_CACHE_DIR/signals-1/price.npy        float64 (NaN = NULL)
+    BACKTEST_CACHE_DIR/signals-1/signal.npy       int32 codes into the manifest vocabulary
+    ...
+
+load() maps the files read-only (np.load mmap_mode='r'): a run over a cache
+that is up to date starts in milliseconds, and nothing is parsed.
+
+Refresh is incremental: only rows with an id above the table's high-water
+mark are fetched and written after the cached ones. The last
+BACKTEST_CACHE_OVERLAP ids are re-read every time, so a row that committed
+after a higher id (concurrent writers on PostgreSQL) is still picked up.
+A table is rebuilt, into a new directory, when the database changed under
+it (another database, /reset) and the trades are when a spread recalculation
+ran since the last refresh. Rows retention later deletes from the database
+(old PRICE_UPDATE ticks) stay in the cache.
+
+    python history_cache.py              # refresh and show what is cached
+    python history_cache.py --rebuild
+"""
+
+import argparse
+import fcntl
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import db
+from db import USE_POSTGRES, get_db_connection, q, table_columns
+from db_time import epoch_us_sql
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CACHE_CONFIG = {
+    'dir': os.environ.get('BACKTEST_CACHE_DIR', os.path.join(HERE, 'backtest_cache')),
+    'fetch_size': int(os.environ.get('BACKTEST_FETCH_SIZE', 20000)),   # rows per round trip
+    'overlap': int(os.environ.get('BACKTEST_CACHE_OVERLAP', 1000)),    # trailing ids re-read on refresh
+}
+
+CACHE_VERSION = 1
+MANIFEST = 'manifest.json'
+CATEGORY = 'category'      # text: int32 codes + vocabulary in the manifest
+
+# table -> [(column, SELECT expression, dtype)], id first
+TABLES = {
+    'trades': [
+        ('id', 'id', 'i8'),
+        ('symbol', 'symbol', CATEGORY),
+        ('strategy', 'strategy', CATEGORY),
+        ('direction', 'direction', CATEGORY),
+        ('entry_time', epoch_us_sql('entry_time'), 'i8'),
+        ('exit_time', epoch_us_sql('exit_time'), 'i8'),
+        ('entry_price', 'entry_price', 'f8'),
+        ('exit_price', 'exit_price', 'f8'),
+        ('pnl_points', 'pnl_points', 'f8'),
+        ('pnl_net_points', 'pnl_net_points', 'f8'),
+        ('duration_seconds', 'COALESCE(duration_seconds, 0)', 'i8'),
+    ],
+    'signals': [
+        ('id', 'id', 'i8'),
+        ('timestamp', epoch_us_sql('timestamp'), 'i8'),
+        ('signal', 'signal', CATEGORY),
+        ('price', 'price', 'f8'),
+        ('symbol', 'symbol', CATEGORY),
+        ('strategy', 'strategy', CATEGORY),
+    ],
+}
+
+
+def _dtype(spec):
+    return np.dtype(np.int32 if spec == CATEGORY else spec)
+
+
+def _source():
+    """Which database the cache was filled from (no credentials)."""
+    if USE_POSTGRES:
+        return 'postgres:' + hashlib.sha256(db.DATABASE_URL.encode()).hexdigest()[:16]
+    return 'sqlite:' + db.DB_PATH
+
+
+# ============================================================
+# COLUMN FILES
+# ============================================================
+def _write_column(path, values, at):
+    """Write values into the column file from row `at` on, in place.
+
+    Files only grow (the manifest says how many rows are valid), so a reader
+    that mapped the file earlier never sees it shrink under it.
+    """
+    if not os.path.exists(path):
+        np.save(path, values)
+        return
+    fmt = np.lib.format
+    with open(path, 'r+b') as f:
+        version = fmt.read_magic(f)[0]
+        shape, _, dtype = getattr(fmt, f'read_array_header_{version}_0')(f)
+        offset = f.tell()
+        header = io.BytesIO()
+        getattr(fmt, f'write_array_header_{version}_0')(
+            header, {'descr': fmt.dtype_to_descr(dtype), 'fortran_order': False,
+                     'shape': (max(shape[0], at + len(values)),)})
+        # np.save leaves room in the header for the row count to grow
+        if len(header.getvalue()) == offset and dtype == values.dtype:
+            f.seek(offset + at * dtype.itemsize)
+            f.write(values.tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+    full = np.concatenate((np.load(path)[:at].astype(values.dtype), values))
+    np.save(path + '.tmp.npy', full)
+    os.replace(path + '.tmp.npy', path)
+
+
+def _open_column(path, rows, dtype):
+    values = np.load(path, mmap_mode='r') if os.path.exists(path) else np.empty(0, dtype)
+    if len(values) < rows:
+        raise RuntimeError(f"{path}: {len(values)} rows, manifest says {rows} (refresh with --rebuild)")
+    return values[:rows]
+
+
+def _encode(values, words, index):
+    """Text values -> int32 codes, new words appended to the vocabulary."""
+    out = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(words)
+            words.append(value)
+        out[i] = code
+    return out
+
+
+# ============================================================
+# MANIFEST
+# ============================================================
+def _read_manifest():
+    try:
+        with open(os.path.join(CACHE_CONFIG['dir'], MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest):
+    path = os.path.join(CACHE_CONFIG['dir'], MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+# ============================================================
+# REFRESH
+# ============================================================
+def _stream(conn, sql, params, size):
+    """Row batches of a query, without the whole result in memory."""
+    if USE_POSTGRES:
+        c = conn.cursor(name='bloop_history_cache')   # server-side: rows stay there until fetched
+        c.itersize = size
+    else:
+        c = conn.cursor()
+    try:
+        c.execute(q(sql), params)
+        while True:
+            rows = c.fetchmany(size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        c.close()
+
+
+def _recalc_stamp(conn):
+    """Latest spread recalculation job (it rewrites pnl_net of old trades)."""
+    if not table_columns(conn, 'recalc_jobs'):
+        return None
+    c = conn.cursor()
+    c.execute('SELECT id, status, last_id FROM recalc_jobs ORDER BY id DESC LIMIT 1')
+    row = c.fetchone()
+    return list(row) if row else None
+
+
+def _sync(conn, name, manifest):
+    """Fetch what is new in one table. Returns rows added."""
+    columns = TABLES[name]
+    spec = [[column, dtype] for column, _, dtype in columns]
+    state = manifest['tables'].get(name)
+    c = conn.cursor()
+    c.execute(f'SELECT MIN(id), MAX(id) FROM {name}')
+    lo, hi = c.fetchone()
+    stamp = _recalc_stamp(conn) if name == 'trades' else None
+
+    # Nothing cached is in the database any more: /reset, or another database
+    gone = state and state['rows'] and (hi is None or hi < state['high_water'] or lo > state['high_water'])
+    old_dir = None
+    if state is None or state['columns'] != spec or state['stamp'] != stamp or gone:
+        generation = 1
+        if state:
+            generation = state['generation'] + 1
+            old_dir = os.path.join(CACHE_CONFIG['dir'], state['dir'])
+        state = {'dir': f'{name}-{generation}', 'generation': generation, 'columns': spec,
+                 'rows': 0, 'high_water': 0, 'stamp': stamp, 'vocab': {}}
+        directory = os.path.join(CACHE_CONFIG['dir'], state['dir'])
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        keep, after, before = 0, 0, 0
+    else:
+        directory = os.path.join(CACHE_CONFIG['dir'], state['dir'])
+        ids = _open_column(os.path.join(directory, 'id.npy'), state['rows'], np.int64)
+        keep = int(np.searchsorted(ids, state['high_water'] - CACHE_CONFIG['overlap'], side='right'))
+        after = int(ids[keep - 1]) if keep else 0
+        before = state['rows']
+        # A crash from here on leaves the (shorter) cache consistent
+        state['rows'] = keep
+        manifest['tables'][name] = state
+        _write_manifest(manifest)
+
+    vocab = state['vocab']
+    index = {column: {word: i for i, word in enumerate(vocab.setdefault(column, []))}
+             for column, _, dtype in columns if dtype == CATEGORY}
+    sql = f"SELECT {', '.join(expr for _, expr, _ in columns)} FROM {name} WHERE id > ? ORDER BY id"
+    rows_at = keep
+    for rows in _stream(conn, sql, (after,), CACHE_CONFIG['fetch_size']):
+        for (column, _, dtype), values in zip(columns, zip(*rows)):
+            if dtype == CATEGORY:
+                values = _encode(values, vocab[column], index[column])
+            else:
+                values = np.array(values, dtype=dtype)
+            _write_column(os.path.join(directory, column + '.npy'), values, rows_at)
+        rows_at += len(rows)
+        state['high_water'] = max(state['high_water'], rows[-1][0])
+
+    state.update(rows=rows_at, refreshed_at=datetime.now(timezone.utc).isoformat())
+    manifest['tables'][name] = state
+    _write_manifest(manifest)
+    if old_dir:
+        # Processes that mapped the old files keep reading them until they exit
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return rows_at - before
+
+
+def refresh(rebuild=False):
+    """Bring the cache up to date with the database. {table: rows added}"""
+    os.makedirs(CACHE_CONFIG['dir'], exist_ok=True)
+    with open(os.path.join(CACHE_CONFIG['dir'], '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)      # one refresh at a time
+        try:
+            manifest = _read_manifest()
+            if rebuild or manifest.get('version') != CACHE_VERSION or manifest.get('source') != _source():
+                tables = manifest.get('tables', {})
+                for state in tables.values():
+                    state['columns'] = None     # fetched again, into the next generation
+                manifest = {'version': CACHE_VERSION, 'source': _source(), 'tables': tables}
+            conn = get_db_connection()
+            try:
+                fetched = {name: _sync(conn, name, manifest) for name in TABLES}
+                conn.rollback()     # read-only: ends the snapshot
+            finally:
+                conn.close()
+            return fetched
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+# ============================================================
+# READING
+# ============================================================
+class Table:
+    """One cached table: read-only memory-mapped columns, text as codes."""
+
+    def __init__(self, name, state):
+        self.name = name
+        self.rows = state['rows']
+        self.vocab = state['vocab']
+        self.high_water = state['high_water']
+        directory = os.path.join(CACHE_CONFIG['dir'], state['dir'])
+        self.columns = {column: _open_column(os.path.join(directory, column + '.npy'), self.rows, _dtype(dtype))
+                        for column, _, dtype in TABLES[name]}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def decode(self, column):
+        """Text column as an object array (None where NULL)."""
+        return np.array(self.vocab[column], dtype=object)[self.columns[column]]
+
+    def equals(self, column, value):
+        """Mask of the rows where a text column == value."""
+        words = self.vocab[column]
+        if value not in words:
+            return np.zeros(self.rows, dtype=bool)
+        return self.columns[column] == words.index(value)
+
+
+def load(update=True, rebuild=False):
+    """{table: Table}. Refreshed from the database first unless update=False
+    (offline: whatever is cached)."""
+    if update or rebuild:
+        refresh(rebuild)
+    manifest = _read_manifest()
+    return {name: Table(name, state) for name, state in manifest.get('tables', {}).items()
+            if name in TABLES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rebuild', action='store_true', help='drop the cache and fetch everything again')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    fetched = refresh(args.rebuild)
+    refresh_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    tables = load(update=False)
+    load_ms = (time.perf_counter() - t0) * 1000
+
+    print(f"\n📦 {CACHE_CONFIG['dir']} ({_source().split(':')[0]})")
+    for name, table in tables.items():
+        size = sum(column.nbytes for column in table.columns.values())
+        print(f"  {name:<8} {len(table):>10,} rows  (+{fetched.get(name, 0):,})  "
+              f"high-water id {table.high_water}  {size / 1e6:.1f} MB")
+    print(f"  Refresh {refresh_s:.2f} s, load {load_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Ingest Queue — Bloop Tracker
+Durable local journal for INGEST_MODE=async.
+
+/webhook validates the secret, appends the parsed signal to an SQLite queue
+(WAL, synchronous=FULL: fsync'd before we answer) and returns 202. A single
+applier thread — elected across gunicorn workers with a file lock — drains
+the queue in order and applies signals to the main database in batches.
+
+Exactly-once: the last applied seq is stored in the main database
+(`ingest_cursor`) in the same transaction as the batch, so after a crash the
+applier resumes after it and drops journal entries already applied.
+
+Transient database errors (locks, deadlocks, pool timeouts: db.is_transient_error)
+are retried with backoff, in order. Only an entry that fails on its own for
+any other reason goes to `dead_letter`; `flask ingest-redrive` puts it back
+at the end of the queue.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from db import is_transient_error, q
+from structured_log import log_event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+INGEST_CONFIG = {
+    'mode': os.environ.get('INGEST_MODE', 'sync'),    # 'sync' | 'async'
+    'path': os.environ.get('INGEST_QUEUE_PATH', os.path.join(HERE, 'ingest_queue.db')),
+    'max_depth': int(os.environ.get('INGEST_MAX_DEPTH', 10000)),    # 429 beyond this
+    'batch_size': int(os.environ.get('INGEST_BATCH_SIZE', 200)),
+    'poll_interval': float(os.environ.get('INGEST_POLL_INTERVAL', 0.05)),
+    'retry_max': float(os.environ.get('INGEST_RETRY_MAX', 30)),     # backoff cap (seconds), transient errors
+}
+
+
+class QueueFull(Exception):
+    """Queue depth reached max_depth: caller should answer 429."""
+
+
+def create_cursor_table(c):
+    """ingest_cursor lives in the main DB, next to the data it guards."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_cursor (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def read_cursor(conn):
+    c = conn.cursor()
+    c.execute('SELECT last_seq FROM ingest_cursor WHERE id = 1')
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+def write_cursor(conn, seq):
+    """Record seq as applied. Caller commits (with the batch it belongs to)."""
+    c = conn.cursor()
+    c.execute(q('UPDATE ingest_cursor SET last_seq = ? WHERE id = 1'), (seq,))
+    if c.rowcount == 0:
+        c.execute(q('INSERT INTO ingest_cursor (id, last_seq) VALUES (1, ?)'), (seq,))
+
+
+class IngestQueue:
+    """Append-only SQLite journal of parsed signals."""
+
+    def __init__(self, path, max_depth):
+        self.path = path
+        self.max_depth = max_depth
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS queue (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                received_at REAL NOT NULL,
+                payload TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                seq INTEGER PRIMARY KEY,
+                received_at REAL NOT NULL,
+                payload TEXT NOT NULL,
+                error TEXT,
+                failed_at TEXT
+            )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def depth(self):
+        row = self._conn().execute('SELECT MIN(seq), MAX(seq) FROM queue').fetchone()
+        return 0 if row[0] is None else row[1] - row[0] + 1
+
+    def enqueue(self, sigs):
+        """Durably append signals (in order). Returns their seqs."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self.depth() + len(sigs) > self.max_depth:
+                raise QueueFull(f'ingest queue full ({self.max_depth})')
+            now = time.time()
+            seqs = []
+            for sig in sigs:
+                cur = conn.execute('INSERT INTO queue (received_at, payload) VALUES (?, ?)',
+                                   (now, json.dumps(sig)))
+                seqs.append(cur.lastrowid)
+            conn.execute('COMMIT')
+            return seqs
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def fetch(self, after_seq, limit):
+        rows = self._conn().execute(
+            'SELECT seq, received_at, payload FROM queue WHERE seq > ? ORDER BY seq LIMIT ?',
+            (after_seq, limit)).fetchall()
+        return [(seq, received_at, json.loads(payload)) for seq, received_at, payload in rows]
+
+    def ack(self, upto_seq):
+        """Drop entries already applied to the main DB."""
+        self._conn().execute('DELETE FROM queue WHERE seq <= ?', (upto_seq,))
+
+    def dead_letter(self, seq, received_at, sig, error):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('INSERT OR REPLACE INTO dead_letter VALUES (?, ?, ?, ?, ?)',
+                     (seq, received_at, json.dumps(sig), str(error),
+                      datetime.now(timezone.utc).isoformat()))
+        conn.execute('DELETE FROM queue WHERE seq = ?', (seq,))
+        conn.execute('COMMIT')
+
+    def dead_letters(self):
+        """[(seq, received_at, sig, error, failed_at)], oldest first."""
+        rows = self._conn().execute('SELECT seq, received_at, payload, error, failed_at '
+                                    'FROM dead_letter ORDER BY seq').fetchall()
+        return [(seq, received_at, json.loads(payload), error, failed_at)
+                for seq, received_at, payload, error, failed_at in rows]
+
+    def redrive(self, seqs=None):
+        """Move dead letters (all, or those in seqs) back to the end of the
+        queue, under new seqs. Returns [(old_seq, new_seq)]."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('SELECT seq, received_at, payload FROM dead_letter ORDER BY seq').fetchall()
+            moved = []
+            for seq, received_at, payload in rows:
+                if seqs is not None and seq not in seqs:
+                    continue
+                cur = conn.execute('INSERT INTO queue (received_at, payload) VALUES (?, ?)',
+                                   (received_at, payload))
+                conn.execute('DELETE FROM dead_letter WHERE seq = ?', (seq,))
+                moved.append((seq, cur.lastrowid))
+            conn.execute('COMMIT')
+            return moved
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def oldest_received_at(self):
+        row = self._conn().execute('SELECT MIN(received_at) FROM queue').fetchone()
+        return row[0]
+
+    def dead_letter_count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM dead_letter').fetchone()[0]
+
+
+class QueueApplier:
+    """Background thread draining the queue into the main DB, in order.
+
+    apply_batch(items, last_seq) must apply every (seq, received_at, sig) item
+    and write_cursor(last_seq) in one transaction, or raise having applied
+    nothing. read_applied() returns the cursor stored in the main DB.
+    mark_applied(seq) advances the cursor alone (dead-lettered entries).
+
+    The cursor, not the exception, says what was applied: apply_batch can
+    fail after its commit (event fan-out, logging), so after any failure the
+    applier re-reads it before retrying anything.
+    """
+
+    def __init__(self, queue, apply_batch, read_applied, mark_applied,
+                 batch_size=200, poll_interval=0.05, retry_max=30):
+        self.queue = queue
+        self.apply_batch = apply_batch
+        self.read_applied = read_applied
+        self.mark_applied = mark_applied
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_max = retry_max
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock_file = None
+        self.is_leader = False
+        self.applied_seq = 0
+        self.applied = 0
+        self.batches = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_apply_lag = None     # seconds from receipt to commit, last item
+
+    def start(self):
+        """Start the thread once per process (call after gunicorn forks)."""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='ingest-applier', daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def _try_lead(self):
+        # Only one process drains the queue; others stay on standby and take
+        # over if the leader dies (flock is released with the process).
+        if self._lock_file is None:
+            self._lock_file = open(self.queue.path + '.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _run(self):
+        while not self._try_lead():
+            time.sleep(5)
+        self.is_leader = True
+
+        # Replay: skip (and drop) whatever the main DB already has
+        self.applied_seq = self.read_applied()
+        self.queue.ack(self.applied_seq)
+        pending = self.queue.depth()
+        if pending:
+            log_event('ingest', '📥 Ingest queue: replaying %d pending signals after seq %d', pending, self.applied_seq,
+                      pending=pending, applied_seq=self.applied_seq)
+
+        backoff = 0
+        resync = False
+        while True:
+            try:
+                if resync:
+                    self._resync()
+                    resync = False
+                items = self.queue.fetch(self.applied_seq, self.batch_size)
+                if not items:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                self._apply(items)
+                backoff = 0
+            except Exception as e:
+                # Transient (or the applier's own bookkeeping): same items again, after a pause
+                resync = True
+                self.retries += 1
+                backoff = min(self.retry_max, backoff * 2 or 0.5)
+                log_event('ingest', '❌ Ingest applier error, retrying in %.1fs: %s', backoff, e, level=logging.ERROR,
+                          backoff=backoff, error=str(e))
+                time.sleep(backoff)
+
+    def _resync(self):
+        """Trust the main DB's cursor: a failed apply may have committed."""
+        self.applied_seq = max(self.applied_seq, self.read_applied())
+        self.queue.ack(self.applied_seq)
+
+    def _apply(self, items):
+        try:
+            self.apply_batch(items, items[-1][0])
+            done = items
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            # Isolate the failing entry: apply one by one, dead-letter poison
+            self._resync()
+            done = [item for item in items if item[0] <= self.applied_seq]
+            for item in items[len(done):]:
+                try:
+                    self.apply_batch([item], item[0])
+                    done.append(item)
+                except Exception as e:
+                    if self.read_applied() >= item[0]:
+                        done.append(item)        # committed, failed afterwards
+                        continue
+                    if is_transient_error(e):
+                        self._done(done)
+                        raise
+                    self.failed += 1
+                    log_event('ingest', '❌ Ingest seq %d failed, moved to dead_letter: %s', item[0], e, level=logging.ERROR,
+                              seq=item[0], error=str(e))
+                    # Dead letter first: a crash in between re-dead-letters it, never loses it
+                    self.queue.dead_letter(*item, e)
+                    self.mark_applied(item[0])
+                    self.applied_seq = item[0]
+        self._done(done)
+
+    def _done(self, done):
+        if not done:
+            return
+        self.applied_seq = max(self.applied_seq, done[-1][0])
+        self.applied += len(done)
+        self.batches += 1
+        self.last_apply_lag = time.time() - done[-1][1]
+        self.queue.ack(self.applied_seq)
+
+    def status(self):
+        oldest = self.queue.oldest_received_at()
+        return {
+            'mode': INGEST_CONFIG['mode'],
+            'depth': self.queue.depth(),
+            'max_depth': self.queue.max_depth,
+            'lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'last_apply_lag_seconds': round(self.last_apply_lag, 3) if self.last_apply_lag is not None else None,
+            'applier_leader': self.is_leader,
+            'applied_seq': self.applied_seq,
+            'applied': self.applied,
+            'batches': self.batches,
+            'failed': self.failed,
+            'retries': self.retries,
+            'dead_letter': self.queue.dead_letter_count(),
+        }
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Ledger Replay — Bloop Tracker
+The signal history through the live server's position / stop rules: the
+trades it would have booked with a given stop config, as a virtual ledger.
+Signals without a usable price (NULL, or 0 from a payload without one) are
+left out: the server can't open or close at 0.
+
+Same rules as webhook_server, from trade_engine: one position per
+(symbol, strategy), LONG/SHORT open and reverse it, PRICE_UPDATE and
+LONG/SHORT check the fixed SL and the trailing stop against the max/min so
+far, stops fill at the price that triggered them. Nothing is written to the DB.
+
+The replay runs on backtest_engine.replay() (NumPy, no loop over the
+signals). --verify also runs trade_engine.replay_ledger(), a plain loop over
+the functions the server calls, and checks that every trade is identical.
+
+    python ledger_replay.py --trail 20 --activation 10             # /tmp/bloop_signals.csv
+    python ledger_replay.py --db --live-config --compare            # the server's signals, config and trades
+    python ledger_replay.py --db --sl 40 --trail 30 --out ledger.csv --verify
+"""
+
+import argparse
+import csv
+from collections import Counter
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+from backtest_engine import EXIT_REASONS, EXIT_SIGNAL, EXIT_STOP, SIGNAL_KINDS, epoch_us, iso_from_us, replay
+from trade_engine import (DEFAULT_STRATEGY, DEFAULT_SYMBOL, fixed_sl_reason, replay_ledger, spread_for,
+                          trailing_reason)
+from trailing_stop_analysis import SPREAD, load_signals, pnl_stats, print_stats
+
+LEDGER_FIELDS = ['symbol', 'strategy', 'direction', 'entry_time', 'entry_price', 'exit_time', 'exit_price',
+                 'exit_reason', 'pnl_points', 'pnl_percent', 'spread_cost', 'pnl_net_points', 'pnl_net_percent',
+                 'duration_seconds', 'max_price', 'min_price']
+
+
+# ============================================================
+# DATA
+# ============================================================
+def _codes(words, default):
+    """Vocabulary with NULLs as the server's default -> (names, code remap)."""
+    names, remap = np.unique(np.array([w or default for w in words] or [default], dtype=object).astype(str),
+                             return_inverse=True)
+    return names.tolist(), remap
+
+
+def history_from_db(rebuild=False):
+    """Signal columns from the server's database (history_cache), with a
+    position key code per signal."""
+    import history_cache
+    s = history_cache.load(rebuild=rebuild)['signals']
+    priced = s['price'] > 0           # NaN (NULL) and 0 (payload without price) excluded
+    symbols, sym_remap = _codes(s.vocab['symbol'], DEFAULT_SYMBOL)
+    strategies, strat_remap = _codes(s.vocab['strategy'], DEFAULT_STRATEGY)
+    pair = sym_remap[s['symbol'][priced]] * len(strategies) + strat_remap[s['strategy'][priced]]
+    pairs, key = np.unique(pair, return_inverse=True)
+    kinds = np.array([SIGNAL_KINDS.get(w, 0) for w in s.vocab['signal']] or [0], dtype=np.int8)
+    return {
+        'key': key.astype(np.int64),
+        'keys': [(symbols[v // len(strategies)], strategies[v % len(strategies)]) for v in pairs.tolist()],
+        'kind': kinds[s['signal'][priced]],
+        'signal': s.decode('signal')[priced],
+        'price': np.ascontiguousarray(s['price'][priced]),
+        'ts': np.ascontiguousarray(s['timestamp'][priced]),
+    }
+
+
+def history_from_signals(signals):
+    """The same columns from load_signals() records (one key: the exports have no symbol)."""
+    signals = [s for s in signals if s['price'] > 0]
+    return {
+        'key': np.zeros(len(signals), dtype=np.int64),
+        'keys': [(DEFAULT_SYMBOL, DEFAULT_STRATEGY)],
+        'kind': np.array([SIGNAL_KINDS.get(s['signal'], 0) for s in signals], dtype=np.int8),
+        'signal': np.array([s['signal'] for s in signals], dtype=object),
+        'price': np.array([s['price'] for s in signals], dtype=np.float64),
+        'ts': epoch_us([s['timestamp'] for s in signals]),
+    }
+
+
+def live_config():
+    """The server's trailing-stop config: GET /trailing-stop (BLOOP_API_URL),
+    else the copy stored in runtime_config (POSITION_MODE=shared)."""
+    api_url = os.environ.get('BLOOP_API_URL')
+    if api_url:
+        with urllib.request.urlopen(f"{api_url.rstrip('/')}/trailing-stop", timeout=30) as resp:
+            return json.loads(resp.read())
+    from db import get_db_connection
+    from runtime_config import load_config
+    conn = get_db_connection()
+    try:
+        stored = load_config(conn).get('trailing_stop')
+    finally:
+        conn.close()
+    if stored is None:
+        sys.exit("❌ No stored trailing-stop config: set BLOOP_API_URL or pass --trail/--activation/--sl")
+    return stored
+
+
+def db_spreads():
+    """{symbol: spread_points} the server charges (symbol_spreads), {} if none."""
+    from db import get_db_connection, table_columns
+    conn = get_db_connection()
+    try:
+        if not table_columns(conn, 'symbol_spreads'):
+            return {}
+        c = conn.cursor()
+        c.execute('SELECT symbol, spread_points FROM symbol_spreads')
+        return dict(c.fetchall())
+    finally:
+        conn.close()
+
+
+# ============================================================
+# LEDGER
+# ============================================================
+def ledger_records(trades, history, cfg):
+    """replay() trades -> the dicts trade_engine.replay_ledger() returns."""
+    iso_in = iso_from_us(history['ts'][trades['entry_index']])
+    iso_out = iso_from_us(history['ts'][trades['exit_index']])
+    records = []
+    for i, (key, side, reason) in enumerate(zip(trades['key'].tolist(), trades['side'].tolist(),
+                                                trades['reason'].tolist())):
+        direction = 'LONG' if side > 0 else 'SHORT'
+        if reason == EXIT_SIGNAL:
+            exit_reason = 'signal'
+        elif reason == EXIT_STOP:
+            exit_reason = fixed_sl_reason(cfg)
+        else:
+            extreme = trades['max_price' if side > 0 else 'min_price'][i]
+            exit_reason = trailing_reason(cfg, direction, float(extreme))
+        symbol, strategy = history['keys'][key]
+        record = {'symbol': symbol, 'strategy': strategy, 'direction': direction,
+                  'entry_time': iso_in[i], 'exit_time': iso_out[i], 'exit_reason': exit_reason,
+                  'atr': None, 'tp1': None, 'tp2': None, 'sl': None}
+        for name in ('entry_price', 'exit_price', 'pnl_points', 'pnl_percent', 'spread_cost', 'pnl_net_points',
+                     'pnl_net_percent', 'duration_seconds', 'max_price', 'min_price'):
+            record[name] = trades[name][i].item()
+        records.append(record)
+    return records
+
+
+def run(history, cfg, spreads):
+    """(trades, open_positions, seconds) of the vectorized replay."""
+    spread = [spread_for(spreads, symbol) for symbol, _ in history['keys']]
+    t0 = time.perf_counter()
+    trades, still_open = replay(history['key'], history['kind'], history['price'], history['ts'], cfg, spread)
+    return trades, still_open, time.perf_counter() - t0
+
+
+def signal_dicts(history):
+    """History columns -> the signal dicts trade_engine.replay_ledger() takes."""
+    return [{'timestamp': t, 'signal': sig, 'price': price, 'symbol': symbol, 'strategy': strategy}
+            for t, sig, price, (symbol, strategy) in zip(
+                iso_from_us(history['ts']), history['signal'].tolist(), history['price'].tolist(),
+                [history['keys'][k] for k in history['key'].tolist()])]
+
+
+def verify(history, cfg, spreads, records):
+    """Loop over trade_engine (the server's calls) vs the vectorized ledger."""
+    signals = signal_dicts(history)
+    t0 = time.perf_counter()
+    expected, _ = replay_ledger(signals, cfg, spreads)
+    loop_s = time.perf_counter() - t0
+    ok = len(expected) == len(records)
+    mismatches = 0
+    for a, b in zip(expected, records):
+        for field in a:
+            if a[field] != b[field]:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"  ✗ {a['entry_time']} {field}: loop {a[field]!r} != engine {b[field]!r}")
+    ok = ok and not mismatches
+    print(f"\n  Loop (trade_engine.replay_ledger): {len(expected)} trades in {loop_s:.2f} s "
+          f"({len(signals) / loop_s:,.0f} signals/s)")
+    print(f"  {'✅ ALL MATCH' if ok else f'❌ MISMATCH ({len(expected)} vs {len(records)} trades, {mismatches} fields)'}")
+    return ok
+
+
+def compare_booked(records):
+    """Virtual ledger vs the trades the server actually booked (history_cache)."""
+    import history_cache
+    t = history_cache.load(update=False)['trades']
+    booked = set(zip(t.decode('symbol').tolist(), t.decode('strategy').tolist(), t.decode('direction').tolist(),
+                     iso_from_us(t['entry_time']), iso_from_us(t['exit_time'])))
+    virtual = {(r['symbol'], r['strategy'], r['direction'], r['entry_time'], r['exit_time']) for r in records}
+    same = booked & virtual
+    print(f"\n  Booked by the server: {len(booked)} trades, P&L net {np.nansum(t['pnl_net_points']):+.1f}")
+    print(f"  Virtual ledger:       {len(virtual)} trades, P&L net "
+          f"{sum(r['pnl_net_points'] for r in records):+.1f}")
+    print(f"  Same entry and exit:  {len(same)} ({len(booked - virtual)} only booked, "
+          f"{len(virtual - booked)} only virtual)")
+    print("  (the server's config may have changed over time; the replay applies one config throughout)")
+
+
+def write_ledger(path, records):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=LEDGER_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+    print(f"  📄 {len(records)} trades -> {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--trail', type=float, help='trailing stop distance in points (0 = off)')
+    parser.add_argument('--activation', type=float, help='profit before the trail arms')
+    parser.add_argument('--sl', type=float, help='fixed stop loss in points (0 = off)')
+    parser.add_argument('--no-stops', action='store_true', help='stops disabled: reversals only')
+    parser.add_argument('--live-config', action='store_true',
+                        help="start from the server's config (GET /trailing-stop or runtime_config)")
+    parser.add_argument('--spread', type=float, help=f'spread per trade (default: symbol_spreads with --db, else {SPREAD})')
+    parser.add_argument('--db', action='store_true',
+                        help="read the server's database (DATABASE_URL or signals.db) through history_cache")
+    parser.add_argument('--rebuild-cache', action='store_true', help='with --db: fetch everything again')
+    parser.add_argument('--signals-file', default='/tmp/bloop_signals.csv')
+    parser.add_argument('--compare', action='store_true', help='with --db: compare with the trades the server booked')
+    parser.add_argument('--verify', action='store_true', help='check against the loop over trade_engine')
+    parser.add_argument('--out', help='write the ledger as CSV')
+    args = parser.parse_args()
+
+    cfg = {'enabled': True, 'trail_points': 20, 'activation_points': 0, 'fixed_sl_points': 0}
+    if args.live_config:
+        cfg.update(live_config())
+    for name, value in (('trail_points', args.trail), ('activation_points', args.activation),
+                        ('fixed_sl_points', args.sl)):
+        if value is not None:
+            cfg[name] = value
+            cfg['enabled'] = True
+    if args.no_stops:
+        cfg['enabled'] = False
+
+    t0 = time.perf_counter()
+    if args.db:
+        history = history_from_db(args.rebuild_cache)
+        spreads = db_spreads()
+    else:
+        history = history_from_signals(load_signals(args.signals_file))
+        spreads = {}
+    if args.spread is not None or not spreads:
+        spreads = {DEFAULT_SYMBOL: SPREAD if args.spread is None else args.spread}
+    load_s = time.perf_counter() - t0
+
+    status = 'ON' if cfg['enabled'] else 'OFF'
+    print("\n" + "="*60)
+    print("  BLOOP LEDGER REPLAY (live server rules)")
+    print(f"  Stops {status} | trail={cfg['trail_points']} activ={cfg['activation_points']} "
+          f"sl={cfg['fixed_sl_points']} | spreads {spreads}")
+    print("="*60)
+
+    n = len(history['key'])
+    print(f"\n  {n:,} signals, {len(history['keys'])} keys (loaded in {load_s:.2f} s)")
+    try:
+        trades, still_open, seconds = run(history, cfg, spreads)
+        records, n_open = ledger_records(trades, history, cfg), len(still_open['key'])
+    except ValueError as e:
+        # Out-of-order LONG/SHORT: only the loop follows them
+        print(f"  ⚠️  {e}")
+        args.verify = False
+        t0 = time.perf_counter()
+        records, still_open = replay_ledger(signal_dicts(history), cfg, spreads)
+        seconds, n_open = time.perf_counter() - t0, len(still_open)
+    print(f"  Replayed in {seconds * 1000:.1f} ms ({n / max(seconds, 1e-9):,.0f} signals/s): "
+          f"{len(records)} trades, {n_open} still open")
+    reasons = Counter(r['exit_reason'].split(' ')[0] for r in records)
+    print("  Exits: " + ', '.join(f"{name} {reasons[name]}" for name in EXIT_REASONS[:3]))
+
+    print_stats("VIRTUAL LEDGER", pnl_stats([r['pnl_net_points'] for r in records]))
+
+    if args.compare and args.db:
+        compare_booked(records)
+    if args.out:
+        write_ledger(args.out, records)
+    if args.verify:
+        sys.exit(0 if verify(history, cfg, spreads, records) else 1)
+
+
+if __name__ == '__main__':
+    main()
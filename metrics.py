@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Metrics — Bloop Tracker
+Counters and latency histograms for GET /metrics (Prometheus text format).
+
+Recording is in memory and cheap (one lock, a bisect and two additions per
+observation), so it runs on every request and every DB operation of the
+webhook path; benchmarks/bench_metrics.py measures it.
+
+Multi-process: each gunicorn worker has its own registry and writes it to
+METRICS_DIR/<pid>-<token>.json every METRICS_FLUSH_INTERVAL seconds. A
+scrape, whichever worker serves it, adds up the counters and histograms of
+every file: workers that exited still count (their files are folded into
+_exited.json), so totals never go backwards on a worker restart. Gauges
+(pool in use, stream subscribers...) are per process, labelled `pid`, and
+only reported for live workers.
+METRICS_DIR='' keeps everything in memory: /metrics shows the serving
+process only (fine with a single worker).
+"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from structured_log import log_event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+METRICS_CONFIG = {
+    'enabled': os.environ.get('METRICS_ENABLED', '1') != '0',
+    'dir': os.environ.get('METRICS_DIR', os.path.join(HERE, 'metrics')),
+    'interval': float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),   # seconds between file writes
+}
+
+PREFIX = 'bloop_'
+
+# Seconds. Webhook DB operations sit in the sub-millisecond to tens of ms range
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+EXITED_FILE = '_exited.json'
+
+
+def _label_key(labels):
+    if len(labels) < 2:
+        return tuple(labels.items())
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Registry:
+    """Metric definitions plus this process's samples."""
+
+    def __init__(self, config=METRICS_CONFIG):
+        self.config = config
+        self.enabled = config['enabled']
+        self._defs = {}          # name -> (type, help, buckets)
+        self._collectors = []    # () -> [(name, labels dict, value)] read at snapshot time
+        self._thread = None
+        self._reset()
+        # A forked worker starts from zero: its parent's samples stay in the parent's file
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._token = secrets.token_hex(4)
+        self._counters = {}      # (name, labels) -> value
+        self._histograms = {}    # (name, labels) -> [count per bucket..., +Inf, sum]
+        self._thread = None
+
+    # ------------------------------------------------------------
+    # Definitions
+    # ------------------------------------------------------------
+    def counter(self, name, help):
+        self._defs[name] = ('counter', help, None)
+        return name
+
+    def gauge(self, name, help):
+        self._defs[name] = ('gauge', help, None)
+        return name
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self._defs[name] = ('histogram', help, tuple(buckets))
+        return name
+
+    def add_collector(self, fn):
+        """fn() -> [(name, labels, value)] for gauges/counters kept elsewhere
+        (e.g. the pool's own counters). Called when the snapshot is taken."""
+        self._collectors.append(fn)
+
+    # ------------------------------------------------------------
+    # Recording (hot path)
+    # ------------------------------------------------------------
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        buckets = self._defs[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(buckets) + 2)
+            h[bisect_left(buckets, value)] += 1
+            h[-1] += value
+
+    def timer(self, name, **labels):
+        """Context manager: observe the seconds spent in the block (also when it raises)."""
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """Decorator version of timer()."""
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    # ------------------------------------------------------------
+    # Per-process files
+    # ------------------------------------------------------------
+    def snapshot(self):
+        """This process's samples as a JSON-able dict."""
+        with self._lock:
+            counters = [[n, list(l), v] for (n, l), v in self._counters.items()]
+            histograms = [[n, list(l), list(h)] for (n, l), h in self._histograms.items()]
+        gauges = []
+        for fn in self._collectors:
+            try:
+                samples = fn()
+            except Exception:
+                continue   # a broken collector must not break the scrape
+            for name, labels, value in samples:
+                sample = [name, sorted(labels.items()), value]
+                (counters if self._defs[name][0] == 'counter' else gauges).append(sample)
+        return {'pid': self._pid, 'updated': time.time(), 'counters': counters,
+                'histograms': histograms, 'gauges': gauges}
+
+    def _path(self):
+        return os.path.join(self.config['dir'], f'{self._pid}-{self._token}.json')
+
+    def write(self):
+        """Write this process's file (atomic rename). No-op without METRICS_DIR."""
+        if not (self.enabled and self.config['dir']):
+            return
+        os.makedirs(self.config['dir'], exist_ok=True)
+        data = self.snapshot()
+        path = self._path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def start(self):
+        """Start the file writer once per process (call after gunicorn forks)."""
+        if not (self.enabled and self.config['dir']):
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except Exception as e:
+                log_event('metrics', '⚠️  Metrics: %s', e, level=logging.ERROR, error=str(e))
+            time.sleep(self.config['interval'])
+
+    def _collect_files(self):
+        """Snapshots of every process; files of exited ones are folded into
+        _exited.json (under a file lock, one scraper at a time)."""
+        directory = self.config['dir']
+        self.write()
+        own = os.path.basename(self._path())
+        with open(os.path.join(directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                exited = _read_json(os.path.join(directory, EXITED_FILE)) or {'counters': [], 'histograms': []}
+                live, gone = [], []
+                for name in os.listdir(directory):
+                    if not name.endswith('.json') or name == EXITED_FILE:
+                        continue
+                    data = _read_json(os.path.join(directory, name))
+                    if data is None:
+                        continue
+                    # Only a process that is gone: a slow one still writes its file later
+                    if name == own or _pid_alive(data['pid']):
+                        live.append(data)
+                    else:
+                        gone.append((name, data))
+                if gone:
+                    exited = _merge([exited] + [data for _, data in gone])
+                    with open(os.path.join(directory, EXITED_FILE + '.tmp'), 'w') as f:
+                        json.dump(exited, f)
+                    os.replace(os.path.join(directory, EXITED_FILE + '.tmp'),
+                               os.path.join(directory, EXITED_FILE))
+                    for name, _ in gone:
+                        os.remove(os.path.join(directory, name))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return live, exited
+
+    # ------------------------------------------------------------
+    # Exposition
+    # ------------------------------------------------------------
+    def render(self):
+        """Prometheus text exposition (version 0.0.4) of every process."""
+        if self.config['dir'] and self.enabled:
+            live, exited = self._collect_files()
+        else:
+            live, exited = [self.snapshot()], {'counters': [], 'histograms': []}
+        totals = _merge(live + [exited])
+        gauges = [[n, labels + [['pid', data['pid']]], v] for data in live for n, labels, v in data['gauges']]
+
+        by_name = {}
+        for n, labels, v in totals['counters'] + gauges:
+            by_name.setdefault(n, []).append((labels, v))
+        for n, labels, h in totals['histograms']:
+            by_name.setdefault(n, []).append((labels, h))
+
+        lines = []
+        for name in sorted(by_name):
+            if name not in self._defs:
+                continue    # written by another version of the code
+            kind, help, buckets = self._defs[name]
+            full = PREFIX + name
+            lines.append(f'# HELP {full} {help}')
+            lines.append(f'# TYPE {full} {kind}')
+            for labels, value in sorted(by_name[name], key=lambda s: str(s[0])):
+                labels = [tuple(l) for l in labels]
+                if kind != 'histogram':
+                    lines.append(f'{full}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for le, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{_format_labels(labels, ("le", _format_value(le)))} {cumulative}')
+                lines.append(f'{full}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+                lines.append(f'{full}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'labels', 'start')
+
+    def __init__(self, registry, name, labels):
+        self.registry, self.name, self.labels = registry, name, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass            # exists, another user's
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None     # vanished or half-written by an old version: skip
+
+
+def _merge(snapshots):
+    """Sum counters and histograms (bucket by bucket) over snapshots."""
+    counters, histograms = {}, {}
+    for data in snapshots:
+        for n, labels, v in data['counters']:
+            key = (n, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + v
+        for n, labels, h in data['histograms']:
+            key = (n, tuple(map(tuple, labels)))
+            if key in histograms and len(histograms[key]) == len(h):
+                histograms[key] = [a + b for a, b in zip(histograms[key], h)]
+            else:
+                histograms[key] = list(h)
+    return {'counters': [[n, [list(x) for x in l], v] for (n, l), v in counters.items()],
+            'histograms': [[n, [list(x) for x in l], h] for (n, l), h in histograms.items()]}
+
+
+METRICS = Registry()
+atexit.register(lambda: METRICS.write())
+
+# ============================================================
+# METRIC CATALOGUE (defined here so every process can render all of them)
+# ============================================================
+HTTP_DURATION = METRICS.histogram('http_request_duration_seconds',
+                                  'Time to produce the response, by route')
+HTTP_REQUESTS = METRICS.counter('http_requests_total', 'Requests by route, method and status')
+DB_DURATION = METRICS.histogram('db_operation_duration_seconds',
+                                'Database operations of the signal/read paths, by op')
+SIGNALS = METRICS.counter('signals_total', 'Signals applied (committed), by signal type')
+TRADES_CLOSED = METRICS.counter('trades_closed_total',
+                                'Trades booked, by exit reason (signal, trailing_stop, fixed_sl)')
+TICK_LAG = METRICS.histogram('tick_lag_seconds',
+                             'From sent_at (price_updater send time) to commit', LAG_BUCKETS)
+POOL_CHECKOUT = METRICS.histogram('db_pool_checkout_seconds', 'Time to get a pooled connection')
+POOL_CONNECT = METRICS.histogram('db_connect_seconds', 'Time to open a new database connection')
+POOL_IN_USE = METRICS.gauge('db_pool_in_use', 'Connections checked out')
+POOL_EVENTS = METRICS.counter('db_pool_events_total',
+                              'Pool events: waits, timeouts, created, recycled, discarded, health_check_failures')
+OPEN_POSITIONS = METRICS.gauge('open_positions', 'Open positions held in memory')
+STREAM_SUBSCRIBERS = METRICS.gauge('stream_subscribers', 'Open /stream connections')
+INGEST_DEPTH = METRICS.gauge('ingest_queue_depth', 'Signals waiting in the async ingest queue')
+
+
+# ============================================================
+# STAGES: per-request timings of the DB operations (slow-request log)
+# ============================================================
+_stages = threading.local()
+
+
+def begin_stages():
+    """Start collecting the stage timings of this thread's request."""
+    _stages.timings = {}
+
+
+def record_stage(name, seconds):
+    """Add to the current request's stage (no-op outside a request)."""
+    timings = getattr(_stages, 'timings', None)
+    if timings is not None:
+        total, count = timings.get(name, (0.0, 0))
+        timings[name] = (total + seconds, count + 1)
+
+
+def end_stages():
+    """{stage: (seconds, calls)} of the request, and stop collecting."""
+    timings = getattr(_stages, 'timings', None) or {}
+    _stages.timings = None
+    return timings
+
+
+def _db_done(op, seconds):
+    METRICS.observe(DB_DURATION, seconds, op=op)
+    record_stage(op, seconds)
+
+
+class db_timer:
+    """Context manager timing a DB operation: db_operation_duration_seconds{op=...}
+    plus the request's stage timings."""
+    __slots__ = ('op', 'start')
+
+    def __init__(self, op):
+        self.op = op
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        _db_done(self.op, time.perf_counter() - self.start)
+
+
+def db_op(op):
+    """Decorator version of db_timer()."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _db_done(op, time.perf_counter() - start)
+        return wrapper
+    return decorator
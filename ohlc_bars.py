@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+OHLC Bars — Bloop Tracker
+`ohlc_bars`: open/high/low/close of signal prices per symbol and time bucket,
+at every OHLC_RESOLUTIONS resolution (1m, 5m, 1h).
+
+Bars are merged, never overwritten: merging the same bucket twice keeps the
+earliest open, the latest close (a late, out-of-order tick never replaces
+it) and the widest high/low, and adds the tick counts. So bars can be built
+from any split of the ticks (batches, chunks).
+
+Coverage: every signal with id >= bars_state.bars_from_id is in the bars.
+New signals are merged at ingest, in the insert's transaction. Older history
+is added by `flask --app webhook_server backfill-bars`, which walks ids
+downwards and lowers bars_from_id with each committed chunk (resumable).
+Retention rolls up ticks below bars_from_id before deleting them; above it
+they are already in the bars.
+"""
+
+import os
+from datetime import datetime, timezone
+
+from db import GREATEST, LEAST, USE_POSTGRES, q
+from db_time import TIME_TYPE, from_db, to_db
+from metrics import db_op
+from stats_summary import bump_version
+
+RESOLUTIONS = {'1m': 60, '5m': 300, '1h': 3600}   # name -> bucket seconds
+OHLC_RESOLUTIONS = [r for r in os.environ.get('OHLC_RESOLUTIONS', '1m,5m,1h').split(',')
+                    if r in RESOLUTIONS]
+BACKFILL_CHUNK = int(os.environ.get('OHLC_BACKFILL_CHUNK', 20000))   # signal ids per transaction
+
+BAR_FIELDS = ['symbol', 'resolution', 'bucket_start', 'open', 'high', 'low', 'close',
+              'ticks', 'first_ts', 'last_ts']
+BAR_TIME_FIELDS = ('bucket_start', 'first_ts', 'last_ts')
+
+
+def create_bars_table(conn):
+    """Caller commits."""
+    c = conn.cursor()
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS ohlc_bars (
+            symbol TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket_start {TIME_TYPE} NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            ticks INTEGER NOT NULL,
+            first_ts {TIME_TYPE} NOT NULL,
+            last_ts {TIME_TYPE} NOT NULL,
+            PRIMARY KEY (symbol, resolution, bucket_start)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bars_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            bars_from_id INTEGER NOT NULL
+        )
+    ''')
+    c.execute('SELECT 1 FROM bars_state WHERE id = 1')
+    if c.fetchone() is None:
+        # Existing history is not in the bars yet: that's backfill-bars' job
+        c.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM signals')
+        c.execute(q('INSERT INTO bars_state (id, bars_from_id) VALUES (1, ?)'), (c.fetchone()[0],))
+
+
+def bucket_start(timestamp, seconds):
+    """UTC isoformat timestamp -> isoformat start of its bucket."""
+    epoch = int(datetime.fromisoformat(timestamp).timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, timezone.utc).isoformat()
+
+
+def rollup(ticks, resolution):
+    """Bars for (timestamp, symbol, price) ticks (any order; ties keep input order)."""
+    seconds = RESOLUTIONS[resolution]
+    bars = {}
+    for ts, symbol, price in ticks:
+        if not price:
+            continue   # missing price (parse_signal stores 0)
+        symbol = symbol or 'USTEC'
+        key = (symbol, bucket_start(ts, seconds))
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = {'symbol': symbol, 'resolution': resolution, 'bucket_start': key[1],
+                         'open': price, 'high': price, 'low': price, 'close': price,
+                         'ticks': 1, 'first_ts': ts, 'last_ts': ts}
+        else:
+            bar['high'] = max(bar['high'], price)
+            bar['low'] = min(bar['low'], price)
+            bar['ticks'] += 1
+            if ts < bar['first_ts']:
+                bar['open'], bar['first_ts'] = price, ts
+            if ts >= bar['last_ts']:
+                bar['close'], bar['last_ts'] = price, ts
+    return list(bars.values())
+
+
+MERGE_BAR_SQL = q(f'''
+    INSERT INTO ohlc_bars ({', '.join(BAR_FIELDS)})
+    VALUES ({', '.join('?' * len(BAR_FIELDS))})
+    ON CONFLICT (symbol, resolution, bucket_start) DO UPDATE SET
+        open = CASE WHEN excluded.first_ts < ohlc_bars.first_ts THEN excluded.open ELSE ohlc_bars.open END,
+        close = CASE WHEN excluded.last_ts >= ohlc_bars.last_ts THEN excluded.close ELSE ohlc_bars.close END,
+        high = {GREATEST}(ohlc_bars.high, excluded.high),
+        low = {LEAST}(ohlc_bars.low, excluded.low),
+        ticks = ohlc_bars.ticks + excluded.ticks,
+        first_ts = {LEAST}(ohlc_bars.first_ts, excluded.first_ts),
+        last_ts = {GREATEST}(ohlc_bars.last_ts, excluded.last_ts)
+''')
+
+
+def merge_bars(conn, bars):
+    """Upsert-merge bars into ohlc_bars. Caller commits."""
+    if bars:
+        c = conn.cursor()
+        c.executemany(MERGE_BAR_SQL, [[to_db(bar[f]) if f in BAR_TIME_FIELDS else bar[f]
+                                       for f in BAR_FIELDS] for bar in bars])
+
+
+@db_op('bars_merge')
+def merge_signals(conn, sigs):
+    """Fold just-inserted signals (dicts) into every resolution. Caller commits."""
+    ticks = [(s['timestamp'], s['symbol'], s['price']) for s in sigs]
+    for resolution in OHLC_RESOLUTIONS:
+        merge_bars(conn, rollup(ticks, resolution))
+
+
+def lock_bars_state(conn):
+    """Start a write transaction serialized on bars_state. Returns bars_from_id.
+
+    Backfill and retention both decide which rows to roll up from
+    bars_from_id; taking this lock first keeps them from rolling up the same
+    rows twice.
+    """
+    c = conn.cursor()
+    if USE_POSTGRES:
+        c.execute('SELECT bars_from_id FROM bars_state WHERE id = 1 FOR UPDATE')
+    else:
+        if not conn.in_transaction:
+            c.execute('BEGIN IMMEDIATE')
+        c.execute('SELECT bars_from_id FROM bars_state WHERE id = 1')
+    return c.fetchone()[0]
+
+
+def backfill_chunk(conn, chunk=BACKFILL_CHUNK):
+    """Merge the next chunk of signals below bars_from_id and commit.
+
+    Returns (ids_lo, signals_merged), or None when history is fully covered.
+    """
+    from_id = lock_bars_state(conn)
+    c = conn.cursor()
+    c.execute(q('SELECT MIN(id) FROM signals WHERE id < ?'), (from_id,))
+    lowest = c.fetchone()[0]
+    if lowest is None:
+        conn.rollback()
+        return None
+    lo = max(lowest, from_id - chunk)
+    c.execute(q('''SELECT timestamp, symbol, price FROM signals
+                 WHERE id >= ? AND id < ? ORDER BY timestamp, id'''), (lo, from_id))
+    ticks = [(from_db(ts), symbol, price) for ts, symbol, price in c.fetchall()]
+    for resolution in OHLC_RESOLUTIONS:
+        merge_bars(conn, rollup(ticks, resolution))
+    c.execute(q('UPDATE bars_state SET bars_from_id = ? WHERE id = 1'), (lo,))
+    bump_version(conn)   # /bars bodies cached under the old version are stale now
+    conn.commit()
+    return lo, len(ticks)
+
+
+BAR_QUERY_FIELDS = ['bucket_start', 'open', 'high', 'low', 'close', 'ticks']
+
+
+def read_bars(conn, symbol, resolution, start=None, end=None, limit=None):
+    """Bars with start <= bucket_start < end (isoformat), oldest first."""
+    sql = f'''SELECT {', '.join(BAR_QUERY_FIELDS)} FROM ohlc_bars
+              WHERE symbol = ? AND resolution = ?'''
+    params = [symbol, resolution]
+    if start:
+        sql += ' AND bucket_start >= ?'
+        params.append(to_db(start))
+    if end:
+        sql += ' AND bucket_start < ?'
+        params.append(to_db(end))
+    sql += ' ORDER BY bucket_start'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    c = conn.cursor()
+    c.execute(q(sql), params)
+    return [(from_db(row[0]),) + tuple(row[1:]) for row in c.fetchall()]
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Position State — Bloop Tracker
+In-process, authoritative copy of the open positions (`open_positions`
+rows), one per (symbol, strategy) key.
+
+Each key has its own lock, so signals for different symbols/strategies are
+processed concurrently; a batch locks every key it touches, in sorted order.
+
+PRICE_UPDATE ticks only move max_price/min_price. Those changes are kept in
+memory and written behind: immediately when POSITION_FLUSH_INTERVAL is 0,
+otherwise at most once per interval (piggybacked on ticks, plus a background
+flusher so a quiet market still gets persisted). Opening and closing a
+position are always written in the signal's own transaction.
+
+Crash recovery: on load, extremes are rebuilt from each stored row plus every
+signal price of its key since entry_time, so ticks whose extremes never got
+flushed are not lost.
+
+POSITION_MODE=local (default): memory is authoritative, for a single worker
+process (any number of threads). POSITION_MODE=shared: for N gunicorn worker
+processes on one database. Each signal transaction takes a database lock per
+key (pg_advisory_xact_lock on PostgreSQL, BEGIN IMMEDIATE on SQLite) and
+re-reads the key's row under it. Extremes are written through (no
+write-behind), and readers re-read the rows, because other processes change
+them.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from db import USE_POSTGRES, q, table_columns
+from db_time import TIME_TYPE, from_db, to_db
+from metrics import db_op, record_stage
+from structured_log import log_event
+from trade_engine import DEFAULT_STRATEGY, DEFAULT_SYMBOL, position_key, track_extremes
+
+FLUSH_INTERVAL = float(os.environ.get('POSITION_FLUSH_INTERVAL', 0))
+SHARED = os.environ.get('POSITION_MODE', 'local') == 'shared'
+
+LOCK_CLASS = 0x426C6F70   # pg_advisory_xact_lock(class, key) namespace for position keys
+
+POSITION_FIELDS = ['symbol', 'strategy', 'direction', 'entry_time', 'entry_price',
+                   'atr', 'tp1', 'tp2', 'sl', 'max_price', 'min_price']
+
+
+def create_positions_table(conn):
+    """open_positions, keyed by (symbol, strategy). Caller commits.
+
+    Moves the row of the old `open_position` singleton (id = 1) over and
+    drops that table.
+    """
+    c = conn.cursor()
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS open_positions (
+            symbol TEXT NOT NULL,
+            strategy TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            entry_time {TIME_TYPE} NOT NULL,
+            entry_price REAL NOT NULL,
+            atr REAL,
+            tp1 REAL,
+            tp2 REAL,
+            sl REAL,
+            max_price REAL,
+            min_price REAL,
+            PRIMARY KEY (symbol, strategy)
+        )
+    ''')
+    legacy = table_columns(conn, 'open_position')
+    if not legacy:
+        return
+    cols = [f for f in POSITION_FIELDS if f in legacy]
+    c.execute(f'SELECT {", ".join(cols)} FROM open_position WHERE id = 1')
+    row = c.fetchone()
+    if row and dict(zip(cols, row)).get('direction'):
+        pos = dict.fromkeys(POSITION_FIELDS)
+        pos.update(zip(cols, row))
+        pos['entry_time'] = from_db(pos['entry_time'])
+        pos['symbol'], pos['strategy'] = position_key(pos)
+        write_position(conn, pos)
+    c.execute('DROP TABLE open_position')
+
+
+def _position_from_row(row):
+    if not row:
+        return None
+    pos = dict(zip(POSITION_FIELDS, row))
+    pos['entry_time'] = from_db(pos['entry_time'])
+    return pos
+
+
+def read_open_positions(conn):
+    """{(symbol, strategy): position} for every open position."""
+    c = conn.cursor()
+    c.execute(f'SELECT {", ".join(POSITION_FIELDS)} FROM open_positions')
+    return {position_key(pos): pos for pos in map(_position_from_row, c.fetchall())}
+
+
+@db_op('position_read')
+def read_open_position(conn, key):
+    c = conn.cursor()
+    c.execute(q(f'SELECT {", ".join(POSITION_FIELDS)} FROM open_positions '
+                'WHERE symbol = ? AND strategy = ?'), key)
+    return _position_from_row(c.fetchone())
+
+
+WRITE_POSITION_SQL = q(f'''
+    INSERT INTO open_positions ({', '.join(POSITION_FIELDS)})
+    VALUES ({', '.join('?' * len(POSITION_FIELDS))})
+    ON CONFLICT (symbol, strategy) DO UPDATE SET
+        {', '.join(f'{f} = excluded.{f}' for f in POSITION_FIELDS[2:])}
+''')
+
+
+@db_op('position_write')
+def write_position(conn, pos):
+    """Upsert the row of pos's key. Caller commits."""
+    c = conn.cursor()
+    c.execute(WRITE_POSITION_SQL, [to_db(pos[f]) if f == 'entry_time' else pos[f]
+                                   for f in POSITION_FIELDS])
+
+
+@db_op('position_delete')
+def delete_position(conn, key):
+    c = conn.cursor()
+    c.execute(q('DELETE FROM open_positions WHERE symbol = ? AND strategy = ?'), key)
+
+
+@db_op('position_lock')
+def lock_keys(conn, keys=None):
+    """Serialize writers of `keys` (every key when None) across processes,
+    until the transaction ends. Take it before reading the rows."""
+    c = conn.cursor()
+    if not USE_POSTGRES:
+        # One writer at a time for the whole database: locks every key
+        if not conn.in_transaction:
+            c.execute('BEGIN IMMEDIATE')
+    elif keys is None:
+        c.execute('LOCK TABLE open_positions IN EXCLUSIVE MODE')
+    else:
+        for key in sorted(set(keys)):
+            c.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', (LOCK_CLASS, '\x1f'.join(key)))
+
+
+@db_op('extremes_update')
+def write_extremes(conn, pos):
+    c = conn.cursor()
+    c.execute(q('UPDATE open_positions SET max_price = ?, min_price = ? WHERE symbol = ? AND strategy = ?'),
+              (pos['max_price'], pos['min_price']) + position_key(pos))
+
+
+class PositionTxn:
+    """Working copy of the positions touched by one DB transaction.
+
+    Mutations stay here until PositionState.commit(txn) is called after the
+    DB commit, so a rolled-back transaction never leaks into memory. Only
+    use keys whose lock is held (PositionState.locked).
+    """
+
+    def __init__(self, state):
+        self._state = state
+        self.positions = {}   # key -> working copy (None = flat)
+        self.dirty = {}       # key -> extremes not written yet
+        self.flushed = False
+        self.events = []      # (type, data) for the event stream, published after commit
+        self._announced = {}  # key -> (max, min) last sent to the stream (None if flat)
+
+    def get(self, key):
+        """The working copy of key's position (None if flat)."""
+        if key not in self.positions:
+            pos = self._state._positions.get(key)
+            self.positions[key] = dict(pos) if pos else None
+            self.dirty[key] = key in self._state._dirty
+            self._announced[key] = (pos['max_price'], pos['min_price']) if pos else None
+        return self.positions[key]
+
+    def update_extremes(self, key, price):
+        """Track max/min in memory. Returns True if either extreme moved."""
+        if not track_extremes(self.get(key), price):
+            return False
+        self.dirty[key] = True
+        return True
+
+    def opened(self, key, pos):
+        """A new position was written to the DB in this transaction."""
+        self.positions[key] = pos
+        self.dirty[key] = False
+        self._announced[key] = (pos['max_price'], pos['min_price'])
+
+    def closed(self, key):
+        """The position was booked as a trade in this transaction."""
+        self.positions[key] = None
+        self.dirty[key] = False
+        self._announced[key] = None
+
+    def moved_extremes(self):
+        """Open positions whose max/min moved since loaded or opened in this
+        transaction (one `extremes` event each, with the last values)."""
+        return [dict(pos) for key, pos in self.positions.items()
+                if pos and self._announced.get(key) not in (None, (pos['max_price'], pos['min_price']))]
+
+    def flush_if_due(self, conn):
+        """Write pending extremes of the touched keys when the flush interval has elapsed."""
+        if self.flushed or not self._state.flush_due():
+            return
+        for key, pos in self.positions.items():
+            if pos and self.dirty[key]:
+                write_extremes(conn, pos)
+                self.dirty[key] = False
+                self.flushed = True
+
+    def write_through(self, conn):
+        """Before commit, with no flush interval (always so in shared mode:
+        other workers read the rows): write every pending extreme, also the
+        ones a batch moved after its first flush."""
+        if self._state.flush_interval > 0:
+            return
+        for key, pos in self.positions.items():
+            if pos and self.dirty[key]:
+                write_extremes(conn, pos)
+                self.dirty[key] = False
+
+
+class PositionState:
+    """Owns the open positions, their extremes and the trailing-stop inputs."""
+
+    def __init__(self, connection_factory, flush_interval=FLUSH_INTERVAL, shared=SHARED):
+        self.connection_factory = connection_factory
+        self.shared = shared
+        # Shared: other processes read the rows, so extremes can't wait
+        self.flush_interval = 0 if shared else flush_interval
+        self._positions = {}            # key -> position dict
+        self._dirty = set()             # keys with extremes not written yet
+        self._locks = {}                # key -> RLock, held for the whole signal transaction
+        self._locks_guard = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._last_flush = time.monotonic()
+        self._pid = os.getpid()
+        self._flusher = None
+
+    def ensure_loaded(self, conn):
+        """Load from the DB once per process (gunicorn workers fork after import)."""
+        if self._loaded and self._pid == os.getpid():
+            return
+        with self._load_lock:
+            if self._loaded and self._pid == os.getpid():
+                return
+            stored = read_open_positions(conn)
+            self._positions = {key: recover_position(conn, pos) for key, pos in stored.items()}
+            self._dirty = {key for key, pos in self._positions.items() if pos != stored[key]}
+            self._loaded = True
+            self._pid = os.getpid()
+            self._last_flush = time.monotonic()
+            self._start_flusher()
+
+    def refresh(self, conn):
+        """Before reading snapshots. Shared mode re-reads every row (other
+        workers write them); local mode only loads once."""
+        if not self.shared:
+            return self.ensure_loaded(conn)
+        self._positions = read_open_positions(conn)
+        self._dirty = set()
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+            return lock
+
+    @contextmanager
+    def locked(self, keys=None, conn=None):
+        """Hold the locks of `keys` (sorted, so batches can't deadlock).
+
+        keys=None locks every key and blocks new ones (/reset). In shared
+        mode, conn's transaction also takes the database locks (lock_keys)
+        and the keys' rows are re-read.
+        """
+        keys = None if keys is None else sorted(set(keys))
+        with ExitStack() as stack:
+            started = time.perf_counter()
+            if keys is None:
+                stack.enter_context(self._locks_guard)
+                locks = [self._locks[k] for k in sorted(self._locks)]
+            else:
+                locks = [self._lock_for(k) for k in keys]
+            for lock in locks:
+                stack.enter_context(lock)
+            record_stage('lock_wait', time.perf_counter() - started)
+            if self.shared and conn is not None:
+                lock_keys(conn, keys)
+                if keys is not None:
+                    self._reload(conn, keys)
+            yield
+
+    def _reload(self, conn, keys):
+        for key in keys:
+            pos = read_open_position(conn, key)
+            if pos:
+                self._positions[key] = pos
+            else:
+                self._positions.pop(key, None)
+            self._dirty.discard(key)
+
+    def snapshot(self, key):
+        pos = self._positions.get(key)
+        return dict(pos) if pos else None
+
+    def positions(self, symbol=None, strategy=None):
+        """Open positions, optionally filtered by symbol and/or strategy."""
+        return [dict(pos) for (sym, strat), pos in sorted(self._positions.items())
+                if symbol in (None, sym) and strategy in (None, strat)]
+
+    def begin(self):
+        """Start a working copy. Call with the locks of the keys it touches held."""
+        return PositionTxn(self)
+
+    def commit(self, txn):
+        """Adopt the working copy once its DB transaction has committed."""
+        if txn.flushed:
+            self._last_flush = time.monotonic()
+        for key, pos in txn.positions.items():
+            if pos:
+                self._positions[key] = pos
+            else:
+                self._positions.pop(key, None)
+            if pos and txn.dirty[key]:
+                self._dirty.add(key)
+            else:
+                self._dirty.discard(key)
+
+    def flush_due(self):
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self, conn):
+        """Persist pending extremes now. Returns True if something was written."""
+        keys = set(self._dirty)
+        if not keys:
+            return False
+        with self.locked(keys):
+            written = [key for key in keys if key in self._dirty and key in self._positions]
+            for key in written:
+                write_extremes(conn, self._positions[key])
+            conn.commit()
+            self._dirty.difference_update(written)
+            self._last_flush = time.monotonic()
+            return bool(written)
+
+    def reset(self):
+        """Forget every position. Call inside locked()."""
+        self._positions = {}
+        self._dirty = set()
+
+    def flush_now(self):
+        """Flush through a fresh checkout (shutdown hook, background flusher)."""
+        if not self._dirty:
+            return False
+        with self.connection_factory() as conn:
+            return self.flush(conn)
+
+    def _start_flusher(self):
+        """Background thread flushing pending extremes every flush_interval."""
+        if self.flush_interval <= 0 or (self._flusher and self._flusher.is_alive()):
+            return
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush_now()
+                except Exception as e:
+                    log_event('position_flush', '❌ Position flush error: %s', e, level=logging.ERROR, error=str(e))
+
+        self._flusher = threading.Thread(target=run, name='position-flusher', daemon=True)
+        self._flusher.start()
+
+
+def recover_position(conn, stored):
+    """Fold signal prices the last flush may have missed into the stored row."""
+    if not stored:
+        return None
+    pos = dict(stored)
+    c = conn.cursor()
+    c.execute(q('''SELECT MAX(price), MIN(price) FROM signals
+                   WHERE symbol = ? AND strategy = ? AND timestamp >= ?'''),
+              position_key(pos) + (to_db(pos['entry_time']),))
+    hi, lo = c.fetchone()
+    if hi is not None:
+        pos['max_price'] = max(pos['max_price'] or hi, hi)
+        pos['min_price'] = min(pos['min_price'] or lo, lo)
+    return pos
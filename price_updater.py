@@ -11,15 +11,21 @@ IC Markets price from the webhook (LONG/SHORT signal entry/exit prices).
 
 import json
 import os
+import threading
 import time
+import urllib.parse
 import urllib.request
 import sys
 from datetime import datetime, timezone
 
 WEBHOOK_URL = "http://127.0.0.1:5555/webhook"
+BATCH_URL = "http://127.0.0.1:5555/webhook/batch"
 STATS_URL = "http://127.0.0.1:5555/stats"
+STREAM_URL = "http://127.0.0.1:5555/stream"
 SYMBOL = "USTEC"
-INTERVAL_SECONDS = 60
+INTERVAL_SECONDS = float(os.environ.get("PRICE_UPDATE_INTERVAL", 60))
+BATCH_SIZE = int(os.environ.get("PRICE_UPDATE_BATCH", 1))  # ticks per POST (1 = send each tick)
+STREAM_RETRY_SECONDS = 5   # pause before reconnecting to /stream
 
 YAHOO_URL = "https://query1.finance.yahoo.com/v8/finance/chart/NQ=F?interval=1m&range=1m"
 
@@ -50,8 +56,68 @@ def fetch_nq_price():
     return round(price, 2)
 
 
+# Open position of SYMBOL as pushed by /stream (see follow_stream);
+# 'changes' counts opens/closes, so main() can flush buffered ticks
+LIVE_POSITION = {'connected': False, 'entry_price': None, 'changes': 0}
+
+
+def apply_stream_event(event, data):
+    if event == 'snapshot':
+        positions = [p for p in data['positions'] if p['strategy'] == 'default']
+        LIVE_POSITION['entry_price'] = positions[0]['entry_price'] if positions else None
+        LIVE_POSITION['connected'] = True
+    elif event == 'position_opened':
+        LIVE_POSITION['entry_price'] = data['entry_price']
+        LIVE_POSITION['changes'] += 1
+    elif event in ('trade_closed', 'reset'):
+        LIVE_POSITION['entry_price'] = None
+        LIVE_POSITION['changes'] += 1
+
+
+def follow_stream(secret):
+    """Background thread: keep LIVE_POSITION current from the server's
+    /stream (Server-Sent Events), so each tick doesn't poll /stats.
+    Reconnects with Last-Event-ID; get_last_ic_price falls back to /stats
+    while disconnected.
+
+    A fresh stream starts with a snapshot; a resumed one only replays what
+    was missed, on top of LIVE_POSITION as it was, so it counts as
+    connected as soon as the server accepts it."""
+    query = urllib.parse.urlencode({'symbol': SYMBOL, 'strategy': 'default',
+                                    'types': 'position_opened,trade_closed,reset'})
+    last_id = None
+    while True:
+        try:
+            headers = {"X-Webhook-Secret": secret, "Accept": "text/event-stream"}
+            if last_id:
+                headers["Last-Event-ID"] = last_id
+            req = urllib.request.Request(f"{STREAM_URL}?{query}", headers=headers)
+            with urllib.request.urlopen(req, timeout=60) as resp:   # heartbeats every 15s
+                if last_id:
+                    # Replay of what was missed, or a snapshot if the id expired
+                    LIVE_POSITION['connected'] = True
+                event, data = None, []
+                for raw in resp:
+                    line = raw.decode().rstrip('\r\n')
+                    if line.startswith('id:'):
+                        last_id = line[3:].strip()
+                    elif line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data.append(line[5:].strip())
+                    elif not line and event:
+                        apply_stream_event(event, json.loads('\n'.join(data)))
+                        event, data = None, []
+        except Exception as e:
+            print(f"Stream disconnected ({e}), polling /stats until it's back")
+        LIVE_POSITION['connected'] = False
+        time.sleep(STREAM_RETRY_SECONDS)
+
+
 def get_last_ic_price():
     """Get the last known IC Markets price from the open position or last trade."""
+    if LIVE_POSITION['connected']:
+        return LIVE_POSITION['entry_price']
     with urllib.request.urlopen(STATS_URL, timeout=10) as resp:
         data = json.loads(resp.read().decode())
 
@@ -68,6 +134,7 @@ def send_price_update(price, secret):
         "price": price,
         "symbol": SYMBOL,
         "secret": secret,
+        "sent_at": time.time(),   # server-side tick lag (bloop_tick_lag_seconds)
     }).encode()
 
     req = urllib.request.Request(
@@ -80,6 +147,35 @@ def send_price_update(price, secret):
         return json.loads(resp.read().decode())
 
 
+def send_price_batch(ticks, secret):
+    """Send buffered PRICE_UPDATE ticks (each with its own timestamp) in one POST."""
+    payload = json.dumps({
+        "secret": secret,
+        "symbol": SYMBOL,
+        "ticks": ticks,
+        "sent_at": time.time(),
+    }).encode()
+
+    req = urllib.request.Request(
+        BATCH_URL,
+        data=payload,
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read().decode())
+
+
+def flush_batch(pending, secret, now, reason):
+    """POST the buffered ticks (if any). Returns the new, empty buffer."""
+    if pending:
+        result = send_price_batch(pending, secret)
+        closes = result.get('closed_trades', 0)
+        print(f"[{now}] PRICE_UPDATE batch ({len(pending)}, {reason}) last @ {pending[-1]['price']:.2f} — "
+              f"closes: {closes} — stale: {result.get('stale_ticks', 0)} — signals: {result.get('total_signals', '?')}")
+    return []
+
+
 def main():
     secret = get_webhook_secret()
     if not secret:
@@ -87,11 +183,14 @@ def main():
         sys.exit(1)
 
     print(f"Bloop Price Updater (delta mode) — polling every {INTERVAL_SECONDS}s")
-    print(f"Webhook: {WEBHOOK_URL}")
+    threading.Thread(target=follow_stream, args=(secret,), name='stream', daemon=True).start()
+    print(f"Webhook: {WEBHOOK_URL}" + (f" (batches of {BATCH_SIZE})" if BATCH_SIZE > 1 else ""))
 
     consecutive_errors = 0
     prev_nq = None       # Previous NQ=F price for delta calculation
     ic_baseline = None   # Last known IC Markets price (anchor point)
+    pending = []         # Ticks buffered for the next batch POST
+    changes = 0          # LIVE_POSITION['changes'] the buffer was started at
 
     while True:
         try:
@@ -120,12 +219,26 @@ def main():
                     ic_baseline = current_ic
                     estimated_price = ic_baseline
                     print(f"[{now}] Recalibrated: new IC price={ic_baseline:.2f}")
+                    # Buffered ticks predate the new position: send them now, not after it
+                    pending = flush_batch(pending, secret, now, 'position changed')
                 else:
                     ic_baseline += delta
                     estimated_price = ic_baseline
 
-            result = send_price_update(round(estimated_price, 2), secret)
-            print(f"[{now}] PRICE_UPDATE @ {estimated_price:.2f} (NQ={nq_price:.2f}, delta={nq_price - (prev_nq or nq_price):+.2f}) — signals: {result.get('total_signals', '?')}")
+            if BATCH_SIZE > 1:
+                if LIVE_POSITION['changes'] != changes:
+                    changes = LIVE_POSITION['changes']
+                    pending = flush_batch(pending, secret, now, 'position changed')
+                pending.append({
+                    "signal": "PRICE_UPDATE",
+                    "price": round(estimated_price, 2),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                })
+                if len(pending) >= BATCH_SIZE:
+                    pending = flush_batch(pending, secret, now, 'full')
+            else:
+                result = send_price_update(round(estimated_price, 2), secret)
+                print(f"[{now}] PRICE_UPDATE @ {estimated_price:.2f} (NQ={nq_price:.2f}, delta={nq_price - (prev_nq or nq_price):+.2f}) — signals: {result.get('total_signals', '?')}")
             consecutive_errors = 0
 
         except Exception as e:
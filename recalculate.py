@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Recalculate — Bloop Tracker
+Re-price net P&L of historical trades after a spread change (POST /recalculate).
+
+Set-based: each chunk is one UPDATE ... FROM joining trades against the
+job's per-symbol spreads (inline CTE, same join as the dry run), over a
+bounded id range and committed on its own, so the webhook is never blocked
+for longer than one chunk. A spread changed mid-job only applies to the next.
+
+Jobs are recorded in `recalc_jobs` (spreads used, id range, high-water mark)
+and can be resumed after a crash or restart from the last committed chunk.
+The UPDATE recomputes from pnl_points, so re-running a chunk is harmless.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from db import USE_POSTGRES, q
+from stats_summary import bump_version, read_summary, rebuild_trade_totals
+
+CHUNK_SIZE = int(os.environ.get('RECALC_CHUNK_SIZE', 5000))   # trade ids per transaction
+
+JOB_FIELDS = ['id', 'status', 'spreads', 'default_spread', 'chunk_size',
+              'min_id', 'max_id', 'last_id', 'trades_updated', 'chunks',
+              'error', 'started_at', 'updated_at', 'finished_at']
+
+
+def _new_spreads(spreads):
+    """WITH new_spreads CTE over {symbol: spread_points}, and its params."""
+    if spreads:
+        values = ', '.join(['(?, ?)'] * len(spreads))
+        params = [v for item in spreads.items() for v in item]
+    else:
+        values, params = "(CAST(NULL AS TEXT), CAST(NULL AS REAL))", []
+    return f'WITH new_spreads (symbol, spread_points) AS (VALUES {values})', params
+
+
+# Trades with their new spread: per-symbol, the ? default for unknown/NULL symbols
+SPREAD_JOIN = '''
+    SELECT t.id, t.pnl_points, t.pnl_net_points, t.spread_cost,
+           COALESCE(ss.spread_points, ?) AS spread
+    FROM trades t
+    LEFT JOIN new_spreads ss ON ss.symbol = t.symbol
+'''
+
+
+_active = set()            # job ids running in this process
+_active_lock = threading.Lock()
+
+
+class JobBusy(Exception):
+    """The job is already running in this process."""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def create_recalc_tables(conn):
+    """symbol_spreads + recalc_jobs. Caller commits."""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS symbol_spreads (
+            symbol TEXT PRIMARY KEY,
+            spread_points REAL NOT NULL
+        )
+    ''')
+    serial = 'SERIAL' if USE_POSTGRES else 'INTEGER'
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS recalc_jobs (
+            id {serial} PRIMARY KEY,
+            status TEXT NOT NULL,
+            spreads TEXT NOT NULL,
+            default_spread REAL NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            min_id INTEGER NOT NULL,
+            max_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            trades_updated INTEGER NOT NULL DEFAULT 0,
+            chunks INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            started_at TEXT,
+            updated_at TEXT,
+            finished_at TEXT
+        )
+    ''')
+
+
+def sync_spreads(conn, spreads):
+    """Upsert {symbol: spread_points} into symbol_spreads. Caller commits."""
+    c = conn.cursor()
+    for symbol, points in spreads.items():
+        c.execute(q('''
+            INSERT INTO symbol_spreads (symbol, spread_points) VALUES (?, ?)
+            ON CONFLICT (symbol) DO UPDATE SET spread_points = excluded.spread_points
+        '''), (symbol, points))
+
+
+# ============================================================
+# DRY RUN
+# ============================================================
+def preview_totals(conn, spreads, default_spread):
+    """Net aggregates as they would be after recalculating, without writing.
+
+    The spreads are passed inline (CTE), symbol_spreads is left untouched.
+    """
+    with_spreads, params = _new_spreads(spreads)
+    c = conn.cursor()
+    c.execute(q(f'''
+        {with_spreads}
+        SELECT COUNT(*),
+               SUM(CASE WHEN pnl_points IS NOT NULL THEN 1 ELSE 0 END),
+               COALESCE(SUM(net), 0),
+               COALESCE(SUM(CASE WHEN net > 0 THEN 1 ELSE 0 END), 0),
+               MAX(net),
+               MIN(net),
+               COALESCE(SUM(cost), 0)
+        FROM (
+            SELECT pnl_points,
+                   CASE WHEN pnl_points IS NULL THEN pnl_net_points ELSE pnl_points - spread END AS net,
+                   CASE WHEN pnl_points IS NULL THEN spread_cost ELSE spread END AS cost
+            FROM ({SPREAD_JOIN}) j
+        ) x
+    '''), params + [default_spread])
+    row = c.fetchone()
+    current = read_summary(conn)
+    keys = ['net_pnl', 'net_winners', 'net_best', 'net_worst', 'spread_total']
+    return {
+        'dry_run': True,
+        'trades': row[0],
+        'trades_to_update': row[1] or 0,
+        'current': {k: current[k] for k in keys},
+        'new': dict(zip(keys, row[2:])),
+    }
+
+
+# ============================================================
+# JOBS
+# ============================================================
+def _job_from_row(row):
+    if not row:
+        return None
+    job = dict(zip(JOB_FIELDS, row))
+    job['spreads'] = json.loads(job['spreads'])
+    span = job['max_id'] - job['min_id'] + 1
+    done = min(max(job['last_id'] - job['min_id'] + 1, 0), span)
+    job['progress'] = round(done / span * 100, 1) if span > 0 else 100.0
+    return job
+
+
+def read_job(conn, job_id):
+    c = conn.cursor()
+    c.execute(q(f'SELECT {", ".join(JOB_FIELDS)} FROM recalc_jobs WHERE id = ?'), (job_id,))
+    return _job_from_row(c.fetchone())
+
+
+def list_jobs(conn, limit=20):
+    c = conn.cursor()
+    c.execute(q(f'SELECT {", ".join(JOB_FIELDS)} FROM recalc_jobs ORDER BY id DESC LIMIT ?'), (limit,))
+    return [_job_from_row(r) for r in c.fetchall()]
+
+
+def create_job(conn, spreads, default_spread, chunk_size=CHUNK_SIZE):
+    """Record a job over the trades that exist now. Commits. Returns the job."""
+    c = conn.cursor()
+    c.execute('SELECT MIN(id), MAX(id) FROM trades')
+    min_id, max_id = c.fetchone()
+    if min_id is None:
+        min_id, max_id = 1, 0   # empty table: nothing to do
+    now = _now()
+    c.execute(q('''
+        INSERT INTO recalc_jobs (status, spreads, default_spread, chunk_size,
+                                 min_id, max_id, last_id, started_at, updated_at)
+        VALUES ('pending', ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    '''), (json.dumps(spreads), default_spread, chunk_size,
+           min_id, max_id, min_id - 1, now, now))
+    job_id = c.fetchone()[0]
+    conn.commit()
+    return read_job(conn, job_id)
+
+
+def _update_chunk(conn, job, lo, hi):
+    """Re-price trades with lo < id <= hi at the job's spreads. Returns rows updated.
+
+    The CTE goes inside FROM: sqlite3 reports no rowcount for a statement
+    starting with WITH.
+    """
+    with_spreads, params = _new_spreads(job['spreads'])
+    c = conn.cursor()
+    c.execute(q(f'''
+        UPDATE trades SET
+            spread_cost = j.spread,
+            pnl_net_points = j.pnl_points - j.spread,
+            pnl_net_percent = CASE WHEN trades.entry_price IS NOT NULL AND trades.entry_price <> 0
+                                   THEN (j.pnl_points - j.spread) / trades.entry_price * 100
+                                   ELSE 0 END
+        FROM ({with_spreads} {SPREAD_JOIN} WHERE t.id > ? AND t.id <= ? AND t.pnl_points IS NOT NULL) j
+        WHERE trades.id = j.id
+    '''), params + [job['default_spread'], lo, hi])
+    return c.rowcount
+
+
+def run_job(connection_factory, job_id, on_chunk=None):
+    """Run (or resume) a job to completion, one committed chunk at a time.
+
+    Raises JobBusy if this process is already running it. Returns the final
+    job; a failing chunk marks the job 'failed' (resumable) and re-raises.
+    """
+    with _active_lock:
+        if job_id in _active:
+            raise JobBusy(f'recalc job {job_id} is already running')
+        _active.add(job_id)
+    try:
+        with connection_factory() as conn:
+            job = read_job(conn, job_id)
+            if job is None or job['status'] == 'done':
+                return job
+            c = conn.cursor()
+            c.execute(q("UPDATE recalc_jobs SET status = 'running', error = NULL, updated_at = ? WHERE id = ?"),
+                      (_now(), job_id))
+            conn.commit()
+
+            last_id, chunks, updated = job['last_id'], job['chunks'], job['trades_updated']
+            try:
+                while last_id < job['max_id']:
+                    hi = min(last_id + job['chunk_size'], job['max_id'])
+                    updated += _update_chunk(conn, job, last_id, hi)
+                    last_id, chunks = hi, chunks + 1
+                    # Progress committed with the chunk it describes
+                    c.execute(q('''UPDATE recalc_jobs SET last_id = ?, chunks = ?, trades_updated = ?,
+                                   updated_at = ? WHERE id = ?'''),
+                              (last_id, chunks, updated, _now(), job_id))
+                    bump_version(conn)
+                    conn.commit()
+                    if on_chunk:
+                        on_chunk(read_job(conn, job_id))
+
+                # Holds off add_trade until commit: a trade closed meanwhile isn't overwritten
+                rebuild_trade_totals(conn)
+                now = _now()
+                c.execute(q("UPDATE recalc_jobs SET status = 'done', updated_at = ?, finished_at = ? WHERE id = ?"),
+                          (now, now, job_id))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                c.execute(q("UPDATE recalc_jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?"),
+                          (str(e), _now(), job_id))
+                conn.commit()
+                raise
+            return read_job(conn, job_id)
+    finally:
+        with _active_lock:
+            _active.discard(job_id)
+
+
+def is_running_here(job_id):
+    with _active_lock:
+        return job_id in _active
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Response Cache — Bloop Tracker
+Conditional GET for the polled read endpoints (/stats, /trades, /signals,
+/position).
+
+Every write bumps `data_version` (stats_summary + stats_by_key). A GET reads
+it first (a sum over a few rows), then:
+  - If-None-Match matches the current ETag  -> 304, no query on the data tables
+  - a response for this URL at this version is cached -> served from memory
+  - otherwise the view runs and its body is cached under the version
+Bodies are cached already compressed, one entry per negotiated encoding.
+Entries of older versions are never served: the version is part of the key.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from serialization import compress_response, negotiate_encoding
+
+CACHE_ENTRIES = int(os.environ.get('RESPONSE_CACHE_ENTRIES', 128))   # 0 = ETag only, no cache
+
+# Headers worth replaying from a cached response (the rest Flask recomputes)
+CACHED_HEADERS = ('X-Next-Cursor', 'Link', 'Content-Encoding')
+
+
+class ResponseCache:
+    """Small LRU of rendered bodies keyed by (version, url, representation)."""
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses,
+                    'not_modified': self.not_modified}
+
+
+def conditional_get(cache, current_version):
+    """Decorator for GET views whose output only changes with data_version.
+
+    current_version() returns the counter (reads it from the DB).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Read the version before rendering: if a write lands meanwhile the
+            # body may be newer than its ETag, never older.
+            version = current_version()
+            etag = f'v{version}'
+            # Weak: the same data in any Content-Encoding shares the ETag
+            if request.if_none_match.contains_weak(etag):
+                with cache._lock:
+                    cache.not_modified += 1
+                return _with_validators(Response(status=304), etag)
+
+            encoding = negotiate_encoding(request.accept_encodings)
+            key = (version, request.full_path, request.accept_mimetypes.best, encoding)
+            entry = cache.get(key)
+            if entry is not None:
+                status, body, mimetype, headers = entry
+                return _with_validators(Response(body, status=status, mimetype=mimetype,
+                                                 headers=headers), etag)
+
+            response = view(*args, **kwargs)
+            if isinstance(response, tuple):
+                return response   # errors (status given explicitly) are not cached
+            compress_response(response, request.accept_encodings)
+            if response.status_code == 200 and not response.is_streamed:
+                headers = [(h, response.headers[h]) for h in CACHED_HEADERS if h in response.headers]
+                cache.put(key, (200, response.get_data(), response.mimetype, headers))
+            return _with_validators(response, etag)
+        return wrapper
+    return decorator
+
+
+def _with_validators(response, etag):
+    response.set_etag(etag, weak=True)
+    # Clients keep the body but revalidate every time (cheap 304)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Retention — Bloop Tracker
+Compaction of old PRICE_UPDATE ticks, the bulk of the `signals` table.
+
+Policies (env, 0 = disabled, which is the default):
+  RETENTION_TICK_DAYS     ticks older than this are deleted, after rolling up
+                          into ohlc_bars the ones the bars don't cover yet (see
+                          ohlc_bars.py). LONG/SHORT signals are never touched.
+  RETENTION_PAYLOAD_DAYS  raw_payload of ticks older than this is dropped
+                          (the parsed columns stay).
+
+Work is done in batches of RETENTION_BATCH_SIZE rows, one short transaction
+each (roll-up + delete + counter), so the webhook is never held up for long.
+Deleted ticks are added to stats_summary.signals_compacted, which keeps
+/stats totals (and repair-stats rebuilds) unchanged after compaction.
+
+SQLite: freed pages are returned with PRAGMA incremental_vacuum when the
+database uses auto_vacuum=INCREMENTAL (set by init_db on new databases; for
+an existing file run `flask --app webhook_server compact --vacuum` once).
+PostgreSQL: autovacuum reclaims the space.
+
+One process per host runs the job (file lock), every RETENTION_INTERVAL
+seconds; `flask --app webhook_server compact` runs a pass by hand.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import USE_POSTGRES, q
+from db_time import from_db, to_db
+from ohlc_bars import OHLC_RESOLUTIONS, lock_bars_state, merge_bars, rollup
+from position_state import position_key
+from stats_summary import add_compacted
+from structured_log import log_event
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+RETENTION_CONFIG = {
+    'tick_days': float(os.environ.get('RETENTION_TICK_DAYS', 0)),
+    'payload_days': float(os.environ.get('RETENTION_PAYLOAD_DAYS', 0)),
+    'batch_size': int(os.environ.get('RETENTION_BATCH_SIZE', 5000)),
+    'batch_pause': float(os.environ.get('RETENTION_BATCH_PAUSE', 0.05)),   # seconds between batches
+    'interval': float(os.environ.get('RETENTION_INTERVAL', 3600)),
+    'vacuum_pages': int(os.environ.get('RETENTION_VACUUM_PAGES', 5000)),  # SQLite, per pass
+    'lock_path': os.environ.get('RETENTION_LOCK_PATH', os.path.join(HERE, 'retention.lock')),
+}
+
+# Position recovery folds in tick prices since entry_time: never compact the
+# most recent day, whatever the policy says.
+MIN_TICK_DAYS = 1.0
+
+
+def enabled(config=RETENTION_CONFIG):
+    return config['tick_days'] > 0 or config['payload_days'] > 0
+
+
+def cutoff(days, now=None):
+    """UTC cutoff (column value), floored to the minute so no 1m bucket is split."""
+    now = now or datetime.now(timezone.utc)
+    return to_db((now - timedelta(days=days)).replace(second=0, microsecond=0))
+
+
+def _in_list(ids):
+    return f"({', '.join('?' * len(ids))})"
+
+
+def compact_ticks(conn, before, batch_size, pause=0.0):
+    """Roll up and delete PRICE_UPDATE rows older than `before`. Returns rows deleted."""
+    total = 0
+    c = conn.cursor()
+    while True:
+        bars_from_id = lock_bars_state(conn)
+        c.execute(q('''
+            SELECT id, timestamp, symbol, price, strategy FROM signals
+            WHERE signal = 'PRICE_UPDATE' AND timestamp < ?
+            ORDER BY timestamp, id
+            LIMIT ?
+        '''), (before, batch_size))
+        rows = c.fetchall()
+        if not rows:
+            conn.rollback()
+            return total
+        # Rows from bars_from_id on are already in the bars (merged at ingest)
+        ticks = [(from_db(ts), symbol, price) for row_id, ts, symbol, price, _ in rows if row_id < bars_from_id]
+        for resolution in OHLC_RESOLUTIONS:
+            merge_bars(conn, rollup(ticks, resolution))
+        ids = [r[0] for r in rows]
+        c.execute(q(f'DELETE FROM signals WHERE id IN {_in_list(ids)}'), ids)
+        add_compacted(conn, [position_key({'symbol': r[2], 'strategy': r[4]}) for r in rows])
+        conn.commit()
+        total += len(ids)
+        if len(rows) < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def strip_payloads(conn, before, batch_size, pause=0.0):
+    """NULL raw_payload on PRICE_UPDATE rows older than `before`. Returns rows updated."""
+    total = 0
+    c = conn.cursor()
+    while True:
+        c.execute(q('''
+            SELECT id FROM signals
+            WHERE signal = 'PRICE_UPDATE' AND timestamp < ? AND raw_payload IS NOT NULL
+            LIMIT ?
+        '''), (before, batch_size))
+        ids = [r[0] for r in c.fetchall()]
+        if not ids:
+            return total
+        c.execute(q(f'UPDATE signals SET raw_payload = NULL WHERE id IN {_in_list(ids)}'), ids)
+        conn.commit()
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def pending(conn, config=RETENTION_CONFIG, now=None):
+    """Rows each policy would touch now (dry run)."""
+    c = conn.cursor()
+    report = {}
+    if config['tick_days'] > 0:
+        c.execute(q("SELECT COUNT(*) FROM signals WHERE signal = 'PRICE_UPDATE' AND timestamp < ?"),
+                  (cutoff(max(config['tick_days'], MIN_TICK_DAYS), now),))
+        report['ticks_to_compact'] = c.fetchone()[0]
+    if config['payload_days'] > 0:
+        c.execute(q('''SELECT COUNT(*) FROM signals WHERE signal = 'PRICE_UPDATE'
+                       AND timestamp < ? AND raw_payload IS NOT NULL'''),
+                  (cutoff(config['payload_days'], now),))
+        report['payloads_to_strip'] = c.fetchone()[0]
+    return report
+
+
+def sqlite_auto_vacuum(conn):
+    """0 none, 1 full, 2 incremental."""
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+
+
+def incremental_vacuum(conn, pages):
+    """Return up to `pages` free pages to the OS. Returns pages freed (SQLite only)."""
+    if USE_POSTGRES or sqlite_auto_vacuum(conn) != 2:
+        return 0
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing SQLite file to auto_vacuum=INCREMENTAL (full VACUUM: slow, locks the DB)."""
+    if USE_POSTGRES or sqlite_auto_vacuum(conn) == 2:
+        return False
+    conn.commit()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+
+def run_retention(conn, config=RETENTION_CONFIG, now=None):
+    """One compaction pass over every enabled policy. Returns a report."""
+    started = time.monotonic()
+    report = {'ticks_compacted': 0, 'payloads_stripped': 0, 'pages_vacuumed': 0}
+    if config['tick_days'] > 0:
+        report['ticks_compacted'] = compact_ticks(
+            conn, cutoff(max(config['tick_days'], MIN_TICK_DAYS), now),
+            config['batch_size'], config['batch_pause'])
+    if config['payload_days'] > 0:
+        report['payloads_stripped'] = strip_payloads(
+            conn, cutoff(config['payload_days'], now), config['batch_size'], config['batch_pause'])
+    if report['ticks_compacted'] or report['payloads_stripped']:
+        report['pages_vacuumed'] = incremental_vacuum(conn, config['vacuum_pages'])
+    report['seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+
+class RetentionWorker:
+    """Background thread running run_retention every interval, one process per host."""
+
+    def __init__(self, connection_factory, config=RETENTION_CONFIG):
+        self.connection_factory = connection_factory
+        self.config = config
+        self._thread = None
+        self._pid = None
+        self._lock_file = None
+        self.is_leader = False
+        self.runs = 0
+        self.last_run = None
+        self.last_report = None
+        self.last_error = None
+
+    def start(self):
+        """Start once per process (call after gunicorn forks). No-op if disabled."""
+        if not enabled(self.config):
+            return
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def _try_lead(self):
+        if self._lock_file is None:
+            self._lock_file = open(self.config['lock_path'], 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _run(self):
+        while not self._try_lead():
+            time.sleep(60)
+        self.is_leader = True
+        while True:
+            try:
+                with self.connection_factory() as conn:
+                    self.last_report = run_retention(conn, self.config)
+                self.last_error = None
+                if self.last_report['ticks_compacted'] or self.last_report['payloads_stripped']:
+                    log_event('retention', '🧹 Retention: %s', self.last_report, **self.last_report)
+            except Exception as e:
+                self.last_error = str(e)
+                log_event('retention', '❌ Retention error: %s', e, level=logging.ERROR, error=str(e))
+            self.runs += 1
+            self.last_run = datetime.now(timezone.utc).isoformat()
+            time.sleep(self.config['interval'])
+
+    def status(self):
+        return {
+            'enabled': enabled(self.config),
+            'tick_days': self.config['tick_days'],
+            'payload_days': self.config['payload_days'],
+            'rollup': OHLC_RESOLUTIONS,
+            'leader': self.is_leader,
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_report': self.last_report,
+            'last_error': self.last_error,
+        }
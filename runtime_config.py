@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Runtime Config — Bloop Tracker
+Settings changed through the API (POST /spread, POST /trailing-stop) kept in
+the `runtime_config` table, one JSON value per name, so every worker process
+applies the same ones (POSITION_MODE=shared). With a single process the
+in-memory dicts are enough and the table is not used.
+"""
+
+import json
+
+from db import q
+
+
+def create_config_table(conn):
+    """Caller commits."""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS runtime_config (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+def save_config(conn, name, value):
+    """Upsert one setting (JSON-serializable). Caller commits."""
+    c = conn.cursor()
+    c.execute(q('''
+        INSERT INTO runtime_config (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    '''), (name, json.dumps(value)))
+
+
+def load_config(conn):
+    """{name: value} for every stored setting."""
+    c = conn.cursor()
+    c.execute('SELECT name, value FROM runtime_config')
+    return {name: json.loads(value) for name, value in c.fetchall()}
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Stats Summary — Bloop Tracker
+Stats snapshot kept in `stats_by_key`, one row per (symbol, strategy): signal
+counts and gross/net trade aggregates, updated incrementally in the same
+transaction as the signal insert / trade close. /stats and the /webhook
+totals aggregate those few rows instead of COUNT/SUM over signals and trades.
+
+Writers only touch their own key's row, so signals for different keys never
+wait on each other. The single-row `stats_summary` table keeps what isn't
+per key: `signals_compacted` (ticks compacted before stats_by_key existed
+only count there) and the global part of `data_version`. Its old total_*
+columns are no longer maintained.
+
+`data_version` is the ETag of the read endpoints: stats_summary.data_version
+plus the sum of stats_by_key.data_version. Per-key writes (signal insert,
+trade close, position open) bump their key's counter; rebuild,
+/recalculate, /reset, /spread and retention bump the global one. Both only
+grow, and a reader sees a bump only once its write is committed.
+
+Rebuilds read signals/trades and then overwrite the rows, so they hold
+lock_stats() for their whole transaction; every incremental writer takes
+its shared side (share_stats) before touching a row, and waits or goes
+first instead of being overwritten.
+
+If the table ever drifts (manual SQL, restored backup), rebuild it:
+    flask --app webhook_server repair-stats
+or POST /admin/rebuild-stats.
+"""
+
+from collections import Counter
+
+from db import GREATEST, LEAST, USE_POSTGRES, q, table_columns
+from metrics import db_op
+from position_state import DEFAULT_STRATEGY, DEFAULT_SYMBOL, LOCK_CLASS, position_key
+
+STATS_LOCK_CLASS = LOCK_CLASS + 1   # pg_advisory_xact_lock(class, 0): rebuild vs incremental writers
+
+# Columns added after the first version of the table: (name, type)
+SUMMARY_COLUMNS = [
+    ('long_signals', 'INTEGER NOT NULL DEFAULT 0'),
+    ('short_signals', 'INTEGER NOT NULL DEFAULT 0'),
+    ('gross_winners', 'INTEGER NOT NULL DEFAULT 0'),
+    ('gross_best', 'REAL'),
+    ('gross_worst', 'REAL'),
+    ('net_pnl', 'REAL NOT NULL DEFAULT 0'),
+    ('net_winners', 'INTEGER NOT NULL DEFAULT 0'),
+    ('net_best', 'REAL'),
+    ('net_worst', 'REAL'),
+    ('spread_total', 'REAL NOT NULL DEFAULT 0'),
+    ('data_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('signals_compacted', 'INTEGER NOT NULL DEFAULT 0'),   # ticks deleted by retention
+]
+
+# Same for stats_by_key
+KEY_COLUMNS = [
+    ('data_version', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+SIGNAL_FIELDS = ['total_signals', 'long_signals', 'short_signals']
+TRADE_FIELDS = ['total_trades', 'total_pnl', 'gross_winners', 'gross_best', 'gross_worst',
+                'net_pnl', 'net_winners', 'net_best', 'net_worst', 'spread_total']
+
+# Per-key aggregation for read_summary(symbol/strategy): counters add up, extremes don't
+KEY_AGGREGATES = {f: 'SUM' for f in SIGNAL_FIELDS + TRADE_FIELDS}
+KEY_AGGREGATES.update(gross_best='MAX', gross_worst='MIN', net_best='MAX', net_worst='MIN')
+
+
+def create_summary_table(conn):
+    """Create/migrate stats_summary and make sure its row is populated.
+    Caller commits."""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_signals INTEGER NOT NULL DEFAULT 0,
+            total_trades INTEGER NOT NULL DEFAULT 0,
+            total_pnl REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    existing = table_columns(conn, 'stats_summary')
+    added = False
+    for col, dtype in SUMMARY_COLUMNS:
+        if col not in existing:
+            c.execute(f'ALTER TABLE stats_summary ADD COLUMN {col} {dtype}')
+            added = True
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_by_key (
+            symbol TEXT NOT NULL,
+            strategy TEXT NOT NULL,
+            total_signals INTEGER NOT NULL DEFAULT 0,
+            long_signals INTEGER NOT NULL DEFAULT 0,
+            short_signals INTEGER NOT NULL DEFAULT 0,
+            total_trades INTEGER NOT NULL DEFAULT 0,
+            total_pnl REAL NOT NULL DEFAULT 0,
+            gross_winners INTEGER NOT NULL DEFAULT 0,
+            gross_best REAL,
+            gross_worst REAL,
+            net_pnl REAL NOT NULL DEFAULT 0,
+            net_winners INTEGER NOT NULL DEFAULT 0,
+            net_best REAL,
+            net_worst REAL,
+            spread_total REAL NOT NULL DEFAULT 0,
+            signals_compacted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (symbol, strategy)
+        )
+    ''')
+    existing = table_columns(conn, 'stats_by_key')
+    for col, dtype in KEY_COLUMNS:
+        if col not in existing:
+            c.execute(f'ALTER TABLE stats_by_key ADD COLUMN {col} {dtype}')
+
+    c.execute('SELECT 1 FROM stats_summary WHERE id = 1')
+    missing = c.fetchone() is None
+    if missing:
+        c.execute('INSERT INTO stats_summary (id) VALUES (1)')
+    c.execute('SELECT 1 FROM stats_by_key LIMIT 1')
+    if added or missing or c.fetchone() is None:
+        rebuild_summary(conn)
+
+
+def _key_totals(c):
+    """{(symbol, strategy): values} over signals and trades (GROUP BY)."""
+    totals = {}
+    c.execute(q('''
+        SELECT COALESCE(symbol, ?), strategy, COUNT(*),
+               COALESCE(SUM(CASE WHEN signal = 'LONG' THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN signal = 'SHORT' THEN 1 ELSE 0 END), 0)
+        FROM signals GROUP BY 1, 2
+    '''), (DEFAULT_SYMBOL,))
+    for row in c.fetchall():
+        totals.setdefault(tuple(row[:2]), {}).update(zip(SIGNAL_FIELDS, row[2:]))
+    c.execute(q('''
+        SELECT COALESCE(symbol, ?), strategy, COUNT(*),
+               COALESCE(SUM(pnl_points), 0),
+               COALESCE(SUM(CASE WHEN pnl_points > 0 THEN 1 ELSE 0 END), 0),
+               MAX(pnl_points),
+               MIN(pnl_points),
+               COALESCE(SUM(pnl_net_points), 0),
+               COALESCE(SUM(CASE WHEN pnl_net_points > 0 THEN 1 ELSE 0 END), 0),
+               MAX(pnl_net_points),
+               MIN(pnl_net_points),
+               COALESCE(SUM(spread_cost), 0)
+        FROM trades GROUP BY 1, 2
+    '''), (DEFAULT_SYMBOL,))
+    for row in c.fetchall():
+        totals.setdefault(tuple(row[:2]), {}).update(zip(TRADE_FIELDS, row[2:]))
+    return totals
+
+
+def _rebuild_keys(c, fields):
+    """Rewrite `fields` of every stats_by_key row from _key_totals (keeps signals_compacted)."""
+    totals = _key_totals(c)
+    # Keys with no rows left get zeros (extremes: NULL, as for an empty table)
+    zeroed = [f"{f} = {'NULL' if KEY_AGGREGATES[f] != 'SUM' else 0}" for f in fields]
+    c.execute(f'UPDATE stats_by_key SET {", ".join(zeroed)}')
+    for key, values in totals.items():
+        values = {f: values[f] for f in fields if f in values}
+        if values:
+            _upsert_key(c, key, values)
+    if 'total_signals' in fields:
+        c.execute('UPDATE stats_by_key SET total_signals = total_signals + signals_compacted')
+
+
+def _upsert_key(c, key, values):
+    cols = ', '.join(values)
+    c.execute(q(f'''
+        INSERT INTO stats_by_key (symbol, strategy, {cols})
+        VALUES (?, ?, {', '.join('?' * len(values))})
+        ON CONFLICT (symbol, strategy) DO UPDATE SET {', '.join(f'{k} = excluded.{k}' for k in values)}
+    '''), list(key) + list(values.values()))
+
+
+def lock_stats(conn):
+    """Keep incremental writers out until the transaction ends (rebuilds).
+    Take it before reading signals/trades."""
+    c = conn.cursor()
+    if USE_POSTGRES:
+        c.execute('SELECT pg_advisory_xact_lock(%s, 0)', (STATS_LOCK_CLASS,))
+    elif not conn.in_transaction:
+        c.execute('BEGIN IMMEDIATE')
+
+
+def share_stats(conn):
+    """Incremental writers: wait for a running rebuild. Writers don't block
+    each other (SQLite already has a single writer)."""
+    if USE_POSTGRES:
+        conn.cursor().execute('SELECT pg_advisory_xact_lock_shared(%s, 0)', (STATS_LOCK_CLASS,))
+
+
+def rebuild_summary(conn):
+    """Recompute the whole snapshot with full scans. Caller commits."""
+    lock_stats(conn)
+    c = conn.cursor()
+    _rebuild_keys(c, SIGNAL_FIELDS + TRADE_FIELDS)
+    bump_version(conn)
+    return read_summary(conn)
+
+
+def rebuild_trade_totals(conn):
+    """Recompute only the trade aggregates (after /recalculate). Caller commits."""
+    lock_stats(conn)
+    c = conn.cursor()
+    _rebuild_keys(c, TRADE_FIELDS)
+    bump_version(conn)
+
+
+@db_op('stats_signals')
+def add_signals(conn, sigs):
+    """Count inserted signals (dicts) per key. Returns the webhook totals."""
+    by_key = {}
+    for sig in sigs:
+        counts = by_key.setdefault(position_key(sig), [0, 0, 0])
+        counts[0] += 1
+        counts[1] += sig['signal'] == 'LONG'
+        counts[2] += sig['signal'] == 'SHORT'
+    share_stats(conn)
+    c = conn.cursor()
+    for key, (n, longs, shorts) in by_key.items():
+        c.execute(q('''
+            INSERT INTO stats_by_key (symbol, strategy, total_signals, long_signals, short_signals,
+                                      data_version)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT (symbol, strategy) DO UPDATE SET
+                total_signals = stats_by_key.total_signals + excluded.total_signals,
+                long_signals = stats_by_key.long_signals + excluded.long_signals,
+                short_signals = stats_by_key.short_signals + excluded.short_signals,
+                data_version = stats_by_key.data_version + 1
+        '''), key + (n, longs, shorts))
+    totals = _aggregate(c, ['total_signals', 'total_trades', 'total_pnl'])
+    totals['total_pnl'] = float(totals['total_pnl'])
+    return totals
+
+
+_TRADE_SETS = f'''
+            total_trades = {{t}}.total_trades + 1,
+            total_pnl = {{t}}.total_pnl + ?,
+            gross_winners = {{t}}.gross_winners + ?,
+            gross_best = {GREATEST}(COALESCE({{t}}.gross_best, ?), ?),
+            gross_worst = {LEAST}(COALESCE({{t}}.gross_worst, ?), ?),
+            net_pnl = {{t}}.net_pnl + ?,
+            net_winners = {{t}}.net_winners + ?,
+            net_best = {GREATEST}(COALESCE({{t}}.net_best, ?), ?),
+            net_worst = {LEAST}(COALESCE({{t}}.net_worst, ?), ?),
+            spread_total = {{t}}.spread_total + ?'''
+
+
+@db_op('stats_trade')
+def add_trade(conn, trade):
+    """Fold a closed trade (dict as returned by close_position) into its key's row."""
+    gross = trade['pnl_points']
+    net = trade['pnl_net_points']
+    share_stats(conn)
+    c = conn.cursor()
+    # Per key: the row may not exist yet (a key's first signal is counted after its trade logic)
+    c.execute(q('''
+        INSERT INTO stats_by_key (symbol, strategy) VALUES (?, ?)
+        ON CONFLICT (symbol, strategy) DO NOTHING
+    '''), position_key(trade))
+    c.execute(q(f'''
+        UPDATE stats_by_key SET {_TRADE_SETS.format(t='stats_by_key')},
+            data_version = data_version + 1
+        WHERE symbol = ? AND strategy = ?
+    '''), (gross, 1 if gross > 0 else 0, gross, gross, gross, gross,
+           net, 1 if net > 0 else 0, net, net, net, net,
+           trade['spread_cost']) + position_key(trade))
+
+
+@db_op('stats_read')
+def read_summary(conn, symbol=None, strategy=None):
+    """The stats_by_key rows matching symbol and/or strategy (all of them
+    when both are None), aggregated."""
+    return _aggregate(conn.cursor(), SIGNAL_FIELDS + TRADE_FIELDS, symbol, strategy)
+
+
+def _aggregate(c, fields, symbol=None, strategy=None):
+    where, params = [], []
+    for col, value in (('symbol', symbol), ('strategy', strategy)):
+        if value is not None:
+            where.append(f'{col} = ?')
+            params.append(value)
+    # All keys: plus the compacted ticks no key row accounts for
+    orphans = ('0' if where else
+               '(SELECT signals_compacted FROM stats_summary WHERE id = 1) - COALESCE(SUM(signals_compacted), 0)')
+    c.execute(q(f'''SELECT {", ".join(f"{KEY_AGGREGATES[f]}({f})" for f in fields)}, {orphans}
+                   FROM stats_by_key {"WHERE " + " AND ".join(where) if where else ""}'''), params)
+    row = c.fetchone()
+    values = dict(zip(fields, row))
+    for f in fields:
+        if KEY_AGGREGATES[f] == 'SUM' and values[f] is None:
+            values[f] = 0   # no row for this key
+    if 'total_signals' in values:
+        values['total_signals'] += row[-1] or 0
+    return values
+
+
+def add_compacted(conn, keys):
+    """Record PRICE_UPDATE rows deleted by retention, `keys` being their
+    (symbol, strategy) keys, one per row. Caller commits."""
+    share_stats(conn)
+    c = conn.cursor()
+    for key, n in Counter(keys).items():
+        c.execute(q('''UPDATE stats_by_key SET signals_compacted = signals_compacted + ?
+                     WHERE symbol = ? AND strategy = ?'''), (n,) + key)
+    c.execute(q('''UPDATE stats_summary SET signals_compacted = signals_compacted + ?,
+                                        data_version = data_version + 1
+                 WHERE id = 1'''), (len(keys),))
+
+
+def clear_compacted(conn):
+    """Forget compacted ticks (/reset deletes every signal). Caller commits."""
+    lock_stats(conn)
+    c = conn.cursor()
+    # The key rows' versions move to the global counter: data_version never goes back
+    c.execute('''UPDATE stats_summary SET signals_compacted = 0,
+                 data_version = data_version + 1 + (SELECT COALESCE(SUM(data_version), 0) FROM stats_by_key)
+                 WHERE id = 1''')
+    c.execute('DELETE FROM stats_by_key')
+
+
+def bump_version(conn, key=None):
+    """Mark a write that doesn't go through the counters above, on `key`'s
+    counter or the global one. Caller commits."""
+    share_stats(conn)
+    c = conn.cursor()
+    if key is None:
+        c.execute('UPDATE stats_summary SET data_version = data_version + 1 WHERE id = 1')
+        return
+    c.execute(q('''
+        INSERT INTO stats_by_key (symbol, strategy, data_version) VALUES (?, ?, 1)
+        ON CONFLICT (symbol, strategy) DO UPDATE SET data_version = stats_by_key.data_version + 1
+    '''), tuple(key))
+
+
+def read_version(conn):
+    c = conn.cursor()
+    c.execute('''SELECT COALESCE((SELECT data_version FROM stats_summary WHERE id = 1), 0)
+                      + COALESCE((SELECT SUM(data_version) FROM stats_by_key), 0)''')
+    return c.fetchone()[0]
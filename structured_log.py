@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Structured Log — Bloop Tracker
+Logging for the webhook hot path that never blocks a request thread.
+
+log_event() puts a record on a bounded in-memory queue (QueueHandler) and
+returns; a background thread (QueueListener) formats it and writes it to
+stdout. If stdout/journald stalls and the queue fills up, records are
+dropped and counted (/health `logging.dropped`) instead of stalling
+requests. The message is formatted lazily, in the writer thread.
+
+LOG_FORMAT=json (default): one JSON object per line, the event's fields as
+keys ({"event": "signal", "signal": "LONG", "price": 21500.5, ...}).
+LOG_FORMAT=text: the human lines the server always printed (emoji included).
+
+Sampling: LOG_SAMPLE=PRICE_UPDATE:10,batch:5 logs 1 in N events of each
+sample key (a signal type for `signal` events, otherwise the event name)
+and adds "sample_rate" to the ones written. Events that close a trade and
+errors are never sampled out.
+"""
+
+import atexit
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from serialization import dumps
+
+
+def parse_sample_rates(value):
+    """'PRICE_UPDATE:10,batch:5' -> {'PRICE_UPDATE': 10, 'batch': 5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        key, _, n = item.partition(':')
+        rates[key.strip()] = max(1, int(n or 1))
+    return rates
+
+
+LOG_CONFIG = {
+    'format': os.environ.get('LOG_FORMAT', 'json'),                   # 'json' | 'text'
+    'level': os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    'queue_size': int(os.environ.get('LOG_QUEUE_SIZE', 10000)),       # records waiting; beyond: dropped
+    'sample': parse_sample_rates(os.environ.get('LOG_SAMPLE', '')),    # sample key -> 1 in N
+    'slow_request_ms': float(os.environ.get('LOG_SLOW_REQUEST_MS', 500)),  # 0 = off
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'event': getattr(record, 'event', record.name),
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return dumps(entry).decode()
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = record.getMessage()
+        return f'{text}\n{record.exc_text}' if record.exc_text else text
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of waiting."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Keep msg/args: the writer thread formats them. Only the traceback
+        # must be rendered here, while its frames still exist.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _output_handler(config):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(TextFormatter() if config['format'] == 'text' else JsonFormatter())
+    return handler
+
+
+log = logging.getLogger('bloop')
+log.setLevel(LOG_CONFIG['level'])
+log.propagate = False
+HANDLER = NonBlockingQueueHandler(queue.Queue(LOG_CONFIG['queue_size']))
+log.addHandler(HANDLER)
+LISTENER = QueueListener(HANDLER.queue, _output_handler(LOG_CONFIG))
+LISTENER.start()
+atexit.register(LISTENER.stop)   # writes what is still queued
+
+
+def _restart_after_fork():
+    # The writer thread doesn't survive fork: new queue (the parent's records
+    # are the parent's to write) and a new thread in the child
+    HANDLER.queue = LISTENER.queue = queue.Queue(LOG_CONFIG['queue_size'])
+    HANDLER.dropped = 0
+    LISTENER._thread = None
+    LISTENER.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def sample_rate(key):
+    """1-in-N rate configured for key (1 = log everything)."""
+    return LOG_CONFIG['sample'].get(key, 1)
+
+
+def sampled(key):
+    """True if this occurrence of key should be logged (every Nth one)."""
+    rate = LOG_CONFIG['sample'].get(key, 1)
+    if rate == 1:
+        return True
+    counter = _counters.get(key)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.setdefault(key, itertools.count())
+    return next(counter) % rate == 0
+
+
+def log_event(event, msg, *args, level=logging.INFO, exc_info=None, **fields):
+    """Queue one event. msg/args are %-formatted later, in the writer thread;
+    fields become JSON keys."""
+    if log.isEnabledFor(level):
+        log.log(level, msg, *args, exc_info=exc_info, extra={'event': event, 'fields': fields})
+
+
+def status():
+    return {
+        'format': LOG_CONFIG['format'],
+        'queued': HANDLER.queue.qsize(),
+        'dropped': HANDLER.dropped,
+        'sample': LOG_CONFIG['sample'],
+        'slow_request_ms': LOG_CONFIG['slow_request_ms'],
+    }
@@ -0,0 +1,19 @@
+"""
+Shared setup: the server modules read their config at import, so the
+environment and a scratch SQLite database are set here, before any test
+module imports webhook_server.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('WEBHOOK_SECRET', 'test-secret')
+os.environ.setdefault('METRICS_DIR', '')
+os.environ.pop('DATABASE_URL', None)
+
+import db  # noqa: E402
+
+db.DB_PATH = os.path.join(tempfile.mkdtemp(), 'signals.db')
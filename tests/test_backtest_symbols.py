@@ -0,0 +1,66 @@
+"""
+Backtest with several symbols in one path: each trade only sees its own
+symbol's prices (signals and bars), as the reference loops do.
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest  # noqa: E402
+
+from backtest_engine import Backtest, to_records  # noqa: E402
+from trailing_stop_analysis import simulate_path, simulate_trailing_stop  # noqa: E402
+
+TRADES = [
+    {'id': 1, 'symbol': 'USTEC', 'direction': 'LONG', 'entry_price': 20000.0, 'exit_price': 20010.0,
+     'pnl_points': 10.0, 'pnl_net': 9.1, 'duration_s': 1800,
+     'entry_time': '2026-01-05T14:30:00+00:00', 'exit_time': '2026-01-05T15:00:00+00:00'},
+    {'id': 2, 'symbol': 'US30', 'direction': 'LONG', 'entry_price': 40000.0, 'exit_price': 39990.0,
+     'pnl_points': -10.0, 'pnl_net': -10.9, 'duration_s': 1800,
+     'entry_time': '2026-01-05T14:30:00+00:00', 'exit_time': '2026-01-05T15:00:00+00:00'},
+]
+
+
+def ticks():
+    signals = []
+    for minute in range(1, 30):
+        ts = f'2026-01-05T14:{30 + minute:02d}:00+00:00'
+        signals.append({'timestamp': ts, 'price': 20000.0 + minute % 5, 'symbol': 'USTEC'})
+        signals.append({'timestamp': ts, 'price': 40000.0 - minute % 30, 'symbol': 'US30'})
+    return signals
+
+
+def pnl(result):
+    return [r['new_pnl'] for r in to_records(result)]
+
+
+def test_signal_windows_are_per_symbol():
+    signals = ticks()
+    bt = Backtest(TRADES, signals, 0.9)
+
+    assert bt.lengths.tolist() == [29, 29]
+    assert pnl(bt.simulate(sl_points=50)) == [10.0, -10.0]          # US30 low was -29
+    assert pnl(bt.simulate(sl_points=20)) == [10.0, -20.0]
+    assert pnl(bt.simulate(sl_points=20)) == [r['new_pnl'] for r in simulate_path(TRADES, signals, 20)]
+    assert pnl(bt.trailing_stop(3)) == [r['new_pnl'] for r in simulate_trailing_stop(TRADES, signals, 3)]
+
+
+def test_bar_windows_are_per_symbol():
+    bars = [{'bucket_start': f'2026-01-05T14:{m:02d}:00+00:00', 'open': base, 'high': base + 5,
+             'low': base - low, 'close': base, 'symbol': symbol}
+            for m in range(30, 60) for symbol, base, low in (('USTEC', 20000.0, 5), ('US30', 40000.0, 25))]
+    bt = Backtest.from_bars(TRADES, bars, 0.9, 60)
+
+    assert bt.lengths.tolist() == [30 * 4, 30 * 4]
+    assert pnl(bt.simulate(sl_points=20)) == [10.0, -20.0]
+
+
+def test_trade_without_symbol_on_a_per_symbol_path():
+    trades = [dict(TRADES[0], symbol=None)]
+    with pytest.raises(ValueError):
+        Backtest(trades, ticks(), 0.9)
@@ -0,0 +1,91 @@
+"""
+QueueApplier: transient DB errors are retried (never dead-lettered), a batch
+that fails after its commit is not applied twice, poison entries are
+dead-lettered alone and can be re-driven.
+
+    python -m pytest -q tests
+"""
+
+import os
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.pop('DATABASE_URL', None)
+
+from ingest_queue import IngestQueue, QueueApplier  # noqa: E402
+
+
+def make_applier(tmp_path, fail):
+    """Applier over a fake main DB: fail(state, items, stage) may raise
+    before or after the (fake) commit."""
+    queue = IngestQueue(str(tmp_path / 'queue.db'), 1000)
+    state = {'cursor': 0, 'applied': [], 'calls': 0}
+
+    def apply_batch(items, last_seq):
+        state['calls'] += 1
+        fail(state, items, 'before')
+        state['applied'] += [seq for seq, _, _ in items]
+        state['cursor'] = last_seq
+        fail(state, items, 'after')
+
+    def mark_applied(seq):
+        state['dead_letters_at_mark'] = [s for s, *_ in queue.dead_letters()]
+        state['cursor'] = seq
+
+    applier = QueueApplier(queue, apply_batch, lambda: state['cursor'], mark_applied,
+                           batch_size=50, poll_interval=0.01, retry_max=0.05)
+    return queue, applier, state
+
+
+def drain(applier, upto, timeout=5):
+    applier.start()
+    deadline = time.time() + timeout
+    while applier.applied_seq < upto and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_transient_errors_are_retried(tmp_path):
+    def locked(state, items, stage):
+        if stage == 'before' and state['calls'] <= 2:
+            raise sqlite3.OperationalError('database is locked')
+
+    queue, applier, state = make_applier(tmp_path, locked)
+    queue.enqueue([{'signal': 'LONG', 'i': i} for i in range(10)])
+    drain(applier, 10)
+
+    assert state['applied'] == list(range(1, 11))
+    assert queue.dead_letter_count() == 0
+    assert applier.retries == 2
+
+
+def test_failure_after_commit_is_not_reapplied(tmp_path):
+    def after_commit(state, items, stage):
+        if stage == 'after' and state['calls'] == 1:
+            raise RuntimeError('event fan-out failed')
+
+    queue, applier, state = make_applier(tmp_path, after_commit)
+    queue.enqueue([{'signal': 'LONG', 'i': i} for i in range(10)])
+    drain(applier, 10)
+
+    assert state['applied'] == list(range(1, 11))
+    assert queue.dead_letter_count() == 0
+
+
+def test_poison_entry_is_dead_lettered_and_redriven(tmp_path):
+    def poison(state, items, stage):
+        if stage == 'before' and any(sig.get('bad') for _, _, sig in items):
+            raise ValueError('bad payload')
+
+    queue, applier, state = make_applier(tmp_path, poison)
+    queue.enqueue([{'signal': 'LONG', 'i': i, 'bad': i == 3} for i in range(10)])
+    drain(applier, 10)
+
+    assert state['applied'] == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+    assert [seq for seq, *_ in queue.dead_letters()] == [4]
+    assert state['dead_letters_at_mark'] == [4]        # kept before the cursor skips it
+
+    assert queue.redrive({4}) == [(4, 11)]
+    assert queue.dead_letter_count() == 0
@@ -0,0 +1,58 @@
+"""
+price_updater follows /stream: after a disconnect it resumes with
+Last-Event-ID, gets only the replay (no snapshot) and must count as
+connected again instead of polling /stats for good.
+
+    python -m pytest -q tests
+"""
+
+import os
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+import price_updater as pu
+import webhook_server as server   # scratch database: conftest.py
+
+SECRET = os.environ['WEBHOOK_SECRET']
+
+
+def wait_for(check, timeout=5):
+    deadline = time.time() + timeout
+    while not check() and time.time() < deadline:
+        time.sleep(0.02)
+    return check()
+
+
+@pytest.fixture
+def live_server(monkeypatch):
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setitem(server.STREAM_CONFIG, 'heartbeat', 0.1)
+    monkeypatch.setattr(pu, 'STREAM_URL', f'http://127.0.0.1:{httpd.server_port}/stream')
+    monkeypatch.setattr(pu, 'STATS_URL', 'http://127.0.0.1:9/stats')    # polling it fails
+    monkeypatch.setattr(pu, 'STREAM_RETRY_SECONDS', 0.1)
+    monkeypatch.setattr(pu, 'LIVE_POSITION', {'connected': False, 'entry_price': None, 'changes': 0})
+    client = server.app.test_client()
+    client.post('/reset', headers={'X-Webhook-Secret': SECRET})
+    yield client
+    httpd.shutdown()
+
+
+def test_resumed_stream_counts_as_connected(live_server):
+    threading.Thread(target=pu.follow_stream, args=(SECRET,), daemon=True).start()
+    assert wait_for(lambda: pu.LIVE_POSITION['connected'])             # snapshot
+    subscribers = server.EVENTS.stats()['subscribers']
+
+    # Overflowed queue: the server ends the stream, the updater resumes
+    for sub in list(server.EVENTS._subscribers):
+        sub.dropped = True
+    assert wait_for(lambda: not pu.LIVE_POSITION['connected'])
+    live_server.post('/webhook', json={'secret': SECRET, 'signal': 'LONG', 'price': 21000, 'symbol': 'USTEC'})
+
+    assert wait_for(lambda: pu.LIVE_POSITION['entry_price'] == 21000)  # from the replay
+    assert pu.LIVE_POSITION['connected']
+    assert server.EVENTS.stats()['subscribers'] == subscribers
+    assert pu.get_last_ic_price() == 21000                             # no /stats poll
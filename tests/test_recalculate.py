@@ -0,0 +1,50 @@
+"""
+/recalculate jobs price every chunk at the spreads the job was created
+with, like the dry run: a POST /spread mid-job doesn't leak into the
+remaining chunks.
+
+    python -m pytest -q tests
+"""
+
+import copy
+import os
+
+import pytest
+
+import webhook_server as server   # scratch database: conftest.py
+from recalculate import create_job, preview_totals, run_job
+
+SECRET = os.environ['WEBHOOK_SECRET']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, 'SPREAD_CONFIG', copy.deepcopy(server.SPREAD_CONFIG))
+    cl = server.app.test_client()
+    cl.post('/reset', headers={'X-Webhook-Secret': SECRET})
+    yield cl
+    with server.db_connection() as conn:
+        server.sync_spreads(conn, server.current_spreads())
+        conn.commit()
+
+
+def test_spread_change_mid_job_waits_for_the_next_job(client):
+    for i, signal in enumerate(['LONG', 'SHORT'] * 3 + ['LONG']):
+        client.post('/webhook', json={'secret': SECRET, 'signal': signal, 'price': 100 + i, 'symbol': 'USTEC'})
+    spread = server.get_spread_for_symbol('USTEC')
+
+    def change_spread(job):
+        client.post('/spread', headers={'X-Webhook-Secret': SECRET},
+                    json={'symbol': 'USTEC', 'spread_points': spread + 5})
+
+    with server.db_connection() as conn:
+        job = create_job(conn, server.current_spreads(), spread, chunk_size=1)
+        preview = preview_totals(conn, job['spreads'], job['default_spread'])
+    job = run_job(server.db_connection, job['id'], on_chunk=change_spread)
+
+    assert job['status'] == 'done' and job['chunks'] == 6 and job['trades_updated'] == 6
+    with server.db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT DISTINCT spread_cost FROM trades')
+        assert [r[0] for r in c.fetchall()] == [spread]
+        assert server.read_summary(conn)['net_pnl'] == pytest.approx(preview['new']['net_pnl'])
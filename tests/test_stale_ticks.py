@@ -0,0 +1,71 @@
+"""
+Buffered ticks older than the open position (price_updater's batch landing
+after a reversal) must not move its extremes or stop it out.
+
+    python -m pytest -q tests
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import webhook_server as server   # scratch database: conftest.py
+from trade_engine import replay_ledger
+
+SECRET = os.environ['WEBHOOK_SECRET']
+OLD = '2020-01-01T00:00:00+00:00'
+
+
+@pytest.fixture
+def client():
+    server.TRAILING_STOP_CONFIG.update(enabled=True, trail_points=5, activation_points=0, fixed_sl_points=0)
+    cl = server.app.test_client()
+    cl.post('/reset', headers={'X-Webhook-Secret': SECRET})
+    yield cl
+    server.TRAILING_STOP_CONFIG.update(enabled=False)
+
+
+def batch(cl, *ticks):
+    resp = cl.post('/webhook/batch', json={'secret': SECRET, 'symbol': 'USTEC', 'ticks': list(ticks)})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_stale_tick_does_not_stop_new_position(client):
+    assert client.post('/webhook', json={'secret': SECRET, 'signal': 'LONG', 'price': 100}).status_code == 200
+
+    result = batch(client, {'signal': 'PRICE_UPDATE', 'price': 90, 'timestamp': OLD})
+
+    assert result['closed_trades'] == 0
+    assert result['stale_ticks'] == 1
+    assert result['outcomes'][0]['stale'] is True
+    assert result['outcomes'][0]['position'] == 'LONG'
+    pos = client.get('/position', headers={'X-Webhook-Secret': SECRET}).get_json()
+    assert (pos['direction'], pos['max_price'], pos['min_price']) == ('LONG', 100, 100)
+    assert result['total_signals'] == 2          # stored all the same
+
+
+def test_fresh_tick_after_stale_one_still_stops(client):
+    assert client.post('/webhook', json={'secret': SECRET, 'signal': 'LONG', 'price': 100}).status_code == 200
+    later = (datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat()
+
+    result = batch(client, {'signal': 'PRICE_UPDATE', 'price': 120, 'timestamp': OLD},
+                   {'signal': 'PRICE_UPDATE', 'price': 94, 'timestamp': later})
+
+    assert [o['stale'] for o in result['outcomes']] == [True, False]
+    trade = result['outcomes'][1]['closed_trade']
+    assert trade['exit_reason'] == 'trailing_stop (peak=100.0, trail=5pts)'   # 120 never counted
+    assert trade['duration_seconds'] >= 0
+
+
+def test_replay_ledger_skips_stale_signals():
+    cfg = {'enabled': True, 'trail_points': 5, 'activation_points': 0, 'fixed_sl_points': 0}
+    signals = [
+        {'timestamp': '2026-01-05T14:30:00+00:00', 'signal': 'LONG', 'price': 100.0},
+        {'timestamp': '2026-01-05T14:29:00+00:00', 'signal': 'PRICE_UPDATE', 'price': 90.0},
+        {'timestamp': '2026-01-05T14:31:00+00:00', 'signal': 'PRICE_UPDATE', 'price': 98.0},
+    ]
+    trades, still_open = replay_ledger(signals, cfg, {'USTEC': 0.9})
+    assert trades == []
+    assert still_open[0]['min_price'] == 98.0
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Trade Engine — Bloop Tracker
+The position / stop rules of the live server, as pure functions.
+
+webhook_server.apply_signal() and the backtester's ledger replay both go
+through these: no DB, no globals. Positions are plain dicts (the
+open_positions fields) and stop settings are passed in, shaped like
+TRAILING_STOP_CONFIG. One signal on the position of its (symbol, strategy):
+
+    0. is_stale(pos, timestamp)         older than the position: skipped
+    1. track_extremes(pos, price)       max/min, this price included
+    2. decide(pos, signal, price, cfg)  -> (close_reason, open_direction)
+         PRICE_UPDATE   close if a stop triggers
+         LONG / SHORT   flat: open. Opposite position: close ('signal') and
+                        open. Same direction: close if a stop triggers
+         anything else  nothing (its price still moved the extremes)
+    3. close_trade(pos, ...) and/or new_position(...)
+
+Stops fill at the price that triggered them: the server sees nothing finer.
+A signal timestamped before the position's entry_time (a batch of buffered
+ticks arriving after a reversal) is stale: its price is from before the
+position existed, so it moves no extreme, triggers no stop and reverses nothing.
+
+replay_ledger() pushes a signal history through the same calls, one position
+per key, and returns the trades the server would have booked (no DB).
+backtest_engine.replay() is its vectorized equivalent, for long histories.
+"""
+
+from datetime import datetime, timezone
+
+DEFAULT_SYMBOL = 'USTEC'
+DEFAULT_STRATEGY = 'default'
+
+
+def position_key(sig):
+    """(symbol, strategy) of a signal or position dict."""
+    return (sig.get('symbol') or DEFAULT_SYMBOL, sig.get('strategy') or DEFAULT_STRATEGY)
+
+
+def _parse_iso(value):
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+# ============================================================
+# RULES
+# ============================================================
+def fixed_sl_reason(cfg):
+    return f"fixed_sl ({cfg['fixed_sl_points']}pts)"
+
+
+def trailing_reason(cfg, direction, extreme):
+    """extreme: the peak (LONG) or trough (SHORT) the stop trailed."""
+    label = 'peak' if direction == 'LONG' else 'trough'
+    return f"trailing_stop ({label}={extreme:.1f}, trail={cfg['trail_points']}pts)"
+
+
+def check_stop(cfg, pos, price):
+    """Should the fixed SL or the trailing stop close pos at price?
+    Returns (should_close, reason)."""
+    if not cfg['enabled']:
+        return False, None
+
+    direction = pos['direction']
+    entry = pos['entry_price']
+
+    # Fixed stop loss check
+    if cfg['fixed_sl_points'] > 0:
+        if direction == 'LONG':
+            unrealized = price - entry
+        else:
+            unrealized = entry - price
+        if unrealized <= -cfg['fixed_sl_points']:
+            return True, fixed_sl_reason(cfg)
+
+    # Trailing stop check: from the peak so far, this price included (track_extremes first)
+    if cfg['trail_points'] > 0:
+        if direction == 'LONG':
+            peak = pos['max_price'] or entry
+            if peak - entry >= cfg['activation_points']:
+                if price <= peak - cfg['trail_points']:
+                    return True, trailing_reason(cfg, direction, peak)
+        else:  # SHORT
+            trough = pos['min_price'] or entry
+            if entry - trough >= cfg['activation_points']:
+                if price >= trough + cfg['trail_points']:
+                    return True, trailing_reason(cfg, direction, trough)
+
+    return False, None
+
+
+def is_stale(pos, timestamp):
+    """Is a signal at timestamp older than the open position pos?"""
+    return bool(pos) and _parse_iso(timestamp) < _parse_iso(pos['entry_time'])
+
+
+def track_extremes(pos, price):
+    """Move pos's max/min to include price. Returns True if either moved."""
+    max_p = max(pos['max_price'] or price, price)
+    min_p = min(pos['min_price'] or price, price)
+    if max_p == pos['max_price'] and min_p == pos['min_price']:
+        return False
+    pos['max_price'] = max_p
+    pos['min_price'] = min_p
+    return True
+
+
+def decide(pos, signal, price, cfg):
+    """What one signal does to the open position of its key (None = flat),
+    its extremes already tracked. Returns (close_reason, open_direction),
+    either None; a close comes before the open."""
+    if signal == 'PRICE_UPDATE':
+        return (check_stop(cfg, pos, price)[1] if pos else None), None
+    if signal not in ('LONG', 'SHORT'):
+        return None, None
+    if not pos:
+        # A position opened at this price can't be stopped by it (entry = max = min)
+        return None, signal
+    if pos['direction'] != signal:
+        return 'signal', signal
+    return check_stop(cfg, pos, price)[1], None
+
+
+def new_position(direction, entry_time, entry_price, symbol, strategy,
+                 atr=None, tp1=None, tp2=None, sl=None):
+    return {
+        'symbol': symbol or DEFAULT_SYMBOL, 'strategy': strategy or DEFAULT_STRATEGY,
+        'direction': direction, 'entry_time': entry_time, 'entry_price': entry_price,
+        'atr': atr, 'tp1': tp1, 'tp2': tp2, 'sl': sl,
+        'max_price': entry_price, 'min_price': entry_price
+    }
+
+
+def close_trade(pos, exit_time, exit_price, exit_reason, spread_cost):
+    """The trade booked when pos closes at exit_price (times as isoformat)."""
+    # Calcular P&L bruto
+    if pos['direction'] == 'LONG':
+        pnl_points = exit_price - pos['entry_price']
+    else:
+        pnl_points = pos['entry_price'] - exit_price
+    pnl_percent = (pnl_points / pos['entry_price']) * 100
+
+    # Spread cost y P&L neto
+    pnl_net_points = pnl_points - spread_cost
+    pnl_net_percent = (pnl_net_points / pos['entry_price']) * 100
+    duration = int((_parse_iso(exit_time) - _parse_iso(pos['entry_time'])).total_seconds())
+
+    return {
+        'symbol': pos['symbol'] or DEFAULT_SYMBOL,
+        'strategy': pos['strategy'],
+        'direction': pos['direction'],
+        'entry_price': pos['entry_price'],
+        'exit_price': exit_price,
+        'exit_reason': exit_reason,
+        'pnl_points': pnl_points,
+        'pnl_percent': pnl_percent,
+        'spread_cost': spread_cost,
+        'pnl_net_points': pnl_net_points,
+        'pnl_net_percent': pnl_net_percent,
+        'duration_seconds': duration,
+        'max_price': pos['max_price'],
+        'min_price': pos['min_price'],
+        'atr': pos['atr'],
+        'tp1': pos['tp1'],
+        'tp2': pos['tp2'],
+        'sl': pos['sl']
+    }
+
+
+# ============================================================
+# REPLAY (reference loop)
+# ============================================================
+def spread_for(spreads, symbol):
+    """Spread of symbol from {symbol: spread_points}, USTEC's when unknown (as the server)."""
+    return spreads.get(symbol, spreads.get(DEFAULT_SYMBOL, 0.0))
+
+
+def replay_ledger(signals, cfg, spreads):
+    """Virtual ledger: signal dicts (timestamp, signal, price, symbol,
+    strategy; optional atr/tp1/tp2/sl) in arrival order through the live
+    rules. spreads: {symbol: spread_points}.
+
+    Returns (trades, open_positions): closed trades in booking order, with
+    entry_time/exit_time added, and the positions still open at the end.
+    """
+    positions = {}
+    trades = []
+    for sig in signals:
+        key = position_key(sig)
+        price = sig['price']
+        pos = positions.get(key)
+        if is_stale(pos, sig['timestamp']):
+            continue
+        if pos:
+            track_extremes(pos, price)
+        close_reason, open_direction = decide(pos, sig['signal'], price, cfg)
+        if close_reason:
+            trade = close_trade(pos, sig['timestamp'], price, close_reason,
+                                spread_for(spreads, key[0]))
+            trade.update(entry_time=pos['entry_time'], exit_time=sig['timestamp'])
+            trades.append(trade)
+            positions[key] = None
+        if open_direction:
+            positions[key] = new_position(open_direction, sig['timestamp'], price, key[0], key[1],
+                                          sig.get('atr'), sig.get('tp1'), sig.get('tp2'), sig.get('sl'))
+    return trades, [pos for pos in positions.values() if pos]
@@ -6,12 +6,36 @@ Simulates trailing stops on historical trade data using signal prices as proxy.
 Limitation: We don't have tick data, only signal prices. So trailing stop triggers
 are approximate (checked at each signal timestamp, not continuously).
 This gives a lower bound on trailing stop effectiveness.
+
+Stops and targets are checked against the whole price path of each trade:
+the signals between entry and exit, or OHLC bars with --bars 1m (finer
+path, each bar walked open -> low/high -> high/low -> close). With --db or
+the API each trade only sees its own symbol's prices; the /tmp exports are
+a single symbol.
+
+The sweeps run on backtest_engine (NumPy, all trades at once). The loop
+functions below are the reference implementation:
+
+    python trailing_stop_analysis.py --verify    # engine == loops on this data, and timings
+    python trailing_stop_analysis.py --bars 1m   # path from /tmp/bloop_bars.csv or the API
+    python trailing_stop_analysis.py --db        # straight from the server's database (history_cache)
 """
 
+import argparse
+import gzip
 import json
+import os
 import sys
+import time
+import urllib.parse
+import urllib.request
 from datetime import datetime
 
+import numpy as np
+
+from backtest_engine import Backtest, iso_from_us, to_records
+from trade_engine import DEFAULT_SYMBOL
+
 # ============================================================
 # TRADE DATA (exported from PostgreSQL)
 # Format: id|direction|entry_price|exit_price|pnl_points|pnl_net|max_price|min_price|duration_s|atr|entry_time|exit_time
@@ -19,6 +43,13 @@ from datetime import datetime
 
 SPREAD = 0.9  # IC Markets USTEC spread in points
 
+SL_GRID = [20, 30, 40, 50, 60, 75, 100, 125, 150, 200]
+TRAIL_GRID = [15, 20, 30, 40, 50, 60, 75, 100, 125, 150]
+ACTIVATION_GRID = [20, 30, 50, 75, 100]
+ACTIVATION_TRAIL_GRID = [15, 20, 30, 40, 50, 75]
+TP1_GRID = [None, 20, 30, 50]
+TP2_GRID = [50, 75, 100, 150, 200]
+
 def load_trades(filepath='/tmp/bloop_trades.csv'):
     """Load trades from pipe-delimited export."""
     trades = []
@@ -59,11 +90,149 @@ def load_signals(filepath='/tmp/bloop_signals.csv'):
     return signals
 
 
-def get_prices_during_trade(signals, entry_time, exit_time):
-    """Get all signal prices between entry and exit (inclusive of exit)."""
+def load_bars(filepath='/tmp/bloop_bars.csv'):
+    """Load OHLC bars (bucket_start|open|high|low|close), e.g. exported from ohlc_bars."""
+    bars = []
+    with open(filepath) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.split('|')
+            bars.append({
+                'bucket_start': parts[0],
+                'open': float(parts[1]),
+                'high': float(parts[2]),
+                'low': float(parts[3]),
+                'close': float(parts[4]),
+            })
+    return bars
+
+
+def fetch_columns(base_url, path, secret, page_size=10000):
+    """Pull a whole table from the API in columnar pages (?format=columns, gzip).
+    Returns {field: [values]} in ascending (oldest first) order."""
+    cols = {}
+    url = f"{base_url}{path}?format=columns&limit={page_size}"
+    while url:
+        req = urllib.request.Request(url, headers={'X-Webhook-Secret': secret,
+                                                   'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            body = resp.read()
+            if resp.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            cursor = resp.headers.get('X-Next-Cursor')
+        for name, values in json.loads(body)['columns'].items():
+            cols.setdefault(name, []).extend(values)
+        url = f"{base_url}{path}?format=columns&limit={page_size}&after={cursor}" if cursor else None
+    # The API pages newest first
+    return {name: values[::-1] for name, values in cols.items()}
+
+
+def load_from_api(base_url, secret):
+    """Same records as load_trades()/load_signals(), straight from the server."""
+    t = fetch_columns(base_url, '/trades', secret)
+    trades = [{
+        'id': t['id'][i],
+        'symbol': t['symbol'][i] or DEFAULT_SYMBOL,
+        'direction': t['direction'][i],
+        'entry_price': t['entry_price'][i],
+        'exit_price': t['exit_price'][i],
+        'pnl_points': t['pnl_points'][i],
+        'pnl_net': t['pnl_net_points'][i],
+        'duration_s': t['duration_seconds'][i] or 0,
+        'entry_time': t['entry_time'][i],
+        'exit_time': t['exit_time'][i],
+    } for i in range(len(t.get('id', [])))]
+    s = fetch_columns(base_url, '/signals', secret)
+    signals = [{'timestamp': ts, 'signal': sig, 'price': price, 'symbol': symbol or DEFAULT_SYMBOL}
+               for ts, sig, price, symbol in zip(s.get('timestamp', []), s.get('signal', []), s.get('price', []),
+                                                 s.get('symbol', []))]
+    return trades, signals
+
+
+def load_bars_from_api(base_url, secret, resolution, symbol='USTEC', page_size=10000):
+    """Every bar of symbol at resolution from GET /bars (oldest first, paged by start)."""
+    bars = []
+    url = f"{base_url}/bars?format=columns&symbol={symbol}&resolution={resolution}&limit={page_size}"
+    while url:
+        req = urllib.request.Request(url, headers={'X-Webhook-Secret': secret,
+                                                   'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            body = resp.read()
+            if resp.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            cursor = resp.headers.get('X-Next-Cursor')
+        cols = json.loads(body)['columns']
+        bars.extend(dict(zip(cols, row)) for row in zip(*cols.values()))
+        url = (f"{base_url}/bars?format=columns&symbol={symbol}&resolution={resolution}&limit={page_size}"
+               f"&start={urllib.parse.quote(cursor)}") if cursor else None
+    return bars
+
+
+def load_from_db(symbol=None, rebuild=False):
+    """Trades (as load_trades(), plus 'symbol') and the signal price path as
+    columns {'timestamp': epoch µs, 'price', 'symbol': codes into 'symbols'},
+    from the server's database through the history_cache columns: only rows
+    newer than the cache are fetched."""
+    import history_cache
+    tables = history_cache.load(rebuild=rebuild)
+    t, s = tables['trades'], tables['signals']
+    rows = np.flatnonzero(t.equals('symbol', symbol)) if symbol else slice(None)
+    trades = [{
+        'id': i,
+        'symbol': sym or DEFAULT_SYMBOL,
+        'direction': direction,
+        'entry_price': entry,
+        'exit_price': exit_,
+        'pnl_points': pnl,
+        'pnl_net': pnl_net,
+        'duration_s': duration,
+        'entry_time': entry_time,
+        'exit_time': exit_time,
+    } for i, sym, direction, entry, exit_, pnl, pnl_net, duration, entry_time, exit_time in zip(
+        t['id'][rows].tolist(), t.decode('symbol')[rows].tolist(), t.decode('direction')[rows].tolist(), t['entry_price'][rows].tolist(),
+        t['exit_price'][rows].tolist(), t['pnl_points'][rows].tolist(), t['pnl_net_points'][rows].tolist(),
+        t['duration_seconds'][rows].tolist(), iso_from_us(t['entry_time'][rows]), iso_from_us(t['exit_time'][rows]))]
+    priced = ~np.isnan(s['price'])
+    if symbol:
+        priced &= s.equals('symbol', symbol)
+    # NULL symbol is the default one, as on the server: one code per name
+    names = [word or DEFAULT_SYMBOL for word in s.vocab.get('symbol', [])]
+    symbols = list(dict.fromkeys(names))
+    codes = np.array([symbols.index(name) for name in names], dtype=np.int64)[s['symbol'][priced]]
+    return trades, {'timestamp': s['timestamp'][priced], 'price': s['price'][priced],
+                    'symbol': codes, 'symbols': symbols}
+
+
+def load_bars_from_db(resolution, symbol='USTEC'):
+    """Every bar of symbol at resolution, read from the ohlc_bars table."""
+    from db import get_db_connection
+    from ohlc_bars import BAR_QUERY_FIELDS, read_bars
+    conn = get_db_connection()
+    try:
+        return [dict(zip(BAR_QUERY_FIELDS, row)) for row in read_bars(conn, symbol, resolution)]
+    finally:
+        conn.close()
+
+
+def load_traded_bars(trades, resolution, api_url=None, secret=''):
+    """Bars of every symbol the trades are in, tagged with it, from the
+    database (or the API with api_url)."""
+    bars = []
+    for symbol in sorted({t['symbol'] for t in trades}):
+        rows = (load_bars_from_api(api_url, secret, resolution, symbol) if api_url
+                else load_bars_from_db(resolution, symbol))
+        bars.extend(dict(b, symbol=symbol) for b in rows)
+    return bars
+
+
+def get_prices_during_trade(signals, entry_time, exit_time, symbol=None):
+    """Get all signal prices between entry and exit (inclusive of exit), of
+    `symbol` when the signals carry one."""
     prices = []
     for s in signals:
-        if s['timestamp'] > entry_time and s['timestamp'] <= exit_time:
+        if s['timestamp'] > entry_time and s['timestamp'] <= exit_time and s.get('symbol', symbol) == symbol:
             prices.append(s['price'])
     return prices
 
@@ -87,7 +256,7 @@ def simulate_trailing_stop(trades, signals, trail_points, activation_points=0):
 
         # Get intermediate prices during this trade
         intermediate_prices = get_prices_during_trade(
-            signals, trade['entry_time'], trade['exit_time']
+            signals, trade['entry_time'], trade['exit_time'], trade.get('symbol')
         )
 
         # Track the peak favorable price
@@ -153,31 +322,81 @@ def simulate_trailing_stop(trades, signals, trail_points, activation_points=0):
     return results
 
 
-def simulate_fixed_stop_loss(trades, sl_points):
+def simulate_path(trades, signals, sl_points=None, trail_points=None, activation_points=0,
+                  tp1_points=None, tp2_points=None, tp1_fraction=0.5, breakeven=False, fill='level'):
     """
-    Simulate a fixed stop loss. Since we don't have tick data,
-    we can only check if the final P&L exceeded the stop loss.
-    This is an approximation — in reality the SL would trigger intra-bar.
+    Simulate fixed SL, trailing stop and TP1/TP2 against every signal price
+    during the trade (not just the final P&L: a trade that crossed its stop
+    and then recovered is stopped out).
+
+    tp1_points closes tp1_fraction of the position, the rest runs to
+    tp2_points or a stop (moved to entry after TP1 with breakeven=True).
+    fill='level' fills at the stop/target level, 'price' at the signal price
+    that crossed it. Reference loop for backtest_engine.Backtest.simulate().
     """
     results = []
     for trade in trades:
-        pnl = trade['pnl_points']
-        if pnl < -sl_points:
-            pnl = -sl_points
-        pnl_net = pnl - SPREAD
+        # Prices in the trade's favour: up is profit for both directions
+        side = 1.0 if trade['direction'] == 'LONG' else -1.0
+        entry = trade['entry_price'] * side
+        path = [price * side for price in get_prices_during_trade(
+            signals, trade['entry_time'], trade['exit_time'], trade.get('symbol'))]
+        sl = entry - sl_points if sl_points else float('-inf')
+
+        legs = []
+        if tp1_points:
+            pnl1, reason1, tp1_at = _path_leg(path, entry, sl, trail_points, activation_points,
+                                              entry + tp1_points, fill)
+            legs.append((tp1_fraction, pnl1, 'tp1' if reason1 == 'target' else reason1))
+            breakeven_after = tp1_at if breakeven and reason1 == 'target' else None
+        else:
+            breakeven_after = None
+        pnl2, reason2, _ = _path_leg(path, entry, sl, trail_points, activation_points,
+                                     entry + tp2_points if tp2_points else float('inf'), fill, breakeven_after)
+        legs.append((1 - tp1_fraction if tp1_points else 1.0, pnl2, 'tp2' if reason2 == 'target' else reason2))
+
+        pnls = [trade['pnl_points'] if pnl is None else pnl for _, pnl, _ in legs]
+        pnl = pnls[0] if len(legs) == 1 else legs[0][0] * pnls[0] + legs[1][0] * pnls[1]
+        reason = legs[-1][2]
         results.append({
             'id': trade['id'],
+            'direction': trade['direction'],
             'original_pnl': trade['pnl_points'],
             'new_pnl': pnl,
-            'new_pnl_net': pnl_net,
-            'sl_triggered': trade['pnl_points'] < -sl_points,
+            'new_pnl_net': pnl - SPREAD,
+            'exit_reason': reason,
+            'sl_triggered': reason == 'fixed_sl',
+            'trail_triggered': reason == 'trailing_stop',
+            'tp1_hit': bool(tp1_points) and legs[0][2] == 'tp1',
+            'tp2_hit': reason == 'tp2',
         })
     return results
 
 
+def _path_leg(path, entry, sl, trail_points, activation_points, target, fill, breakeven_after=None):
+    """First exit of one leg: (pnl or None if it ran to the signal exit, reason, index)."""
+    peak = entry
+    for i, x in enumerate(path):
+        peak = max(peak, x)
+        stop = max(sl, entry) if breakeven_after is not None and i > breakeven_after else sl
+        trail = peak - trail_points if trail_points and peak - entry >= activation_points else None
+        level = stop if trail is None else max(stop, trail)
+        # Stops first: if several are crossed at once, the highest is reached first
+        if x <= level:
+            reason = 'trailing_stop' if trail is not None and trail > stop else 'fixed_sl'
+            return (level if fill == 'level' else x) - entry, reason, i
+        if x >= target:
+            return (target if fill == 'level' else x) - entry, 'target', i
+    return None, 'signal', None
+
+
 def calc_stats(results, key='new_pnl_net'):
     """Calculate summary statistics."""
-    pnls = [r[key] for r in results]
+    return pnl_stats([r[key] for r in results])
+
+
+def pnl_stats(pnls):
+    """calc_stats() on a plain list of P&Ls (engine results: array.tolist())."""
     total = sum(pnls)
     winners = [p for p in pnls if p > 0]
     losers = [p for p in pnls if p <= 0]
@@ -234,16 +453,114 @@ def print_stats(label, stats):
     print(f"  Best/Worst:       {stats['best']:+.1f} / {stats['worst']:+.1f}")
 
 
+def verify(trades, signals):
+    """Every sweep point through the loops and through the engine: report any
+    field that differs, and the time each side took."""
+    t0 = time.perf_counter()
+    bt = Backtest(trades, signals, SPREAD)
+    build_s = time.perf_counter() - t0
+
+    cases = [(f"SL={sl}", lambda sl=sl: simulate_path(trades, signals, sl),
+              lambda sl=sl: bt.simulate(sl)) for sl in SL_GRID]
+    cases += [(f"trail={trail}", lambda trail=trail: simulate_trailing_stop(trades, signals, trail, 0),
+               lambda trail=trail: bt.trailing_stop(trail, 0)) for trail in TRAIL_GRID + [9999]]
+    cases += [(f"activ={activation} trail={trail}",
+               lambda a=activation, t=trail: simulate_trailing_stop(trades, signals, t, a),
+               lambda a=activation, t=trail: bt.trailing_stop(t, a))
+              for activation in ACTIVATION_GRID for trail in ACTIVATION_TRAIL_GRID]
+    cases += [(f"SL={sl} activ={activation} trail={trail}",
+               lambda s=sl, a=activation, t=trail: simulate_path(trades, signals, s, t, a),
+               lambda s=sl, a=activation, t=trail: bt.simulate(s, t, a))
+              for sl in (30, 100) for activation in (0, 50) for trail in (20, 50)]
+    cases += [(f"SL={sl} TP1={tp1} TP2={tp2}{' BE' if be else ''} {fill}",
+               lambda s=sl, t1=tp1, t2=tp2, be=be, f=fill: simulate_path(
+                   trades, signals, s, 30, 20, t1, t2, breakeven=be, fill=f),
+               lambda s=sl, t1=tp1, t2=tp2, be=be, f=fill: bt.simulate(
+                   s, 30, 20, t1, t2, breakeven=be, fill=f))
+              for sl in (None, 40) for tp1, tp2 in ((None, 50), (25, 75)) for be in (False, True)
+              for fill in ('level', 'price')]
+
+    print(f"\n{'='*60}")
+    print(f"  VERIFY: engine vs loops ({len(cases)} sweep points)")
+    print(f"{'='*60}")
+    loop_s, engine_s, failed = 0.0, build_s, 0
+    for label, loop, engine in cases:
+        t0 = time.perf_counter()
+        expected = loop()
+        t1 = time.perf_counter()
+        got = engine()
+        t2 = time.perf_counter()
+        loop_s += t1 - t0
+        engine_s += t2 - t1
+
+        got = to_records(got)
+        diffs = [(e['id'], k, e[k], g[k]) for e, g in zip(expected, got) for k in e if e[k] != g[k]]
+        if len(expected) != len(got):
+            diffs.append(('-', 'trades', len(expected), len(got)))
+        if diffs:
+            failed += 1
+            trade_id, field, want, have = diffs[0]
+            print(f"  {label:<28} \033[91m{len(diffs)} differences\033[0m (trade {trade_id} {field}: {want} != {have})")
+        else:
+            print(f"  {label:<28} OK")
+
+    print(f"\n  Loops:  {loop_s:8.3f} s")
+    print(f"  Engine: {engine_s:8.3f} s (build {build_s:.3f} s)  x{loop_s / engine_s:,.0f}")
+    print(f"  {'ALL MATCH' if not failed else f'{failed} sweep points differ'}")
+    return not failed
+
+
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--verify', action='store_true', help='check the engine against the loops, with timings')
+    parser.add_argument('--bars', choices=['1m', '5m', '1h'],
+                        help='price path from OHLC bars of this resolution instead of the signals')
+    parser.add_argument('--db', action='store_true',
+                        help="read the server's database (DATABASE_URL or signals.db) through history_cache")
+    parser.add_argument('--symbol', help='only this symbol (--db)')
+    parser.add_argument('--rebuild-cache', action='store_true', help='with --db: fetch everything again')
+    args = parser.parse_args()
+
     print("\n" + "="*60)
     print("  BLOOP TRAILING STOP OPTIMIZER")
     print("  233 trades | USTEC | IC Markets | Spread: 0.9 pts")
     print("="*60)
 
-    trades = load_trades()
-    signals = load_signals()
-
-    print(f"\n  Loaded {len(trades)} trades, {len(signals)} signals")
+    # BLOOP_API_URL (+ WEBHOOK_SECRET): read from the server instead of /tmp exports
+    api_url = os.environ.get('BLOOP_API_URL')
+    path = None
+    if args.db:
+        trades, path = load_from_db(args.symbol, args.rebuild_cache)
+        signals = [{'timestamp': ts, 'price': price, 'symbol': path['symbols'][code]}
+                   for ts, price, code in zip(iso_from_us(path['timestamp']), path['price'].tolist(),
+                                              path['symbol'].tolist())] if args.verify else []
+        n_signals = len(path['price'])
+    elif api_url:
+        trades, signals = load_from_api(api_url.rstrip('/'), os.environ.get('WEBHOOK_SECRET', ''))
+        n_signals = len(signals)
+    else:
+        trades = load_trades()
+        signals = load_signals()
+        n_signals = len(signals)
+
+    print(f"\n  Loaded {len(trades)} trades, {n_signals} signals")
+
+    if args.verify:
+        sys.exit(0 if verify(trades, signals) else 1)
+    if args.bars:
+        from ohlc_bars import RESOLUTIONS
+        if args.db:
+            bars = load_traded_bars(trades, args.bars)
+        elif api_url:
+            bars = load_traded_bars(trades, args.bars, api_url.rstrip('/'), os.environ.get('WEBHOOK_SECRET', ''))
+        else:
+            bars = load_bars()
+        print(f"  Price path: {len(bars)} {args.bars} bars")
+        bt = Backtest.from_bars(trades, bars, SPREAD, RESOLUTIONS[args.bars])
+    elif path is not None:
+        bt = Backtest.from_points(trades, path['timestamp'], path['price'], SPREAD, path['symbol'], path['symbols'])
+    else:
+        bt = Backtest(trades, signals, SPREAD)
 
     # ============================================================
     # BASELINE: Original results (no stops)
@@ -263,7 +580,7 @@ def main():
     # FIXED STOP LOSS SWEEP
     # ============================================================
     print(f"\n\n{'='*60}")
-    print("  FIXED STOP LOSS SWEEP")
+    print("  FIXED STOP LOSS SWEEP (checked along the price path)")
     print(f"{'='*60}")
     print(f"  {'SL (pts)':<10} {'P&L Net':<12} {'WR%':<8} {'PF':<8} {'Expect':<10} {'MaxDD':<10} {'Triggers'}")
     print(f"  {'-'*10} {'-'*12} {'-'*8} {'-'*8} {'-'*10} {'-'*10} {'-'*8}")
@@ -271,10 +588,10 @@ def main():
     best_sl = None
     best_sl_pnl = float('-inf')
 
-    for sl in [20, 30, 40, 50, 60, 75, 100, 125, 150, 200]:
-        results = simulate_fixed_stop_loss(trades, sl)
-        stats = calc_stats(results)
-        triggers = sum(1 for r in results if r['sl_triggered'])
+    for sl in SL_GRID:
+        results = bt.simulate(sl)
+        stats = pnl_stats(results['new_pnl_net'].tolist())
+        triggers = int(results['sl_triggered'].sum())
 
         color = '\033[92m' if stats['total_pnl'] > baseline_stats['total_pnl'] else '\033[0m'
         reset = '\033[0m'
@@ -300,10 +617,10 @@ def main():
     best_trail = None
     best_trail_pnl = float('-inf')
 
-    for trail in [15, 20, 30, 40, 50, 60, 75, 100, 125, 150]:
-        results = simulate_trailing_stop(trades, signals, trail, activation_points=0)
-        stats = calc_stats(results)
-        triggers = sum(1 for r in results if r['trail_triggered'])
+    for trail in TRAIL_GRID:
+        results = bt.trailing_stop(trail, activation_points=0)
+        stats = pnl_stats(results['new_pnl_net'].tolist())
+        triggers = int(results['trail_triggered'].sum())
 
         color = '\033[92m' if stats['total_pnl'] > baseline_stats['total_pnl'] else '\033[0m'
         reset = '\033[0m'
@@ -328,11 +645,11 @@ def main():
     best_combo = None
     best_combo_pnl = float('-inf')
 
-    for activation in [20, 30, 50, 75, 100]:
-        for trail in [15, 20, 30, 40, 50, 75]:
-            results = simulate_trailing_stop(trades, signals, trail, activation)
-            stats = calc_stats(results)
-            triggers = sum(1 for r in results if r['trail_triggered'])
+    for activation in ACTIVATION_GRID:
+        for trail in ACTIVATION_TRAIL_GRID:
+            results = bt.trailing_stop(trail, activation)
+            stats = pnl_stats(results['new_pnl_net'].tolist())
+            triggers = int(results['trail_triggered'].sum())
 
             if triggers == 0:
                 continue
@@ -357,63 +674,40 @@ def main():
         print(f"  COMBINED: SL={best_sl} + Trail(activ={best_combo[0]}, trail={best_combo[1]})")
         print(f"{'='*60}")
 
-        combined_results = []
-        for trade in trades:
-            # Apply fixed SL first
-            pnl = trade['pnl_points']
-            if pnl < -best_sl:
-                pnl = -best_sl
-                combined_results.append({
-                    'id': trade['id'],
-                    'original_pnl': trade['pnl_points'],
-                    'new_pnl': pnl,
-                    'new_pnl_net': pnl - SPREAD,
-                })
+        combined_results = bt.simulate(best_sl, best_combo[1], best_combo[0])
+        combined_stats = pnl_stats(combined_results['new_pnl_net'].tolist())
+        print_stats(f"COMBINED (SL={best_sl} + Trail {best_combo[0]}/{best_combo[1]})", combined_stats)
+
+    # ============================================================
+    # TAKE PROFIT: TP1 (half off) + TP2, with the best SL
+    # ============================================================
+    print(f"\n\n{'='*60}")
+    print(f"  TAKE PROFIT SWEEP (SL={best_sl}, TP1 closes half, stop to entry after TP1)")
+    print(f"{'='*60}")
+    print(f"  {'TP1':<8} {'TP2':<8} {'P&L Net':<12} {'WR%':<8} {'PF':<8} {'Expect':<10} {'TP1/TP2 hits'}")
+    print(f"  {'-'*8} {'-'*8} {'-'*12} {'-'*8} {'-'*8} {'-'*10} {'-'*12}")
+
+    best_tp = None
+    best_tp_pnl = float('-inf')
+
+    for tp1 in TP1_GRID:
+        for tp2 in TP2_GRID:
+            if tp1 and tp1 >= tp2:
                 continue
+            results = bt.simulate(best_sl, tp1_points=tp1, tp2_points=tp2, breakeven=True)
+            stats = pnl_stats(results['new_pnl_net'].tolist())
+            hits = f"{int(results['tp1_hit'].sum())}/{int(results['tp2_hit'].sum())}"
 
-            # Then check trailing stop
-            direction = trade['direction']
-            entry = trade['entry_price']
-            intermediate_prices = get_prices_during_trade(
-                signals, trade['entry_time'], trade['exit_time']
-            )
+            color = '\033[92m' if stats['total_pnl'] > baseline_stats['total_pnl'] else '\033[0m'
+            reset = '\033[0m'
 
-            peak = entry
-            trail_exit = None
+            print(f"  {tp1 or '-':<8} {tp2:<8} {color}{stats['total_pnl']:>+10.1f}{reset}  {stats['win_rate']:<8} {stats['profit_factor']:<8} {stats['expectancy']:>+8.1f}  {hits}")
 
-            for price in intermediate_prices:
-                if direction == 'LONG':
-                    if price > peak:
-                        peak = price
-                    unrealized = peak - entry
-                    if unrealized >= best_combo[0]:
-                        if price <= peak - best_combo[1]:
-                            trail_exit = peak - best_combo[1]
-                            break
-                else:
-                    if price < peak:
-                        peak = price
-                    unrealized = entry - peak
-                    if unrealized >= best_combo[0]:
-                        if price >= peak + best_combo[1]:
-                            trail_exit = peak + best_combo[1]
-                            break
-
-            if trail_exit:
-                if direction == 'LONG':
-                    pnl = trail_exit - entry
-                else:
-                    pnl = entry - trail_exit
-
-            combined_results.append({
-                'id': trade['id'],
-                'original_pnl': trade['pnl_points'],
-                'new_pnl': pnl,
-                'new_pnl_net': pnl - SPREAD,
-            })
+            if stats['total_pnl'] > best_tp_pnl:
+                best_tp_pnl = stats['total_pnl']
+                best_tp = (tp1, tp2)
 
-        combined_stats = calc_stats(combined_results)
-        print_stats(f"COMBINED (SL={best_sl} + Trail {best_combo[0]}/{best_combo[1]})", combined_stats)
+    print(f"\n  >>> Best targets: TP1={best_tp[0] or '-'} TP2={best_tp[1]} (P&L: {best_tp_pnl:+.1f})")
 
     # ============================================================
     # ANALYSIS: Trades that gave back significant profit
@@ -424,12 +718,10 @@ def main():
     print(f"{'='*60}")
 
     # Use trailing stop results to find MFE data
-    trail_results = simulate_trailing_stop(trades, signals, 9999, 0)  # huge trail = never triggers, but tracks MFE
+    trail_results = bt.trailing_stop(9999, 0)  # huge trail = never triggers, but tracks MFE
 
     gave_back = []
-    for r in trail_results:
-        trade = next(t for t in trades if t['id'] == r['id'])
-        mfe = r['mfe']
+    for trade, mfe in zip(trades, trail_results['mfe'].tolist()):
         final_pnl = trade['pnl_points']
         gave_back_pts = mfe - final_pnl if trade['direction'] == 'LONG' else mfe + final_pnl
         # For shorts: MFE is how far price dropped, final_pnl is positive if price dropped
@@ -475,10 +767,11 @@ def main():
   Best Trailing:      {best_trail_pnl:+.1f} pts (trail={best_trail} pts)""")
     if best_combo:
         print(f"  Best Combo:         {best_combo_pnl:+.1f} pts (activ={best_combo[0]}, trail={best_combo[1]})")
+    print(f"  Best Targets:       {best_tp_pnl:+.1f} pts (SL={best_sl}, TP1={best_tp[0] or '-'}, TP2={best_tp[1]})")
 
     print(f"""
   IMPORTANT CAVEATS:
-  - Analysis uses signal prices only (every ~30-90 min), NOT tick data
+  - Analysis uses signal prices only (every ~30-90 min) unless --bars, NOT tick data
   - Real trailing stops would trigger at intermediate prices we can't see
   - Results are CONSERVATIVE — real trailing stops would likely perform better
   - To get accurate results, enable PRICE_UPDATE in webhook_server.py
@@ -6,13 +6,50 @@ Incluye datos para optimización: ATR, TP1, TP2, SL, High, Low
 Incluye coste de spread en cálculos de P&L
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from functools import wraps
+import click
+import atexit
+import base64
+import csv
+import io
 import json
+import logging
 import os
+import threading
+import time
+from collections import Counter
 from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from db import USE_POSTGRES, create_indexes, db_connection, get_db_connection, pool_stats, q, table_columns
+from db_time import migrate_time_columns, rows_from_db, time_indexes, to_db
+from event_stream import (EVENT_TYPES, STREAM_CONFIG, EventBus, NotifyListener, TooManySubscribers,
+                          encode_frame, stream_frames)
+from metrics import (HTTP_DURATION, HTTP_REQUESTS, INGEST_DEPTH, METRICS, OPEN_POSITIONS, POOL_EVENTS,
+                     POOL_IN_USE, SIGNALS, STREAM_SUBSCRIBERS, TICK_LAG, TRADES_CLOSED, begin_stages,
+                     db_timer, end_stages)
+from ingest_queue import (INGEST_CONFIG, IngestQueue, QueueApplier, QueueFull,
+                          create_cursor_table, read_cursor, write_cursor)
+from ohlc_bars import (BAR_QUERY_FIELDS, OHLC_RESOLUTIONS, backfill_chunk, create_bars_table,
+                       merge_signals, read_bars)
+from position_state import (DEFAULT_STRATEGY, DEFAULT_SYMBOL, PositionState, create_positions_table,
+                            delete_position, position_key, read_open_position, write_position)
+from recalculate import (CHUNK_SIZE as RECALC_CHUNK_SIZE, JobBusy, create_job, create_recalc_tables,
+                         is_running_here, list_jobs, preview_totals, read_job, run_job,
+                         sync_spreads)
+from response_cache import ResponseCache, conditional_get
+from retention import RETENTION_CONFIG, RetentionWorker, enable_incremental_vacuum, pending, run_retention
+from runtime_config import create_config_table, load_config, save_config
+from serialization import FastJSONProvider, columns, compress_response, dumps
+from structured_log import LOG_CONFIG, log_event, sample_rate, sampled, status as log_status
+from stats_summary import (add_signals, add_trade, bump_version, clear_compacted,
+                           create_summary_table, read_summary, read_version, rebuild_summary,
+                           rebuild_trade_totals)
+from trade_engine import close_trade, decide, is_stale, new_position
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 # ============================================================
 # AUTHENTICATION
@@ -32,6 +69,72 @@ def require_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+# ============================================================
+# MÉTRICAS (/metrics): latencia por ruta; las operaciones de DB se miden donde ocurren
+# ============================================================
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    begin_stages()
+
+
+@app.after_request
+def record_request(response):
+    # Registered before compress(): after_request runs in reverse, so this one is last
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('request_started')
+    stages = end_stages()
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        METRICS.observe(HTTP_DURATION, elapsed, route=route, method=request.method)
+        if LOG_CONFIG['slow_request_ms'] and elapsed * 1000 >= LOG_CONFIG['slow_request_ms']:
+            log_slow_request(route, response.status_code, elapsed, stages)
+    METRICS.inc(HTTP_REQUESTS, route=route, method=request.method, status=response.status_code)
+    return response
+
+
+def log_slow_request(route, status, elapsed, stages):
+    """Requests over LOG_SLOW_REQUEST_MS, with the time spent per stage
+    (DB operations, lock waits; `other` = the rest: parsing, logic, JSON)."""
+    stage_ms = {name: {'ms': round(seconds * 1000, 2), 'calls': calls}
+                for name, (seconds, calls) in sorted(stages.items(), key=lambda s: -s[1][0])}
+    other_ms = elapsed * 1000 - sum(s['ms'] for s in stage_ms.values())
+    summary = ', '.join(f"{name} {s['ms']:.1f}" for name, s in stage_ms.items())
+    log_event('slow_request', '🐢 %s %s -> %s in %.0f ms (%s, other %.1f)', request.method, request.path,
+              status, elapsed * 1000, summary or 'no DB stages', other_ms, level=logging.WARNING,
+              route=route, method=request.method, path=request.path, status=status,
+              duration_ms=round(elapsed * 1000, 2), stages=stage_ms, other_ms=round(other_ms, 2))
+
+
+KNOWN_SIGNALS = ('LONG', 'SHORT', 'PRICE_UPDATE')
+
+
+def record_applied(sigs, closed_trades):
+    """After commit: signals per type, trades per exit reason, tick lag
+    (sent_at is set by price_updater; one observation per request)."""
+    for signal, n in Counter(s['signal'] if s['signal'] in KNOWN_SIGNALS else 'other' for s in sigs).items():
+        METRICS.inc(SIGNALS, n, signal=signal)
+    for trade in closed_trades:
+        if trade:
+            METRICS.inc(TRADES_CLOSED, reason=trade['exit_reason'].split(' ')[0])
+    now = time.time()
+    for sent_at in {s['sent_at'] for s in sigs if s.get('sent_at')}:
+        METRICS.observe(TICK_LAG, max(0.0, now - sent_at))
+
+
+def runtime_samples():
+    """Gauges and pool counters of this process, read at scrape/flush time."""
+    pool = pool_stats()
+    samples = [(POOL_IN_USE, {}, pool['in_use']),
+               (OPEN_POSITIONS, {}, len(POSITION.positions())),
+               (STREAM_SUBSCRIBERS, {}, EVENTS.stats()['subscribers'])]
+    samples += [(POOL_EVENTS, {'event': name}, pool[name])
+                for name in ('waits', 'timeouts', 'created', 'recycled', 'discarded', 'health_check_failures')]
+    if APPLIER:
+        samples.append((INGEST_DEPTH, {}, APPLIER.status()['depth']))
+    return samples
+
+
 # ============================================================
 # CONFIGURACIÓN DE SPREAD (IC Markets USTEC)
 # Basado en monitoreo real: 2026-02-09/10 (~22 horas de datos)
@@ -63,27 +166,9 @@ def get_spread_for_symbol(symbol='USTEC'):
     config = SPREAD_CONFIG.get(symbol, SPREAD_CONFIG.get('USTEC'))
     return config['spread_points']
 
-# Database setup
-DATABASE_URL = os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_PUBLIC_URL')
-
-if DATABASE_URL:
-    import psycopg2
-    USE_POSTGRES = True
-else:
-    import sqlite3
-    USE_POSTGRES = False
-    DB_PATH = os.path.join(os.path.dirname(__file__), 'signals.db')
-
-
-def get_db_connection():
-    if USE_POSTGRES:
-        return psycopg2.connect(DATABASE_URL)
-    else:
-        return sqlite3.connect(DB_PATH)
-
-
 def init_db():
     """Crear tablas si no existen."""
+    # Unpooled on purpose: runs at import time, possibly in the gunicorn master
     conn = get_db_connection()
     c = conn.cursor()
     
@@ -92,7 +177,7 @@ def init_db():
         c.execute('''
             CREATE TABLE IF NOT EXISTS signals (
                 id SERIAL PRIMARY KEY,
-                timestamp TEXT NOT NULL,
+                timestamp TIMESTAMPTZ NOT NULL,
                 signal TEXT NOT NULL,
                 price REAL,
                 symbol TEXT,
@@ -104,6 +189,7 @@ def init_db():
                 high REAL,
                 low REAL,
                 raw_payload TEXT,
+                strategy TEXT NOT NULL DEFAULT 'default',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
@@ -114,13 +200,13 @@ def init_db():
                 id SERIAL PRIMARY KEY,
                 symbol TEXT,
                 direction TEXT,
-                entry_time TEXT,
+                entry_time TIMESTAMPTZ,
                 entry_price REAL,
                 entry_atr REAL,
                 entry_tp1 REAL,
                 entry_tp2 REAL,
                 entry_sl REAL,
-                exit_time TEXT,
+                exit_time TIMESTAMPTZ,
                 exit_price REAL,
                 exit_reason TEXT,
                 pnl_points REAL,
@@ -130,24 +216,8 @@ def init_db():
                 pnl_net_percent REAL,
                 duration_seconds INTEGER,
                 max_price REAL,
-                min_price REAL
-            )
-        ''')
-        
-        # Posición abierta con datos de optimización
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS open_position (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                direction TEXT,
-                entry_time TEXT,
-                entry_price REAL,
-                symbol TEXT,
-                atr REAL,
-                tp1 REAL,
-                tp2 REAL,
-                sl REAL,
-                max_price REAL,
-                min_price REAL
+                min_price REAL,
+                strategy TEXT NOT NULL DEFAULT 'default'
             )
         ''')
         
@@ -169,12 +239,6 @@ def init_db():
             ('trades', 'spread_cost', 'REAL'),
             ('trades', 'pnl_net_points', 'REAL'),
             ('trades', 'pnl_net_percent', 'REAL'),
-            ('open_position', 'atr', 'REAL'),
-            ('open_position', 'tp1', 'REAL'),
-            ('open_position', 'tp2', 'REAL'),
-            ('open_position', 'sl', 'REAL'),
-            ('open_position', 'max_price', 'REAL'),
-            ('open_position', 'min_price', 'REAL'),
         ]
         for table, col, dtype in migration_columns:
             try:
@@ -185,10 +249,12 @@ def init_db():
                 pass  # Column already exists
     else:
         # SQLite syntax
+        # Solo tiene efecto en una base nueva: permite PRAGMA incremental_vacuum (retention)
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
         c.execute('''
             CREATE TABLE IF NOT EXISTS signals (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
                 signal TEXT NOT NULL,
                 price REAL,
                 symbol TEXT,
@@ -200,6 +266,7 @@ def init_db():
                 high REAL,
                 low REAL,
                 raw_payload TEXT,
+                strategy TEXT NOT NULL DEFAULT 'default',
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )
         ''')
@@ -209,13 +276,13 @@ def init_db():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 symbol TEXT,
                 direction TEXT,
-                entry_time TEXT,
+                entry_time INTEGER,
                 entry_price REAL,
                 entry_atr REAL,
                 entry_tp1 REAL,
                 entry_tp2 REAL,
                 entry_sl REAL,
-                exit_time TEXT,
+                exit_time INTEGER,
                 exit_price REAL,
                 exit_reason TEXT,
                 pnl_points REAL,
@@ -225,218 +292,281 @@ def init_db():
                 pnl_net_percent REAL,
                 duration_seconds INTEGER,
                 max_price REAL,
-                min_price REAL
-            )
-        ''')
-        
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS open_position (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                direction TEXT,
-                entry_time TEXT,
-                entry_price REAL,
-                symbol TEXT,
-                atr REAL,
-                tp1 REAL,
-                tp2 REAL,
-                sl REAL,
-                max_price REAL,
-                min_price REAL
+                min_price REAL,
+                strategy TEXT NOT NULL DEFAULT 'default'
             )
         ''')
-    
+
+    # Posiciones por (symbol, strategy): columna strategy en bases anteriores
+    for table in ('signals', 'trades'):
+        if 'strategy' not in table_columns(conn, table):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN strategy TEXT NOT NULL DEFAULT '{DEFAULT_STRATEGY}'")
+
+    create_bars_table(conn)
+    migrated = migrate_time_columns(conn)
+    if migrated:
+        print(f"🕒 Time columns migrated to native types: {', '.join(migrated)}")
+    create_positions_table(conn)
+    create_indexes(conn)
+    create_summary_table(conn)
+    create_cursor_table(c)
+    create_recalc_tables(conn)
+    create_config_table(conn)
+    sync_spreads(conn, current_spreads())
     conn.commit()
     conn.close()
     db_type = "PostgreSQL" if USE_POSTGRES else "SQLite"
     print(f"✅ Database initialized ({db_type})")
 
 
-def get_open_position(conn):
-    c = conn.cursor()
-    c.execute('''SELECT direction, entry_time, entry_price, symbol, 
-                        atr, tp1, tp2, sl, max_price, min_price 
-                 FROM open_position WHERE id = 1''')
-    row = c.fetchone()
-    if row:
-        return {
-            'direction': row[0], 'entry_time': row[1], 'entry_price': row[2], 
-            'symbol': row[3], 'atr': row[4], 'tp1': row[5], 'tp2': row[6], 
-            'sl': row[7], 'max_price': row[8], 'min_price': row[9]
-        }
-    return None
-
-
-def update_position_extremes(conn, price):
-    """Update max/min price for the open position. Returns updated position."""
-    pos = get_open_position(conn)
+def set_open_position(conn, direction, entry_time, entry_price, symbol,
+                      atr=None, tp1=None, tp2=None, sl=None, strategy=DEFAULT_STRATEGY):
+    """Upsert the open position of (symbol, strategy). Returns it as a dict. Caller commits."""
+    pos = new_position(direction, entry_time, entry_price, symbol, strategy, atr, tp1, tp2, sl)
+    write_position(conn, pos)
+    bump_version(conn, position_key(pos))
+    return pos
+
+
+def close_position(conn, exit_time, exit_price, exit_reason='signal',
+                   pos=None, delete_row=True, key=None):
+    """Book the open position as a trade. Caller commits.
+
+    pos: the in-memory position (POSITION) — avoids reading the row back;
+    otherwise the row of `key` (symbol, strategy) is read.
+    delete_row: False when the caller is about to overwrite the row
+    with a new position (reversal), so the DELETE is skipped.
+    """
+    if pos is None:
+        pos = read_open_position(conn, key or (DEFAULT_SYMBOL, DEFAULT_STRATEGY))
     if not pos:
         return None
+    
+    trade = close_trade(pos, exit_time, exit_price, exit_reason,
+                        get_spread_for_symbol(pos['symbol'] or DEFAULT_SYMBOL))
+    c = conn.cursor()
+    with db_timer('trade_insert'):
+        c.execute(q('''
+        INSERT INTO trades (symbol, direction, entry_time, entry_price,
+                           entry_atr, entry_tp1, entry_tp2, entry_sl,
+                           exit_time, exit_price, exit_reason,
+                           pnl_points, pnl_percent,
+                           spread_cost, pnl_net_points, pnl_net_percent,
+                           duration_seconds, max_price, min_price, strategy)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''), (pos['symbol'], pos['direction'], to_db(pos['entry_time']), pos['entry_price'],
+               pos['atr'], pos['tp1'], pos['tp2'], pos['sl'],
+               to_db(exit_time), exit_price, exit_reason,
+               trade['pnl_points'], trade['pnl_percent'],
+               trade['spread_cost'], trade['pnl_net_points'], trade['pnl_net_percent'],
+               trade['duration_seconds'], pos['max_price'], pos['min_price'], pos['strategy']))
+    if delete_row:
+        delete_position(conn, position_key(pos))
+    
+    add_trade(conn, trade)
+    return trade
 
-    max_p = max(pos['max_price'] or price, price)
-    min_p = min(pos['min_price'] or price, price)
 
-    c = conn.cursor()
-    if USE_POSTGRES:
-        c.execute('UPDATE open_position SET max_price = %s, min_price = %s WHERE id = 1',
-                  (max_p, min_p))
-    else:
-        c.execute('UPDATE open_position SET max_price = ?, min_price = ? WHERE id = 1',
-                  (max_p, min_p))
-    conn.commit()
+def parse_signal(data, timestamp=None):
+    """Normaliza el payload de TradingView / price_updater a un dict de señal."""
+    def opt(key):
+        # Datos de optimización (opcionales)
+        return float(data.get(key, 0)) if data.get(key) else None
 
-    pos['max_price'] = max_p
-    pos['min_price'] = min_p
-    return pos
+    return {
+        'timestamp': timestamp or datetime.now(timezone.utc).isoformat(),
+        'signal': data.get('signal', 'UNKNOWN').upper(),
+        'price': float(data.get('price', 0)),
+        'symbol': data.get('symbol', DEFAULT_SYMBOL),
+        'strategy': str(data.get('strategy') or DEFAULT_STRATEGY),
+        'timeframe': data.get('timeframe', '1m'),
+        'atr': opt('atr'), 'tp1': opt('tp1'), 'tp2': opt('tp2'),
+        'sl': opt('sl'), 'high': opt('high'), 'low': opt('low'),
+        'raw_payload': json.dumps(data),
+        'sent_at': float(data['sent_at']) if data.get('sent_at') else None,
+    }
 
 
-def check_trailing_stop(pos, current_price):
-    """Check if trailing stop or fixed SL should trigger.
-    Returns (should_close, reason) tuple."""
-    cfg = TRAILING_STOP_CONFIG
-    if not cfg['enabled']:
-        return False, None
+SIGNAL_INSERT_FIELDS = ['timestamp', 'signal', 'price', 'symbol', 'timeframe',
+                        'atr', 'tp1', 'tp2', 'sl', 'high', 'low', 'raw_payload', 'strategy']
+INSERT_SIGNAL_SQL = q(f'''
+    INSERT INTO signals ({', '.join(SIGNAL_INSERT_FIELDS)})
+    VALUES ({', '.join('?' * len(SIGNAL_INSERT_FIELDS))})
+''')
 
-    direction = pos['direction']
-    entry = pos['entry_price']
 
-    # Fixed stop loss check
-    if cfg['fixed_sl_points'] > 0:
-        if direction == 'LONG':
-            unrealized = current_price - entry
-        else:
-            unrealized = entry - current_price
-        if unrealized <= -cfg['fixed_sl_points']:
-            return True, f"fixed_sl ({cfg['fixed_sl_points']}pts)"
-
-    # Trailing stop check
-    if cfg['trail_points'] > 0:
-        if direction == 'LONG':
-            peak = pos['max_price'] or entry
-            unrealized_from_entry = peak - entry
-            if unrealized_from_entry >= cfg['activation_points']:
-                trail_level = peak - cfg['trail_points']
-                if current_price <= trail_level:
-                    return True, f"trailing_stop (peak={peak:.1f}, trail={cfg['trail_points']}pts)"
-        else:  # SHORT
-            trough = pos['min_price'] or entry
-            unrealized_from_entry = entry - trough
-            if unrealized_from_entry >= cfg['activation_points']:
-                trail_level = trough + cfg['trail_points']
-                if current_price >= trail_level:
-                    return True, f"trailing_stop (trough={trough:.1f}, trail={cfg['trail_points']}pts)"
-
-    return False, None
+def signal_row(sig):
+    return [to_db(sig[k]) if k == 'timestamp' else sig[k] for k in SIGNAL_INSERT_FIELDS]
 
 
-def set_open_position(conn, direction, entry_time, entry_price, symbol,
-                      atr=None, tp1=None, tp2=None, sl=None):
+def insert_signal(conn, sig):
     c = conn.cursor()
-    if USE_POSTGRES:
-        c.execute('''
-            INSERT INTO open_position (id, direction, entry_time, entry_price, symbol,
-                                       atr, tp1, tp2, sl, max_price, min_price)
-            VALUES (1, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                direction = EXCLUDED.direction,
-                entry_time = EXCLUDED.entry_time,
-                entry_price = EXCLUDED.entry_price,
-                symbol = EXCLUDED.symbol,
-                atr = EXCLUDED.atr,
-                tp1 = EXCLUDED.tp1,
-                tp2 = EXCLUDED.tp2,
-                sl = EXCLUDED.sl,
-                max_price = EXCLUDED.max_price,
-                min_price = EXCLUDED.min_price
-        ''', (direction, entry_time, entry_price, symbol, atr, tp1, tp2, sl, 
-              entry_price, entry_price))
-    else:
-        c.execute('''
-            INSERT OR REPLACE INTO open_position 
-            (id, direction, entry_time, entry_price, symbol, atr, tp1, tp2, sl, max_price, min_price)
-            VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (direction, entry_time, entry_price, symbol, atr, tp1, tp2, sl,
-              entry_price, entry_price))
-    conn.commit()
+    with db_timer('signal_insert'):
+        c.execute(INSERT_SIGNAL_SQL, signal_row(sig))
+    merge_signals(conn, [sig])
 
 
-def close_position(conn, exit_time, exit_price, exit_reason='signal'):
-    pos = get_open_position(conn)
-    if not pos:
-        return None
-    
-    # Calcular P&L bruto
-    if pos['direction'] == 'LONG':
-        pnl_points = exit_price - pos['entry_price']
-    else:
-        pnl_points = pos['entry_price'] - exit_price
-    
-    pnl_percent = (pnl_points / pos['entry_price']) * 100
-    
-    # Calcular spread cost y P&L neto
-    symbol = pos['symbol'] or 'USTEC'
-    spread_cost = get_spread_for_symbol(symbol)
-    pnl_net_points = pnl_points - spread_cost
-    pnl_net_percent = (pnl_net_points / pos['entry_price']) * 100
-    
-    entry_dt = datetime.fromisoformat(pos['entry_time'])
-    exit_dt = datetime.fromisoformat(exit_time)
-    duration = int((exit_dt - entry_dt).total_seconds())
-    
+def insert_signals(conn, sigs):
+    """Multi-row insert: COPY on PostgreSQL, executemany on SQLite."""
+    rows = [signal_row(s) for s in sigs]
     c = conn.cursor()
-    
+    with db_timer('signal_insert'):
+        _copy_or_insert(c, rows)
+    merge_signals(conn, sigs)
+
+
+def _copy_or_insert(c, rows):
     if USE_POSTGRES:
-        c.execute('''
-            INSERT INTO trades (symbol, direction, entry_time, entry_price,
-                               entry_atr, entry_tp1, entry_tp2, entry_sl,
-                               exit_time, exit_price, exit_reason,
-                               pnl_points, pnl_percent, 
-                               spread_cost, pnl_net_points, pnl_net_percent,
-                               duration_seconds, max_price, min_price)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (pos['symbol'], pos['direction'], pos['entry_time'], pos['entry_price'],
-              pos['atr'], pos['tp1'], pos['tp2'], pos['sl'],
-              exit_time, exit_price, exit_reason,
-              pnl_points, pnl_percent,
-              spread_cost, pnl_net_points, pnl_net_percent,
-              duration, pos['max_price'], pos['min_price']))
-        c.execute('DELETE FROM open_position WHERE id = 1')
+        # CSV: None is written unquoted and empty, which COPY reads as NULL
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        c.copy_expert(f"COPY signals ({', '.join(SIGNAL_INSERT_FIELDS)}) FROM STDIN WITH (FORMAT csv)", buf)
     else:
-        c.execute('''
-            INSERT INTO trades (symbol, direction, entry_time, entry_price,
-                               entry_atr, entry_tp1, entry_tp2, entry_sl,
-                               exit_time, exit_price, exit_reason,
-                               pnl_points, pnl_percent,
-                               spread_cost, pnl_net_points, pnl_net_percent,
-                               duration_seconds, max_price, min_price)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (pos['symbol'], pos['direction'], pos['entry_time'], pos['entry_price'],
-              pos['atr'], pos['tp1'], pos['tp2'], pos['sl'],
-              exit_time, exit_price, exit_reason,
-              pnl_points, pnl_percent,
-              spread_cost, pnl_net_points, pnl_net_percent,
-              duration, pos['max_price'], pos['min_price']))
-        c.execute('DELETE FROM open_position WHERE id = 1')
-    
-    conn.commit()
-    
-    return {
-        'direction': pos['direction'],
-        'entry_price': pos['entry_price'],
-        'exit_price': exit_price,
-        'exit_reason': exit_reason,
-        'pnl_points': pnl_points,
-        'pnl_percent': pnl_percent,
-        'spread_cost': spread_cost,
-        'pnl_net_points': pnl_net_points,
-        'pnl_net_percent': pnl_net_percent,
-        'duration_seconds': duration,
-        'max_price': pos['max_price'],
-        'min_price': pos['min_price'],
-        'atr': pos['atr'],
-        'tp1': pos['tp1'],
-        'tp2': pos['tp2'],
-        'sl': pos['sl']
-    }
+        c.executemany(INSERT_SIGNAL_SQL, rows)
+
+
+def process_signal(conn, sig, txn):
+    """Guarda la señal, la cuenta y aplica la lógica de trading dentro de la
+    transacción actual de conn, sin commit: el caller hace un único commit por
+    señal y luego POSITION.commit(txn).
+
+    Returns (position, closed_trade, totals), totals being the stats
+    counters after this signal.
+    """
+    insert_signal(conn, sig)
+    pos, closed_trade, _ = apply_signal(conn, sig, txn)
+    totals = add_signals(conn, [sig])
+    txn.write_through(conn)
+    stage_events(conn, txn)
+    return pos, closed_trade, totals
+
+
+def process_batch(conn, sigs, txn):
+    """Bulk-insert sigs, then replay them in order through apply_signal, all
+    in the caller's transaction. Returns ([(position, closed_trade, stale)], totals)."""
+    insert_signals(conn, sigs)
+    outcomes = [apply_signal(conn, sig, txn) for sig in sigs]
+    totals = add_signals(conn, sigs)
+    txn.write_through(conn)
+    stage_events(conn, txn)
+    return outcomes, totals
+
+
+def stage_events(conn, txn):
+    """Close the transaction's event list (extremes last, one per position) and
+    hand it to the bus; EVENTS.after_commit(txn.events) once committed."""
+    txn.events.extend(('extremes', pos) for pos in txn.moved_extremes())
+    EVENTS.before_commit(conn, txn.events)
+
+
+def book_trade(txn, key, trade, pos, exit_time):
+    """A close_position() of this transaction: update txn, queue the event."""
+    txn.closed(key)
+    txn.events.append(('trade_closed', {**trade, 'entry_time': pos['entry_time'], 'exit_time': exit_time}))
+
+
+def apply_signal(conn, sig, txn):
+    """Lógica de trading para una señal ya guardada, sobre la posición de su
+    clave (symbol, strategy).
+
+    The position comes from memory (txn), never from a SELECT. Extremes are
+    written behind (see position_state); opens and closes are written here.
+
+    Returns (position, closed_trade, stale): the open position of the key
+    after the signal (None if flat), the trade closed by it, if any, and
+    whether it was skipped as older than that position (trade_engine.is_stale:
+    buffered ticks landing after a reversal). Stale signals are still stored.
+    """
+    signal, price, timestamp = sig['signal'], sig['price'], sig['timestamp']
+    key = position_key(sig)
+    txn.events.append(('signal', {'timestamp': timestamp, 'signal': signal, 'price': price,
+                                  'symbol': key[0], 'strategy': key[1]}))
+
+    pos = txn.get(key)
+    closed_trade = None
+    if is_stale(pos, timestamp):
+        return pos, None, True
+
+    # Update max/min price on every signal (for trailing stop tracking)
+    if pos:
+        txn.update_extremes(key, price)
+
+    # PRICE_UPDATE: stops only. LONG/SHORT: open, reverse, or stops (trade_engine)
+    close_reason, open_direction = decide(pos, signal, price, TRAILING_STOP_CONFIG)
+    if close_reason:
+        # Reversal: the upsert below overwrites the row, no DELETE needed
+        closed_trade = close_position(conn, timestamp, price, close_reason,
+                                      pos=pos, delete_row=not open_direction)
+        book_trade(txn, key, closed_trade, pos, timestamp)
+    if open_direction:
+        opened = set_open_position(conn, open_direction, timestamp, price, key[0],
+                                   sig['atr'], sig['tp1'], sig['tp2'], sig['sl'],
+                                   strategy=key[1])
+        txn.opened(key, opened)
+        txn.events.append(('position_opened', dict(opened)))
+
+    txn.flush_if_due(conn)
+    return txn.get(key), closed_trade, False
+
+
+SIGNAL_EMOJI = {'LONG': '🟢', 'SHORT': '🔴', 'PRICE_UPDATE': '📡'}
+TRADE_LOG_FIELDS = ('symbol', 'strategy', 'direction', 'entry_price', 'exit_price', 'exit_reason',
+                    'pnl_points', 'pnl_net_points', 'spread_cost', 'duration_seconds')
+
+
+def _sample_fields(key):
+    rate = sample_rate(key)
+    return {'sample_rate': rate} if rate > 1 else {}
+
+
+def log_signal(sig, closed_trade, totals):
+    """Un evento por señal (PRICE_UPDATE muestreable con LOG_SAMPLE); los cierres siempre."""
+    signal, atr = sig['signal'], sig['atr']
+    if not closed_trade and not sampled(signal):
+        return
+    log_event('signal', '%s [%s] %s @ %.2f%s | 📊 Signals: %s | Trades: %s | P&L: %.2f pts',
+              SIGNAL_EMOJI.get(signal, '⚪'), sig['timestamp'][:19], signal, sig['price'],
+              f' [ATR:{atr:.1f}]' if atr else '',
+              totals['total_signals'], totals['total_trades'], totals['total_pnl'],
+              signal=signal, price=sig['price'], symbol=sig['symbol'], strategy=sig['strategy'],
+              timestamp=sig['timestamp'], atr=atr, total_signals=totals['total_signals'],
+              total_trades=totals['total_trades'], total_pnl=totals['total_pnl'],
+              **_sample_fields(signal))
+    if closed_trade:
+        log_trade(sig, closed_trade)
+
+
+def log_trade(sig, trade):
+    log_event('trade_closed', '   %s Closed %s (%s): %+.1f pts bruto → %+.1f pts neto (spread: -%.0f)',
+              '✅' if trade['pnl_net_points'] > 0 else '❌', trade['direction'], trade['exit_reason'],
+              trade['pnl_points'], trade['pnl_net_points'], trade['spread_cost'],
+              exit_time=sig['timestamp'], **{k: trade[k] for k in TRADE_LOG_FIELDS})
+
+
+def log_batch(sigs, outcomes, totals):
+    closed = sum(1 for _, closed_trade, _ in outcomes if closed_trade)
+    stale = sum(1 for _, _, skipped in outcomes if skipped)
+    if stale:
+        log_event('stale_ticks', '   ⏪ %d ticks older than their position skipped', stale,
+                  level=logging.WARNING, count=stale, first_timestamp=sigs[0]['timestamp'],
+                  last_timestamp=sigs[-1]['timestamp'])
+    if closed or sampled('batch'):
+        log_event('batch', '📦 [%s → %s] Batch: %d signals, %d closed | 📊 Signals: %s | Trades: %s | P&L: %.2f pts',
+                  sigs[0]['timestamp'][:19], sigs[-1]['timestamp'][:19], len(sigs), closed,
+                  totals['total_signals'], totals['total_trades'], totals['total_pnl'],
+                  count=len(sigs), first_timestamp=sigs[0]['timestamp'], last_timestamp=sigs[-1]['timestamp'],
+                  closed_trades=closed, total_signals=totals['total_signals'],
+                  total_trades=totals['total_trades'], total_pnl=totals['total_pnl'],
+                  **_sample_fields('batch'))
+    for sig, (_, closed_trade, _) in zip(sigs, outcomes):
+        if sig['signal'] in ('LONG', 'SHORT') and (closed_trade or sampled(sig['signal'])):
+            log_event('signal', '   %s [%s] %s @ %.2f', SIGNAL_EMOJI[sig['signal']], sig['timestamp'][:19],
+                      sig['signal'], sig['price'], signal=sig['signal'], price=sig['price'],
+                      symbol=sig['symbol'], strategy=sig['strategy'], timestamp=sig['timestamp'],
+                      batch=True, **_sample_fields(sig['signal']))
+        if closed_trade:
+            log_trade(sig, closed_trade)
 
 
 @app.route('/webhook', methods=['POST'])
@@ -445,6 +575,9 @@ def webhook():
     
     Auth: Accepts secret in JSON body (for TradingView compatibility)
     since TradingView webhooks can't send custom headers.
+
+    INGEST_MODE=async: the signal is journaled and 202 is returned right
+    away; the ingest applier thread writes it to the DB (see ingest_queue).
     """
     try:
         if request.is_json:
@@ -462,262 +595,570 @@ def webhook():
         if body_secret != WEBHOOK_SECRET:
             return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
         
-        signal = data.get('signal', 'UNKNOWN').upper()
-        price = float(data.get('price', 0))
-        symbol = data.get('symbol', 'USTEC')
-        timeframe = data.get('timeframe', '1m')
-        
-        # Datos de optimización (opcionales)
-        atr = float(data.get('atr', 0)) if data.get('atr') else None
-        tp1 = float(data.get('tp1', 0)) if data.get('tp1') else None
-        tp2 = float(data.get('tp2', 0)) if data.get('tp2') else None
-        sl = float(data.get('sl', 0)) if data.get('sl') else None
-        high = float(data.get('high', 0)) if data.get('high') else None
-        low = float(data.get('low', 0)) if data.get('low') else None
-        
-        timestamp = datetime.now(timezone.utc).isoformat()
-        
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Guardar señal
-        if USE_POSTGRES:
-            c.execute('''
-                INSERT INTO signals (timestamp, signal, price, symbol, timeframe,
-                                    atr, tp1, tp2, sl, high, low, raw_payload)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (timestamp, signal, price, symbol, timeframe,
-                  atr, tp1, tp2, sl, high, low, json.dumps(data)))
-        else:
-            c.execute('''
-                INSERT INTO signals (timestamp, signal, price, symbol, timeframe,
-                                    atr, tp1, tp2, sl, high, low, raw_payload)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (timestamp, signal, price, symbol, timeframe,
-                  atr, tp1, tp2, sl, high, low, json.dumps(data)))
-        conn.commit()
-        
-        # Procesar lógica de trading
-        pos = get_open_position(conn)
-        closed_trade = None
-
-        # Update max/min price on every signal (for trailing stop tracking)
-        if pos:
-            pos = update_position_extremes(conn, price)
-
-        if signal == 'PRICE_UPDATE':
-            # Price update only — check trailing stop, don't open/close on signal
-            if pos:
-                should_close, reason = check_trailing_stop(pos, price)
-                if should_close:
-                    closed_trade = close_position(conn, timestamp, price, reason)
-                    print(f"   TRAILING STOP triggered: {reason}")
-        elif signal in ['LONG', 'SHORT']:
-            if pos and pos['direction'] != signal:
-                closed_trade = close_position(conn, timestamp, price, 'signal')
-
-            if not pos or closed_trade:
-                set_open_position(conn, signal, timestamp, price, symbol,
-                                 atr, tp1, tp2, sl)
-
-        # Also check trailing stop on regular signals (before opening new position)
-        if signal in ['LONG', 'SHORT'] and not closed_trade:
-            pos = get_open_position(conn)
-            if pos:
-                should_close, reason = check_trailing_stop(pos, price)
-                if should_close:
-                    closed_trade = close_position(conn, timestamp, price, reason)
-        
-        # Stats
-        c.execute('SELECT COUNT(*) FROM signals')
-        total_signals = c.fetchone()[0]
-        c.execute('SELECT COUNT(*), COALESCE(SUM(pnl_points), 0) FROM trades')
-        trade_stats = c.fetchone()
+        sig = parse_signal(data)
         
-        conn.close()
-        
-        # Log
-        emoji = "🟢" if signal == "LONG" else "🔴" if signal == "SHORT" else "📡" if signal == "PRICE_UPDATE" else "⚪"
-        opt_info = f" [ATR:{atr:.1f}]" if atr else ""
-        print(f"\n{emoji} [{timestamp[:19]}] {signal} @ {price:.2f}{opt_info}")
+        if APPLIER:
+            try:
+                seq = INGEST.enqueue([sig])[0]
+            except QueueFull as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 429, {'Retry-After': '1'}
+            APPLIER.notify()
+            return jsonify({'status': 'queued', 'seq': seq,
+                            'signal': sig['signal'], 'price': sig['price']}), 202
         
-        if closed_trade:
-            pnl_emoji = "✅" if closed_trade['pnl_net_points'] > 0 else "❌"
-            print(f"   {pnl_emoji} Closed {closed_trade['direction']}: {closed_trade['pnl_points']:+.1f} pts bruto → {closed_trade['pnl_net_points']:+.1f} pts neto (spread: -{closed_trade['spread_cost']:.0f})")
+        # Una sola transacción: o se aplica todo o nada
+        with db_connection() as conn:
+            POSITION.ensure_loaded(conn)
+            with POSITION.locked([position_key(sig)], conn):
+                txn = POSITION.begin()
+                pos, closed_trade, totals = process_signal(conn, sig, txn)
+                with db_timer('commit'):
+                    conn.commit()
+                POSITION.commit(txn)
+                EVENTS.after_commit(txn.events)   # under the key lock: per-key order
         
-        print(f"   📊 Signals: {total_signals} | Trades: {trade_stats[0]} | P&L: {trade_stats[1] or 0:.2f} pts")
+        record_applied([sig], [closed_trade])
+        log_signal(sig, closed_trade, totals)
         
         return jsonify({
             'status': 'ok',
-            'signal': signal,
-            'price': price,
-            'optimization_data': {'atr': atr, 'tp1': tp1, 'tp2': tp2, 'sl': sl},
+            'signal': sig['signal'],
+            'price': sig['price'],
+            'optimization_data': {'atr': sig['atr'], 'tp1': sig['tp1'], 'tp2': sig['tp2'], 'sl': sig['sl']},
             'closed_trade': closed_trade,
-            'total_signals': total_signals,
-            'total_trades': trade_stats[0],
-            'total_pnl': float(trade_stats[1] or 0)
+            'total_signals': totals['total_signals'],
+            'total_trades': totals['total_trades'],
+            'total_pnl': totals['total_pnl']
         }), 200
         
     except Exception as e:
-        print(f"❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
+        log_event('error', '❌ Error: %s', e, level=logging.ERROR, exc_info=True, route=request.path)
         return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
 
+def parse_tick_timestamp(value):
+    """ISO-8601 string or epoch seconds -> UTC isoformat (None if missing)."""
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).isoformat()
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+BATCH_MAX_TICKS = int(os.environ.get('BATCH_MAX_TICKS', 5000))
+
+
+@app.route('/webhook/batch', methods=['POST'])
+def webhook_batch():
+    """Recibir una lista ordenada de ticks/señales en un solo request.
+
+    Body: {"secret": ..., "symbol": "USTEC", "ticks": [{"signal": "PRICE_UPDATE",
+    "price": 21500.5, "timestamp": "2026-02-10T14:00:01+00:00"}, ...]}
+    (a bare JSON array of ticks is accepted too, each carrying "secret").
+    Envelope fields (symbol, strategy, timeframe, sent_at) are defaults for every tick; ticks
+    without a timestamp get the receive time. All ticks are stored with one
+    multi-row insert and replayed in list order in one transaction.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if isinstance(data, list):
+            ticks, envelope = data, (data[0] if data and isinstance(data[0], dict) else {})
+        elif isinstance(data, dict):
+            ticks, envelope = data.get('ticks'), data
+        else:
+            return jsonify({'status': 'error', 'message': 'JSON body required'}), 400
+
+        if not WEBHOOK_SECRET:
+            return jsonify({'status': 'error', 'message': 'WEBHOOK_SECRET not configured on server'}), 500
+        if envelope.get('secret', '') != WEBHOOK_SECRET:
+            return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+
+        if not isinstance(ticks, list) or not ticks:
+            return jsonify({'status': 'error', 'message': 'ticks must be a non-empty list'}), 400
+        if len(ticks) > BATCH_MAX_TICKS:
+            return jsonify({'status': 'error', 'message': f'max {BATCH_MAX_TICKS} ticks per batch'}), 413
+
+        received_at = datetime.now(timezone.utc).isoformat()
+        defaults = {k: envelope[k] for k in ('symbol', 'strategy', 'timeframe', 'sent_at') if k in envelope}
+        try:
+            sigs = []
+            for tick in ticks:
+                tick = {k: v for k, v in tick.items() if k != 'secret'}
+                sigs.append(parse_signal({**defaults, **tick},
+                                         parse_tick_timestamp(tick.get('timestamp')) or received_at))
+        except (TypeError, ValueError, AttributeError) as e:
+            return jsonify({'status': 'error', 'message': f'invalid tick: {e}'}), 400
+
+        if APPLIER:
+            try:
+                seqs = INGEST.enqueue(sigs)
+            except QueueFull as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 429, {'Retry-After': '1'}
+            APPLIER.notify()
+            return jsonify({'status': 'queued', 'count': len(seqs),
+                            'first_seq': seqs[0], 'last_seq': seqs[-1]}), 202
+
+        with db_connection() as conn:
+            POSITION.ensure_loaded(conn)
+            with POSITION.locked(map(position_key, sigs), conn):
+                txn = POSITION.begin()
+                outcomes, totals = process_batch(conn, sigs, txn)
+                with db_timer('commit'):
+                    conn.commit()
+                POSITION.commit(txn)
+                EVENTS.after_commit(txn.events)   # under the key lock: per-key order
+
+        record_applied(sigs, [closed_trade for _, closed_trade, _ in outcomes])
+        log_batch(sigs, outcomes, totals)
+
+        return jsonify({
+            'status': 'ok',
+            'count': len(sigs),
+            'outcomes': [{
+                'index': i,
+                'timestamp': sig['timestamp'],
+                'signal': sig['signal'],
+                'price': sig['price'],
+                'symbol': sig['symbol'],
+                'strategy': sig['strategy'],
+                'position': pos['direction'] if pos else None,
+                'closed_trade': closed_trade,
+                'stale': stale,
+            } for i, (sig, (pos, closed_trade, stale)) in enumerate(zip(sigs, outcomes))],
+            'closed_trades': sum(1 for _, closed_trade, _ in outcomes if closed_trade),
+            'stale_ticks': sum(1 for _, _, stale in outcomes if stale),
+            'total_signals': totals['total_signals'],
+            'total_trades': totals['total_trades'],
+            'total_pnl': totals['total_pnl']
+        }), 200
+
+    except Exception as e:
+        log_event('error', '❌ Error: %s', e, level=logging.ERROR, exc_info=True, route=request.path)
+        return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
+
+
+# ============================================================
+# ASYNC INGEST (INGEST_MODE=async)
+# ============================================================
+def apply_queued(items, last_seq):
+    """Apply journaled signals in one transaction, advancing ingest_cursor."""
+    sigs = [sig for _, _, sig in items]
+    for sig in sigs:
+        sig.setdefault('strategy', DEFAULT_STRATEGY)   # journaled before strategies existed
+    with db_connection() as conn:
+        POSITION.ensure_loaded(conn)
+        with POSITION.locked(map(position_key, sigs), conn):
+            sync_runtime_config(conn)
+            txn = POSITION.begin()
+            outcomes, totals = process_batch(conn, sigs, txn)
+            write_cursor(conn, last_seq)
+            with db_timer('commit'):
+                conn.commit()
+            POSITION.commit(txn)
+            EVENTS.after_commit(txn.events)
+    record_applied(sigs, [closed_trade for _, closed_trade, _ in outcomes])
+    if len(sigs) == 1:
+        log_signal(sigs[0], outcomes[0][1], totals)
+    else:
+        log_batch(sigs, outcomes, totals)
+
+
+def read_applied_seq():
+    with db_connection() as conn:
+        return read_cursor(conn)
+
+
+def mark_applied_seq(seq):
+    with db_connection() as conn:
+        write_cursor(conn, seq)
+        conn.commit()
+
+
+@app.route('/ingest/status', methods=['GET'])
+def ingest_status():
+    """Queue depth and ingest lag (seconds the oldest queued signal has waited)."""
+    if not APPLIER:
+        return jsonify({'mode': INGEST_CONFIG['mode']})
+    return jsonify(APPLIER.status())
+
+
+@app.before_request
+def start_background_workers():
+    # Threads don't survive fork: (re)start them in each gunicorn worker
+    if APPLIER:
+        APPLIER.start()
+    RETENTION.start()
+    if EVENT_LISTENER:
+        EVENT_LISTENER.start()
+    METRICS.start()
+
+
+@app.before_request
+def load_shared_config():
+    # POSITION_MODE=shared: /spread and /trailing-stop may have been changed in another worker
+    if POSITION.shared:
+        with db_connection() as conn:
+            sync_runtime_config(conn)
+
+
+def sync_runtime_config(conn):
+    """Shared mode: adopt the spread / trailing-stop settings stored by any worker."""
+    if not POSITION.shared:
+        return
+    stored = load_config(conn)
+    if 'trailing_stop' in stored:
+        TRAILING_STOP_CONFIG.update(stored['trailing_stop'])
+    for symbol, cfg in stored.get('spread', {}).items():
+        SPREAD_CONFIG.setdefault(symbol, {}).update(cfg)
+
+
+@app.after_request
+def compress(response):
+    # gzip/deflate for anything big enough (cached GETs arrive already compressed)
+    return compress_response(response, request.accept_encodings)
+
+
+# ============================================================
+# CONDITIONAL GET: ETag = data_version, cached bodies per version
+# ============================================================
+RESPONSE_CACHE = ResponseCache()
+
+
+def current_data_version():
+    with db_connection() as conn:
+        return read_version(conn)
+
+
+cached_by_version = conditional_get(RESPONSE_CACHE, current_data_version)
+
+
+# ============================================================
+# LISTADOS: keyset pagination + NDJSON streaming
+# ============================================================
+PAGE_MAX = 10000          # max rows per JSON page (also the default, as before)
+STREAM_FETCH_SIZE = 2000  # rows per round trip of the server-side cursor
+
+SIGNAL_COLUMNS = ['id', 'timestamp', 'signal', 'price', 'symbol', 'strategy', 'timeframe',
+                  'atr', 'tp1', 'tp2', 'sl', 'high', 'low']
+TRADE_COLUMNS = ['id', 'symbol', 'direction', 'entry_time', 'entry_price',
+                 'entry_atr', 'entry_tp1', 'entry_tp2', 'entry_sl',
+                 'exit_time', 'exit_price', 'exit_reason',
+                 'pnl_points', 'pnl_percent',
+                 'spread_cost', 'pnl_net_points', 'pnl_net_percent',
+                 'duration_seconds', 'max_price', 'min_price', 'strategy']
+
+
+def encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    sort_value, row_id = json.loads(raw)
+    return sort_value, int(row_id)
+
+
+def keyset_query(table, columns, sort_col, after, limit):
+    """Newest first by (sort_col, id). `after` resumes below the cursor row;
+    the leading `sort_col <= ?` keeps the scan on the sort_col index."""
+    sql = f'SELECT {", ".join(columns)} FROM {table}'
+    params = []
+    if after:
+        sort_value, row_id = after
+        sort_value = to_db(sort_value)
+        sql += f' WHERE {sort_col} <= ? AND ({sort_col} < ? OR id < ?)'
+        params += [sort_value, sort_value, row_id]
+    sql += f' ORDER BY {sort_col} DESC, id DESC'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return q(sql), params
+
+
+def list_rows(table, names, sort_col):
+    """GET handler body shared by /signals and /trades.
+
+    ?limit=N&after=<cursor>: keyset page; the body stays a JSON array and the
+    next page is advertised in X-Next-Cursor / Link headers.
+    ?format=columns: same page as {"count", "columns": {field: [values]}}.
+    ?format=ndjson (or Accept: application/x-ndjson): one JSON object per line
+    streamed from a server-side cursor; no row limit unless ?limit is given.
+    """
+    fmt = request.args.get('format')
+    stream = (fmt == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    try:
+        limit = request.args.get('limit', type=int)
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except (ValueError, TypeError):
+        return jsonify({'status': 'error', 'message': 'invalid after cursor'}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({'status': 'error', 'message': 'limit must be positive'}), 400
+    if not stream:
+        limit = min(limit or PAGE_MAX, PAGE_MAX)
+
+    sql, params = keyset_query(table, names, sort_col, after, limit)
+    sort_idx = names.index(sort_col)
+    times = time_indexes(names, table)
+
+    if stream:
+        def generate():
+            with db_connection() as conn:
+                if USE_POSTGRES:
+                    # Named cursor = server-side: rows arrive STREAM_FETCH_SIZE at a time
+                    c = conn.cursor(name=f'{table}_stream')
+                    c.itersize = STREAM_FETCH_SIZE
+                else:
+                    c = conn.cursor()
+                    c.arraysize = STREAM_FETCH_SIZE
+                c.execute(sql, params)
+                for r in c:
+                    yield dumps(dict(zip(names, rows_from_db([r], times)[0]))) + b'\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        rows = rows_from_db(c.fetchall(), times)
+
+    if fmt == 'columns':
+        response = jsonify(columns(names, rows))
+    else:
+        response = jsonify([dict(zip(names, r)) for r in rows])
+    if len(rows) == limit:
+        last = rows[-1]
+        cursor = encode_cursor(last[sort_idx], last[0])
+        extra = f'&format={fmt}' if fmt == 'columns' else ''
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Link'] = f'<{request.path}?limit={limit}&after={cursor}{extra}>; rel="next"'
+    return response
+
+
 @app.route('/signals', methods=['GET'])
 @require_auth
+@cached_by_version
 def get_signals():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''SELECT id, timestamp, signal, price, symbol, timeframe, 
-                        atr, tp1, tp2, sl, high, low
-                 FROM signals ORDER BY timestamp DESC LIMIT 10000''')
-    rows = c.fetchall()
-    conn.close()
-    
-    return jsonify([{
-        'id': r[0], 'timestamp': r[1], 'signal': r[2], 'price': r[3],
-        'symbol': r[4], 'timeframe': r[5], 'atr': r[6], 'tp1': r[7],
-        'tp2': r[8], 'sl': r[9], 'high': r[10], 'low': r[11]
-    } for r in rows])
+    return list_rows('signals', SIGNAL_COLUMNS, 'timestamp')
 
 
 @app.route('/trades', methods=['GET'])
 @require_auth
+@cached_by_version
 def get_trades():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''SELECT id, symbol, direction, entry_time, entry_price,
-                        entry_atr, entry_tp1, entry_tp2, entry_sl,
-                        exit_time, exit_price, exit_reason,
-                        pnl_points, pnl_percent, 
-                        spread_cost, pnl_net_points, pnl_net_percent,
-                        duration_seconds, max_price, min_price
-                 FROM trades ORDER BY exit_time DESC LIMIT 10000''')
-    rows = c.fetchall()
-    conn.close()
-    
-    return jsonify([{
-        'id': r[0], 'symbol': r[1], 'direction': r[2],
-        'entry_time': r[3], 'entry_price': r[4],
-        'entry_atr': r[5], 'entry_tp1': r[6], 'entry_tp2': r[7], 'entry_sl': r[8],
-        'exit_time': r[9], 'exit_price': r[10], 'exit_reason': r[11],
-        'pnl_points': r[12], 'pnl_percent': r[13],
-        'spread_cost': r[14], 'pnl_net_points': r[15], 'pnl_net_percent': r[16],
-        'duration_seconds': r[17], 'max_price': r[18], 'min_price': r[19]
-    } for r in rows])
+    return list_rows('trades', TRADE_COLUMNS, 'exit_time')
+
+
+BARS_MAX = 10000
+
+
+def parse_time_arg(name):
+    """Query arg as ISO-8601 or epoch seconds -> UTC isoformat (None if absent)."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    return parse_tick_timestamp(value)
+
+
+@app.route('/bars', methods=['GET'])
+@require_auth
+@cached_by_version
+def get_bars():
+    """OHLC bars, oldest first: ?symbol=USTEC&resolution=1m&start=&end=&limit=
+
+    start/end: ISO-8601 or epoch seconds (end exclusive). When the page is
+    full, X-Next-Cursor holds the `start` of the next page.
+    """
+    symbol = request.args.get('symbol', 'USTEC')
+    resolution = request.args.get('resolution', '1m')
+    if resolution not in OHLC_RESOLUTIONS:
+        return jsonify({'status': 'error', 'message': f'resolution must be one of {OHLC_RESOLUTIONS}'}), 400
+    try:
+        start = parse_time_arg('start')
+        end = parse_time_arg('end')
+        limit = min(request.args.get('limit', BARS_MAX, type=int), BARS_MAX)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if limit <= 0:
+        return jsonify({'status': 'error', 'message': 'limit must be positive'}), 400
+
+    with db_connection() as conn:
+        rows = read_bars(conn, symbol, resolution, start, end, limit + 1)
+    next_start = rows[limit][0] if len(rows) > limit else None
+    rows = rows[:limit]
+    if request.args.get('format') == 'columns':
+        response = jsonify(columns(BAR_QUERY_FIELDS, rows))
+    else:
+        response = jsonify([dict(zip(BAR_QUERY_FIELDS, r)) for r in rows])
+    if next_start:
+        args = dict(request.args, start=next_start)
+        response.headers['X-Next-Cursor'] = next_start
+        response.headers['Link'] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return response
 
 
 @app.route('/stats', methods=['GET'])
+@cached_by_version
 def get_stats():
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    c.execute('SELECT COUNT(*) FROM signals')
-    total_signals = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM signals WHERE signal = 'LONG'")
-    longs = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM signals WHERE signal = 'SHORT'")
-    shorts = c.fetchone()[0]
-    
-    # Stats con P&L bruto
-    c.execute('''
-        SELECT COUNT(*), 
-               COALESCE(SUM(pnl_points), 0), 
-               COALESCE(AVG(pnl_points), 0),
-               COALESCE(SUM(CASE WHEN pnl_points > 0 THEN 1 ELSE 0 END), 0),
-               COALESCE(MAX(pnl_points), 0),
-               COALESCE(MIN(pnl_points), 0)
-        FROM trades
-    ''')
-    t = c.fetchone()
+    # Snapshot mantenido incrementalmente (stats_summary) + posición en memoria.
+    # ?symbol=&strategy= (uno o ambos): solo esa clave, desde stats_by_key
+    symbol, strategy = request.args.get('symbol'), request.args.get('strategy')
+    with db_connection() as conn:
+        s = read_summary(conn, symbol, strategy)
+        POSITION.refresh(conn)
+    pos = POSITION.snapshot((symbol or DEFAULT_SYMBOL, strategy or DEFAULT_STRATEGY))
     
-    # Stats con P&L neto (después de spread)
-    c.execute('''
-        SELECT COALESCE(SUM(pnl_net_points), 0),
-               COALESCE(AVG(pnl_net_points), 0),
-               COALESCE(SUM(CASE WHEN pnl_net_points > 0 THEN 1 ELSE 0 END), 0),
-               COALESCE(MAX(pnl_net_points), 0),
-               COALESCE(MIN(pnl_net_points), 0),
-               COALESCE(SUM(spread_cost), 0)
-        FROM trades
-    ''')
-    net = c.fetchone()
-    
-    pos = get_open_position(conn)
-    conn.close()
-    
-    total_trades = t[0] or 0
-    win_rate_gross = (t[3] / total_trades * 100) if total_trades > 0 else 0
-    win_rate_net = (net[2] / total_trades * 100) if total_trades > 0 else 0
+    total_trades = s['total_trades'] or 0
+    win_rate_gross = (s['gross_winners'] / total_trades * 100) if total_trades > 0 else 0
+    win_rate_net = (s['net_winners'] / total_trades * 100) if total_trades > 0 else 0
+    avg_gross = s['total_pnl'] / total_trades if total_trades > 0 else 0
+    avg_net = s['net_pnl'] / total_trades if total_trades > 0 else 0
     
     # Spread config para mostrar
-    spread_info = SPREAD_CONFIG.get('USTEC', {})
+    spread_symbol = symbol if symbol in SPREAD_CONFIG else DEFAULT_SYMBOL
+    spread_info = SPREAD_CONFIG.get(spread_symbol, {})
     
     return jsonify({
-        'signals': {'total': total_signals, 'longs': longs, 'shorts': shorts},
+        'signals': {'total': s['total_signals'], 'longs': s['long_signals'], 'shorts': s['short_signals']},
         'trades': {
             'total': total_trades,
             # P&L Bruto (sin spread)
             'gross': {
-                'total_pnl': round(float(t[1] or 0), 2),
-                'avg_pnl': round(float(t[2] or 0), 2),
-                'winners': int(t[3] or 0),
+                'total_pnl': round(float(s['total_pnl'] or 0), 2),
+                'avg_pnl': round(float(avg_gross), 2),
+                'winners': int(s['gross_winners'] or 0),
                 'win_rate': round(win_rate_gross, 1),
-                'best_trade': round(float(t[4] or 0), 2),
-                'worst_trade': round(float(t[5] or 0), 2)
+                'best_trade': round(float(s['gross_best'] or 0), 2),
+                'worst_trade': round(float(s['gross_worst'] or 0), 2)
             },
             # P&L Neto (con spread)
             'net': {
-                'total_pnl': round(float(net[0] or 0), 2),
-                'avg_pnl': round(float(net[1] or 0), 2),
-                'winners': int(net[2] or 0),
+                'total_pnl': round(float(s['net_pnl'] or 0), 2),
+                'avg_pnl': round(float(avg_net), 2),
+                'winners': int(s['net_winners'] or 0),
                 'win_rate': round(win_rate_net, 1),
-                'best_trade': round(float(net[3] or 0), 2),
-                'worst_trade': round(float(net[4] or 0), 2),
-                'total_spread_cost': round(float(net[5] or 0), 2)
+                'best_trade': round(float(s['net_best'] or 0), 2),
+                'worst_trade': round(float(s['net_worst'] or 0), 2),
+                'total_spread_cost': round(float(s['spread_total'] or 0), 2)
             },
             # Legacy (mantener compatibilidad) - usa bruto
-            'winners': int(t[3] or 0),
+            'winners': int(s['gross_winners'] or 0),
             'win_rate': round(win_rate_gross, 1),
-            'total_pnl': round(float(t[1] or 0), 2),
-            'avg_pnl': round(float(t[2] or 0), 2),
-            'best_trade': round(float(t[4] or 0), 2),
-            'worst_trade': round(float(t[5] or 0), 2)
+            'total_pnl': round(float(s['total_pnl'] or 0), 2),
+            'avg_pnl': round(float(avg_gross), 2),
+            'best_trade': round(float(s['gross_best'] or 0), 2),
+            'worst_trade': round(float(s['gross_worst'] or 0), 2)
         },
         'spread_config': {
-            'symbol': 'USTEC',
+            'symbol': spread_symbol,
             'spread_points': spread_info.get('spread_points', 90),
             'source': spread_info.get('source', 'SpreadMonitor EA'),
             'last_updated': spread_info.get('last_updated', 'N/A')
         },
-        'open_position': pos
+        'open_position': pos,
+        'open_positions': POSITION.positions(symbol, strategy)
     })
 
 
 @app.route('/position', methods=['GET'])
 @require_auth
+@cached_by_version
 def get_position():
-    conn = get_db_connection()
-    pos = get_open_position(conn)
-    conn.close()
+    """Open position of ?symbol=&strategy= (default USTEC / default)."""
+    key = (request.args.get('symbol') or DEFAULT_SYMBOL, request.args.get('strategy') or DEFAULT_STRATEGY)
+    with db_connection() as conn:
+        POSITION.refresh(conn)
+    pos = POSITION.snapshot(key)
     return jsonify(pos or {'status': 'no open position'})
 
 
+@app.route('/positions', methods=['GET'])
+@require_auth
+@cached_by_version
+def get_positions():
+    """Every open position, optionally filtered by ?symbol= and/or ?strategy=."""
+    with db_connection() as conn:
+        POSITION.refresh(conn)
+    return jsonify(POSITION.positions(request.args.get('symbol'), request.args.get('strategy')))
+
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events: signals, opened positions, extremes, closed trades
+    and config changes as they are committed (see event_stream).
+
+    Filters: ?types=signal,trade_closed  ?symbol=  ?strategy=. Resume with
+    the Last-Event-ID header (EventSource sends it on reconnect) or
+    ?last_event_id=. Without a resumable id the stream starts with a
+    `snapshot` event holding the open positions.
+    Auth: X-Webhook-Secret header, or ?secret= (EventSource can't send headers).
+    """
+    if not WEBHOOK_SECRET:
+        return jsonify({'status': 'error', 'message': 'WEBHOOK_SECRET not configured on server'}), 500
+    token = request.headers.get('X-Webhook-Secret') or request.args.get('secret', '')
+    if token != WEBHOOK_SECRET:
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+
+    types = [t for t in request.args.get('types', '').split(',') if t]
+    unknown = set(types) - set(EVENT_TYPES)
+    if unknown:
+        return jsonify({'status': 'error', 'message': f'unknown event types: {sorted(unknown)}',
+                        'types': list(EVENT_TYPES)}), 400
+    symbol, strategy = request.args.get('symbol'), request.args.get('strategy')
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+    try:
+        sub, replay, current_id = EVENTS.subscribe(last_id, types=types, symbol=symbol, strategy=strategy)
+    except TooManySubscribers as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503, {'Retry-After': '5'}
+    if replay is None:
+        # Subscribed first: events committed meanwhile are queued, none is lost
+        # (the snapshot may already include the first ones)
+        try:
+            with db_connection() as conn:
+                POSITION.refresh(conn)
+        except Exception:
+            EVENTS.unsubscribe(sub)
+            raise
+        replay = [encode_frame('snapshot', {'positions': POSITION.positions(symbol, strategy)}, current_id)]
+
+    return Response(stream_frames(EVENTS, sub, replay, STREAM_CONFIG['heartbeat']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/reset', methods=['POST'])
 @require_auth
 def reset_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('DELETE FROM signals')
-    c.execute('DELETE FROM trades')
-    c.execute('DELETE FROM open_position')
-    conn.commit()
-    conn.close()
+    events = [('reset', {})]
+    with db_connection() as conn, POSITION.locked(None, conn):
+        c = conn.cursor()
+        c.execute('DELETE FROM signals')
+        c.execute('DELETE FROM trades')
+        c.execute('DELETE FROM open_positions')
+        c.execute('DELETE FROM ohlc_bars')
+        clear_compacted(conn)
+        rebuild_summary(conn)
+        EVENTS.before_commit(conn, events)
+        conn.commit()
+        POSITION.reset()
+        EVENTS.after_commit(events)
     return jsonify({'status': 'ok', 'message': 'All data reset'})
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text format, all gunicorn workers added up (see metrics.py)."""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/health', methods=['GET'])
 def health():
     db_type = "PostgreSQL" if USE_POSTGRES else "SQLite"
@@ -729,7 +1170,14 @@ def health():
         'version': 'v5',
         'spread_config': {
             'USTEC': spread_info.get('spread_points', 90)
-        }
+        },
+        'position_mode': 'shared' if POSITION.shared else 'local',
+        'db_pool': pool_stats(),
+        'response_cache': RESPONSE_CACHE.stats(),
+        'ingest': APPLIER.status() if APPLIER else {'mode': INGEST_CONFIG['mode']},
+        'retention': RETENTION.status(),
+        'logging': log_status(),
+        'stream': {**EVENTS.stats(), **({'listener_connected': EVENT_LISTENER.connected} if EVENT_LISTENER else {})}
     })
 
 
@@ -757,6 +1205,16 @@ def spread_config():
                 SPREAD_CONFIG[symbol] = {}
             SPREAD_CONFIG[symbol]['spread_points'] = float(spread)
             SPREAD_CONFIG[symbol]['last_updated'] = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+            # /stats shows the spread config: invalidate cached responses
+            events = [('config', {'spread': {symbol: SPREAD_CONFIG[symbol]}})]
+            with db_connection() as conn:
+                sync_spreads(conn, {symbol: float(spread)})
+                if POSITION.shared:
+                    save_config(conn, 'spread', SPREAD_CONFIG)
+                bump_version(conn)
+                EVENTS.before_commit(conn, events)
+                conn.commit()
+            EVENTS.after_commit(events)
             
             return jsonify({
                 'status': 'ok',
@@ -792,9 +1250,18 @@ def trailing_stop_config():
             TRAILING_STOP_CONFIG['activation_points'] = float(data['activation_points'])
         if 'fixed_sl_points' in data:
             TRAILING_STOP_CONFIG['fixed_sl_points'] = float(data['fixed_sl_points'])
+        events = [('config', {'trailing_stop': dict(TRAILING_STOP_CONFIG)})]
+        if POSITION.shared:
+            with db_connection() as conn:
+                save_config(conn, 'trailing_stop', TRAILING_STOP_CONFIG)
+                EVENTS.before_commit(conn, events)
+                conn.commit()
+        EVENTS.after_commit(events)
 
         status = "ENABLED" if TRAILING_STOP_CONFIG['enabled'] else "DISABLED"
-        print(f"   Trailing stop config updated: {status} | trail={TRAILING_STOP_CONFIG['trail_points']} activ={TRAILING_STOP_CONFIG['activation_points']} sl={TRAILING_STOP_CONFIG['fixed_sl_points']}")
+        log_event('config', '   Trailing stop config updated: %s | trail=%s activ=%s sl=%s', status,
+                  TRAILING_STOP_CONFIG['trail_points'], TRAILING_STOP_CONFIG['activation_points'],
+                  TRAILING_STOP_CONFIG['fixed_sl_points'], trailing_stop=dict(TRAILING_STOP_CONFIG))
 
         return jsonify({
             'status': 'ok',
@@ -805,52 +1272,166 @@ def trailing_stop_config():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+def current_spreads():
+    """{symbol: spread_points} from SPREAD_CONFIG (what /recalculate applies)."""
+    return {sym: cfg['spread_points'] for sym, cfg in SPREAD_CONFIG.items() if 'spread_points' in cfg}
+
+
 @app.route('/recalculate', methods=['POST'])
 @require_auth
 def recalculate_pnl():
-    """Recalcular P&L neto de todos los trades con el spread actual."""
+    """Recalcular P&L neto de todos los trades con el spread actual.
+
+    Body (optional JSON): dry_run, chunk_size, background (202 + job),
+    job_id (resume an interrupted job).
+    """
+    opts = request.get_json(silent=True) or {}
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        
-        # Obtener todos los trades
-        c.execute('SELECT id, symbol, pnl_points, entry_price FROM trades')
-        rows = c.fetchall()
-        
-        updated = 0
-        for row in rows:
-            trade_id, symbol, pnl_points, entry_price = row
-            if pnl_points is None:
-                continue
-                
-            spread = get_spread_for_symbol(symbol or 'USTEC')
-            pnl_net = pnl_points - spread
-            pnl_net_pct = (pnl_net / entry_price * 100) if entry_price else 0
-            
-            if USE_POSTGRES:
-                c.execute('''
-                    UPDATE trades 
-                    SET spread_cost = %s, pnl_net_points = %s, pnl_net_percent = %s
-                    WHERE id = %s
-                ''', (spread, pnl_net, pnl_net_pct, trade_id))
+        if opts.get('dry_run'):
+            with db_connection() as conn:
+                return jsonify(preview_totals(conn, current_spreads(), get_spread_for_symbol('USTEC')))
+
+        with db_connection() as conn:
+            if opts.get('job_id') is not None:
+                job = read_job(conn, int(opts['job_id']))
+                if job is None:
+                    return jsonify({'status': 'error', 'message': f"job {opts['job_id']} not found"}), 404
             else:
-                c.execute('''
-                    UPDATE trades 
-                    SET spread_cost = ?, pnl_net_points = ?, pnl_net_percent = ?
-                    WHERE id = ?
-                ''', (spread, pnl_net, pnl_net_pct, trade_id))
-            updated += 1
-        
-        conn.commit()
-        conn.close()
-        
+                job = create_job(conn, current_spreads(), get_spread_for_symbol('USTEC'),
+                                 int(opts.get('chunk_size') or RECALC_CHUNK_SIZE))
+        if is_running_here(job['id']):
+            return jsonify({'status': 'error', 'message': f"job {job['id']} is already running"}), 409
+
+        if opts.get('background'):
+            threading.Thread(target=run_recalc_job, args=(job['id'],),
+                             name=f"recalc-{job['id']}", daemon=True).start()
+            response = jsonify({'status': 'accepted', 'job': job})
+            response.headers['Location'] = f"/recalculate/jobs/{job['id']}"
+            return response, 202
+
+        job = run_job(db_connection, job['id'])
         spread_used = get_spread_for_symbol('USTEC')
         return jsonify({
             'status': 'ok',
-            'trades_updated': updated,
+            'trades_updated': job['trades_updated'],
             'spread_used': spread_used,
-            'message': f'Recalculated {updated} trades with spread {spread_used} pts'
+            'job_id': job['id'],
+            'chunks': job['chunks'],
+            'message': f"Recalculated {job['trades_updated']} trades with spread {spread_used} pts"
         })
+    except JobBusy as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+def run_recalc_job(job_id):
+    try:
+        job = run_job(db_connection, job_id)
+        log_event('recalc_job', '✅ Recalc job %s: %s trades in %s chunks', job_id, job['trades_updated'],
+                  job['chunks'], job_id=job_id, trades_updated=job['trades_updated'], chunks=job['chunks'])
+    except Exception as e:
+        log_event('recalc_job', '❌ Recalc job %s failed (resume with job_id): %s', job_id, e,
+                  level=logging.ERROR, exc_info=True, job_id=job_id)
+
+
+@app.route('/recalculate/jobs', methods=['GET'])
+@require_auth
+def recalc_jobs():
+    with db_connection() as conn:
+        jobs = list_jobs(conn)
+    for job in jobs:
+        job['running_here'] = is_running_here(job['id'])
+    return jsonify(jobs)
+
+
+@app.route('/recalculate/jobs/<int:job_id>', methods=['GET'])
+@require_auth
+def recalc_job_status(job_id):
+    with db_connection() as conn:
+        job = read_job(conn, job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'job {job_id} not found'}), 404
+    job['running_here'] = is_running_here(job_id)
+    return jsonify(job)
+
+
+@app.cli.command('repair-stats')
+def repair_stats_command():
+    """Rebuild stats_summary from signals/trades (flask --app webhook_server repair-stats)."""
+    with db_connection() as conn:
+        before = read_summary(conn)
+        after = rebuild_summary(conn)
+        conn.commit()
+    for key in after:
+        mark = '' if before[key] == after[key] else '  <- repaired'
+        print(f"  {key:<15} {before[key]!s:>14} -> {after[key]!s:<14}{mark}")
+
+
+@app.cli.command('compact')
+@click.option('--dry-run', is_flag=True, help='Only count what the policies would touch.')
+@click.option('--vacuum', is_flag=True, help='SQLite: switch to auto_vacuum=INCREMENTAL (full VACUUM, locks the DB).')
+def compact_command(dry_run, vacuum):
+    """Run one retention pass now (flask --app webhook_server compact)."""
+    with db_connection() as conn:
+        if vacuum and enable_incremental_vacuum(conn):
+            print("  auto_vacuum=INCREMENTAL enabled (database vacuumed)")
+        if dry_run:
+            print(f"  {pending(conn) or 'retention disabled (RETENTION_TICK_DAYS / RETENTION_PAYLOAD_DAYS)'}")
+            return
+        report = run_retention(conn)
+    for key, value in report.items():
+        print(f"  {key:<18} {value}")
+
+
+@app.cli.command('backfill-bars')
+@click.option('--chunk', type=int, default=None, help='Signal ids per transaction.')
+def backfill_bars_command(chunk):
+    """Build ohlc_bars for history older than the bars (resumable)."""
+    total = 0
+    with db_connection() as conn:
+        while True:
+            done = backfill_chunk(conn, chunk) if chunk else backfill_chunk(conn)
+            if done is None:
+                break
+            lo, merged = done
+            total += merged
+            print(f"  ids >= {lo}: {total} signals merged")
+    print(f"  ohlc_bars cover all history ({total} signals merged)")
+
+
+@app.cli.command('ingest-redrive')
+@click.argument('seqs', nargs=-1, type=int)
+@click.option('--all', 'redrive_all', is_flag=True, help='Re-drive every dead-lettered signal.')
+def ingest_redrive_command(seqs, redrive_all):
+    """List dead-lettered signals, or queue them again (INGEST_MODE=async).
+    They keep their timestamp: one older than its key's open position is
+    stored but skipped (stale).
+
+    flask --app webhook_server ingest-redrive            # list
+    flask --app webhook_server ingest-redrive 812 813    # re-drive these seqs
+    """
+    queue = INGEST or IngestQueue(INGEST_CONFIG['path'], INGEST_CONFIG['max_depth'])
+    if not seqs and not redrive_all:
+        for seq, _, sig, error, failed_at in queue.dead_letters():
+            print(f"  {seq:>8}  {failed_at[:19]}  {sig.get('signal')} @ {sig.get('price')} "
+                  f"{sig.get('symbol')}/{sig.get('strategy')} [{sig.get('timestamp', '')[:19]}]  {error}")
+        return
+    moved = queue.redrive(None if redrive_all else set(seqs))
+    for old, new in moved:
+        print(f"  dead_letter {old} -> queue {new}")
+    print(f"  {len(moved)} re-driven; the applier picks them up after what is already queued")
+
+
+@app.route('/admin/rebuild-stats', methods=['POST'])
+@require_auth
+def rebuild_stats():
+    """Rebuild the stats snapshot from scratch (full scan of signals/trades)."""
+    try:
+        with db_connection() as conn:
+            summary = rebuild_summary(conn)
+            conn.commit()
+        return jsonify({'status': 'ok', 'summary': summary})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -865,10 +1446,11 @@ def index():
         <li><a href="/stats">📊 Estadísticas (Bruto vs Neto)</a></li>
         <li><a href="/trades">📈 Trades</a></li>
         <li><a href="/signals">📡 Señales</a></li>
-        <li><a href="/position">🎯 Posición</a></li>
+        <li><a href="/position">🎯 Posición</a> (<a href="/positions">todas</a>)</li>
+        <li><a href="/stream">⚡ Stream en vivo</a> (SSE)</li>
         <li><a href="/spread">💰 Config Spread</a></li>
         <li><a href="/trailing-stop">🎯 Trailing Stop Config</a></li>
-        <li><a href="/health">💚 Health</a></li>
+        <li><a href="/health">💚 Health</a> · <a href="/metrics">📈 Metrics</a></li>
     </ul>
     <p><small>POST /recalculate para recalcular P&L con nuevo spread</small></p>
     """
@@ -877,6 +1459,34 @@ def index():
 # Inicializar DB
 init_db()
 
+# Posición abierta en memoria (cargada en cada worker al primer uso)
+POSITION = PositionState(db_connection)
+atexit.register(POSITION.flush_now)
+
+# Eventos en vivo para /stream (pub/sub en memoria; NOTIFY entre workers en modo shared + PostgreSQL)
+EVENTS = EventBus(STREAM_CONFIG, notify=POSITION.shared and USE_POSTGRES)
+EVENT_LISTENER = NotifyListener(EVENTS, get_db_connection) if EVENTS.notify else None
+if EVENT_LISTENER:
+    EVENT_LISTENER.start()
+
+# Métricas: gauges del proceso + fichero por worker para /metrics
+METRICS.add_collector(runtime_samples)
+METRICS.start()
+
+# Cola de ingesta durable (solo INGEST_MODE=async)
+INGEST = APPLIER = None
+if INGEST_CONFIG['mode'] == 'async':
+    INGEST = IngestQueue(INGEST_CONFIG['path'], INGEST_CONFIG['max_depth'])
+    APPLIER = QueueApplier(INGEST, apply_queued, read_applied_seq, mark_applied_seq,
+                           batch_size=INGEST_CONFIG['batch_size'],
+                           poll_interval=INGEST_CONFIG['poll_interval'],
+                           retry_max=INGEST_CONFIG['retry_max'])
+    APPLIER.start()
+
+# Retención / compactación de ticks (no-op salvo RETENTION_TICK_DAYS / RETENTION_PAYLOAD_DAYS)
+RETENTION = RetentionWorker(db_connection, RETENTION_CONFIG)
+RETENTION.start()
+
 if __name__ == '__main__':
     spread = get_spread_for_symbol('USTEC')
     print(f"🎯 Bloop Tracker v5 - Con spread real ({spread} pts USTEC)")